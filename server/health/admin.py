@@ -3,7 +3,10 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import UserProfile, HealthData, Recommendation
+from .models import (
+    UserProfile, HealthData, Recommendation, BufferedHealthData, OutboxMessage,
+    recommendations_changed
+)
 
 
 @admin.register(UserProfile)
@@ -76,6 +79,26 @@ class HealthDataAdmin(admin.ModelAdmin):
     user_name.admin_order_field = 'user__profile__name'
 
 
+@admin.register(BufferedHealthData)
+class BufferedHealthDataAdmin(admin.ModelAdmin):
+    """Read-only view of the write-behind ingest buffer."""
+    
+    list_display = ['user', 'date', 'received_at']
+    list_filter = ['received_at']
+    search_fields = ['user__username']
+    readonly_fields = ['user', 'date', 'payload', 'received_at']
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    """Read-only view of Celery task messages waiting for the outbox relay."""
+    
+    list_display = ['task', 'available_at', 'attempts', 'created_at']
+    list_filter = ['task']
+    search_fields = ['dedupe_key']
+    readonly_fields = ['task', 'args', 'kwargs', 'dedupe_key', 'available_at', 'attempts', 'last_error', 'created_at']
+
+
 @admin.register(Recommendation)
 class RecommendationAdmin(admin.ModelAdmin):
     """Admin interface for Recommendation model."""
@@ -137,12 +160,14 @@ class RecommendationAdmin(admin.ModelAdmin):
     def mark_as_read(self, request, queryset):
         """Mark selected recommendations as read."""
         updated = queryset.update(is_read=True)
+        recommendations_changed(queryset.values_list('user_id', flat=True))
         self.message_user(request, f'{updated} recommendations marked as read.')
     mark_as_read.short_description = 'Mark selected recommendations as read'
     
     def mark_as_completed(self, request, queryset):
         """Mark selected recommendations as completed."""
         updated = queryset.update(is_completed=True)
+        recommendations_changed(queryset.values_list('user_id', flat=True))
         self.message_user(request, f'{updated} recommendations marked as completed.')
     mark_as_completed.short_description = 'Mark selected recommendations as completed'
     
@@ -151,6 +176,7 @@ class RecommendationAdmin(admin.ModelAdmin):
         from datetime import timedelta
         new_expiry = timezone.now() + timedelta(days=7)
         updated = queryset.update(expires_at=new_expiry)
+        recommendations_changed(queryset.values_list('user_id', flat=True))
         self.message_user(request, f'Extended expiration for {updated} recommendations by 7 days.')
     extend_expiration.short_description = 'Extend expiration by 7 days'
 
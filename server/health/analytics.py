@@ -0,0 +1,254 @@
+"""
+Personal-baseline anomaly detection over health history.
+
+A day is anomalous when one of its metrics is far from the user's own norm:
+its z-score against the mean and standard deviation of the user's preceding
+HEALTH_ANOMALY_WINDOW_DAYS days reaches HEALTH_ANOMALY_Z_THRESHOLD, e.g. "your
+sleep is 2σ below your 30-day norm". An EWMA (span HEALTH_ANOMALY_EWMA_SPAN)
+of the same history gives the recent trend shown alongside.
+
+Everything is computed on aligned series: each metric is a users × days
+matrix (NaN where a day has no value), so the rolling statistics of every user
+and day come from a handful of NumPy operations on prefix sums, and the EWMA
+from one vectorized step per day across all users.
+
+Detection is incremental: ``detect`` is given the HealthData rows being
+processed (e.g. today's ingest) and reads only the window preceding them, not
+the whole history. The EWMA over that window equals the one over the full
+history up to a weight of (1 - alpha) ** window on the days before it (about
+2e-4 for span 7 over 30 days). Given rows spanning a long period, e.g. a
+re-processed import, the same call evaluates every row against its own window.
+
+Anomalies become Recommendations fingerprinted per metric and direction, so
+they go through the rules' upsert and stale-removal path (see rules.py).
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .models import HealthData, Recommendation
+
+
+METRICS = ('steps', 'sleep_hours', 'heart_rate_avg', 'calories_burned')
+
+ANOMALY_VERSION = 'anomaly_v1.0'
+
+# Smallest standard deviation a baseline is given, so near-constant histories
+# do not turn trivial differences into large z-scores
+MIN_STD = {'steps': 500.0, 'sleep_hours': 0.25, 'heart_rate_avg': 2.0, 'calories_burned': 50.0}
+
+# Recommendations for anomalies, by metric and direction; the content is
+# formatted with value, mean, std, sigma (|z|), ewma and window
+ANOMALY_RULES = [
+    {
+        'metric': 'steps', 'direction': 'low',
+        'title': 'Less Active Than Usual',
+        'content': 'You walked {value:.0f} steps, {sigma:.1f}σ below your {window}-day norm of {mean:.0f} '
+                   '(recent trend {ewma:.0f}). A short walk can get you back on track.',
+        'type': 'exercise', 'priority': 'medium',
+    },
+    {
+        'metric': 'sleep_hours', 'direction': 'low',
+        'title': 'Less Sleep Than Usual',
+        'content': 'You slept {value:.1f} hours, {sigma:.1f}σ below your {window}-day norm of {mean:.1f} hours '
+                   '(recent trend {ewma:.1f}). Try to go to bed earlier tonight.',
+        'type': 'sleep', 'priority': 'high',
+    },
+    {
+        'metric': 'sleep_hours', 'direction': 'high',
+        'title': 'More Sleep Than Usual',
+        'content': 'You slept {value:.1f} hours, {sigma:.1f}σ above your {window}-day norm of {mean:.1f} hours. '
+                   'Oversleeping can be a sign of fatigue or illness.',
+        'type': 'sleep', 'priority': 'low',
+    },
+    {
+        'metric': 'heart_rate_avg', 'direction': 'high',
+        'title': 'Heart Rate Above Your Norm',
+        'content': 'Your average heart rate was {value:.0f} BPM, {sigma:.1f}σ above your {window}-day norm of '
+                   '{mean:.0f} BPM. Consider rest and stress management today.',
+        'type': 'mindfulness', 'priority': 'high',
+    },
+    {
+        'metric': 'calories_burned', 'direction': 'low',
+        'title': 'Fewer Calories Burned Than Usual',
+        'content': 'You burned {value:.0f} calories, {sigma:.1f}σ below your {window}-day norm of {mean:.0f}.',
+        'type': 'exercise', 'priority': 'low',
+    },
+]
+
+
+def source(rule):
+    """Generator name in the fingerprints of an anomaly rule's recommendations."""
+    return f"anomaly:{rule['metric']}:{rule['direction']}"
+
+
+def fingerprints(user_id, day):
+    """Fingerprints of every anomaly recommendation a user-day can have."""
+    return {
+        Recommendation.fingerprint_for(user_id, day, source(rule), rule['type'])
+        for rule in ANOMALY_RULES
+    }
+
+
+def align(rows, start, days):
+    """
+    Turn ``(user_id, date, *METRICS)`` rows into aligned series.
+
+    Returns ``(user_ids, series)``: the sorted user IDs, and per metric a float
+    matrix with one row per user and one column per day from ``start``.
+    """
+    user_ids = np.array(sorted({row[0] for row in rows}), dtype=np.int64)
+    series = {metric: np.full((len(user_ids), days), np.nan) for metric in METRICS}
+    if not rows:
+        return user_ids, series
+
+    user_index = np.searchsorted(user_ids, np.fromiter((row[0] for row in rows), np.int64, len(rows)))
+    day_index = np.fromiter((row[1].toordinal() for row in rows), np.int64, len(rows)) - start.toordinal()
+    for position, metric in enumerate(METRICS, start=2):
+        values = np.array([row[position] for row in rows], dtype=np.float64)  # None becomes NaN
+        series[metric][user_index, day_index] = values
+    return user_ids, series
+
+
+def rolling_baseline(values, window, min_days):
+    """
+    Mean and sample standard deviation of the ``window`` days before each day.
+
+    ``values`` is a users × days matrix with NaN for missing days. Days whose
+    window has fewer than ``min_days`` values get NaN.
+    """
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1, keepdims=True)
+    # Shifting each user's series by its mean keeps the sums of squares small
+    offset = np.divide(np.where(valid, values, 0.0).sum(axis=1, keepdims=True), counts,
+                       out=np.zeros_like(counts, dtype=np.float64), where=counts > 0)
+    shifted = np.where(valid, values - offset, 0.0)
+
+    def prefix(matrix):
+        # prefix(m)[:, t] is the sum over the days before t
+        return np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(matrix, axis=1)], axis=1)
+
+    count, total, squares = prefix(valid.astype(np.float64)), prefix(shifted), prefix(shifted * shifted)
+    end = np.arange(values.shape[1])
+    begin = np.maximum(end - window, 0)
+    n = count[:, end] - count[:, begin]
+    s = total[:, end] - total[:, begin]
+    q = squares[:, end] - squares[:, begin]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s / n
+        variance = np.maximum(q - s * mean, 0.0) / (n - 1)
+    enough = n >= max(min_days, 2)
+    return np.where(enough, mean + offset, np.nan), np.where(enough, np.sqrt(variance), np.nan)
+
+
+def ewma(values, span):
+    """
+    Exponentially weighted moving average of the days before each day.
+
+    Missing days carry the previous average forward; NaN until a user's first value.
+    """
+    alpha = 2.0 / (span + 1)
+    result = np.full_like(values, np.nan)
+    state = np.full(len(values), np.nan)
+    for day in range(values.shape[1]):
+        result[:, day] = state
+        current = values[:, day]
+        has_value = ~np.isnan(current)
+        state = np.where(has_value, np.where(np.isnan(state), current, state + alpha * (current - state)), state)
+    return result
+
+
+def baselines(user_ids, start, end, window=None, min_days=None, span=None):
+    """
+    Rolling baselines of ``user_ids`` for every day from ``start`` to ``end``.
+
+    Returns ``(user_ids, days, stats)``: the sorted user IDs, the dates, and per
+    metric a dict of users × days matrices ``value``, ``mean``, ``std``, ``ewma``
+    and ``z`` (NaN where there is no value or not enough history).
+    """
+    window = window or settings.HEALTH_ANOMALY_WINDOW_DAYS
+    min_days = min_days or settings.HEALTH_ANOMALY_MIN_DAYS
+    span = span or settings.HEALTH_ANOMALY_EWMA_SPAN
+    history_start = start - timedelta(days=window)
+
+    rows = list(
+        HealthData.objects.filter(user_id__in=set(user_ids), date__range=[history_start, end])
+        .order_by().values_list('user_id', 'date', *METRICS)
+    )
+    aligned_ids, series = align(rows, history_start, (end - history_start).days + 1)
+    # Users without any data in the period still get (all-NaN) rows
+    user_ids = np.array(sorted(set(user_ids)), dtype=np.int64)
+    present = np.isin(user_ids, aligned_ids)
+
+    stats = {}
+    for metric, values in series.items():
+        full = np.full((len(user_ids), values.shape[1]), np.nan)
+        full[present] = values
+        mean, std = rolling_baseline(full, window, min_days)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (full - mean) / np.maximum(std, MIN_STD[metric])
+        stats[metric] = {
+            name: matrix[:, window:]
+            for name, matrix in (('value', full), ('mean', mean), ('std', std), ('ewma', ewma(full, span)), ('z', z))
+        }
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return user_ids, days, stats
+
+
+def detect(rows, threshold=None):
+    """
+    Return unsaved anomaly Recommendations for HealthData ``rows``.
+
+    ``rows`` are ``(id, user_id, date, *metrics)`` tuples as loaded by rules.py
+    (``rules.COLUMNS``); only the window preceding their dates is read.
+    """
+    if not rows:
+        return []
+    threshold = threshold or settings.HEALTH_ANOMALY_Z_THRESHOLD
+    window = settings.HEALTH_ANOMALY_WINDOW_DAYS
+    expires_at = timezone.now() + timedelta(days=7)
+
+    user_ids, days, stats = baselines(
+        {row[1] for row in rows}, min(row[2] for row in rows), max(row[2] for row in rows)
+    )
+    user_index = np.searchsorted(user_ids, np.fromiter((row[1] for row in rows), np.int64, len(rows)))
+    day_index = np.fromiter((row[2].toordinal() for row in rows), np.int64, len(rows)) - days[0].toordinal()
+
+    recommendations = []
+    for rule in ANOMALY_RULES:
+        metric = stats[rule['metric']]
+        z = metric['z'][user_index, day_index]
+        with np.errstate(invalid='ignore'):
+            flagged = z <= -threshold if rule['direction'] == 'low' else z >= threshold
+        positions = np.flatnonzero(flagged)
+        if len(positions):
+            metrics.inc(
+                'health_anomalies_total', metrics.label_set(metric=rule['metric'], direction=rule['direction']),
+                len(positions)
+            )
+        for position in positions:
+            user_id, day = int(user_ids[user_index[position]]), days[day_index[position]]
+            at = (user_index[position], day_index[position])
+            sigma = abs(float(z[position]))
+            recommendations.append(Recommendation(
+                user_id=user_id,
+                date=day,
+                fingerprint=Recommendation.fingerprint_for(user_id, day, source(rule), rule['type']),
+                title=rule['title'],
+                content=rule['content'].format(
+                    value=metric['value'][at], mean=metric['mean'][at], std=metric['std'][at],
+                    ewma=metric['ewma'][at], sigma=sigma, window=window
+                ),
+                type=rule['type'],
+                priority=rule['priority'],
+                # Chebyshev: at most 1 / z² of any distribution lies this far out
+                # (no bound below |z| = 1, so thresholds under 1 give 0)
+                confidence_score=round(min(0.99, 1 - 1 / max(sigma, 1.0) ** 2), 2),
+                model_version=ANOMALY_VERSION,
+                expires_at=expires_at
+            ))
+    return recommendations
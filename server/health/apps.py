@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HealthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'health'
+    
+    def ready(self):
+        # Install the query recorder and Celery task signal handlers in every process
+        from . import metrics  # noqa: F401
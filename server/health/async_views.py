@@ -0,0 +1,221 @@
+"""
+Async versions of the ingest, health summary and recommendation list endpoints.
+
+Under an ASGI server (``uvicorn synaptica.asgi:application``) a request to these
+views is a coroutine instead of a thread: authentication, cache reads and the
+read queries go through the async cache API and Django's async ORM, so a
+request waiting on Redis or PostgreSQL does not hold a worker. Steps that only
+exist as sync code (serializer validation, the ingest upsert with its rollup and
+cache maintenance and its task outbox message) run in one ``sync_to_async``
+call each.
+
+The views return the same payloads, status codes and ``X-Cache`` headers as
+their DRF counterparts in views.py and share their cache entries.
+``HEALTH_ASYNC_VIEWS`` routes the URLs to them; leave it off under WSGI, where
+Django would start an event loop for every request.
+"""
+import functools
+import logging
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .authentication import CachedTokenAuthentication
+from .cache import acached_user_response
+from .fast_serializers import RecommendationListValuesSerializer
+from .models import HealthData, HealthRollup, Recommendation, RecommendationCounter
+from .pagination import PrecountedPageNumberPagination, RecommendationKeysetPagination
+from .serializers import HealthDataCreateUpdateSerializer, HealthDataSerializer, RecommendationListSerializer
+from .tasks import schedule_health_data_processing
+from .views import add_recommendation_counts, filter_recommendations, summarize_health
+
+logger = logging.getLogger(__name__)
+
+
+def render(response):
+    """Render a DRF Response the way JSONRenderer does for the sync views."""
+    rendered = HttpResponse(
+        JSONRenderer().render(response.data),
+        status=response.status_code,
+        content_type=JSONRenderer.media_type
+    )
+    for header, value in response.items():
+        if header.lower() != 'content-type':
+            rendered[header] = value
+    return rendered
+
+
+def async_api_view(http_method_names):
+    """
+    ``@api_view`` with ``IsAuthenticated`` for coroutine views.
+
+    The view receives a DRF Request authenticated by CachedTokenAuthentication
+    and returns a Response; errors are turned into responses by DRF's
+    exception handler.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            authenticator = CachedTokenAuthentication()
+            request = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                authenticators=()
+            )
+            try:
+                if request.method not in http_method_names:
+                    raise exceptions.MethodNotAllowed(request.method)
+
+                authenticated = await authenticator.aauthenticate(request._request)
+                if authenticated is None:
+                    raise exceptions.NotAuthenticated()
+                request.user, request.auth = authenticated
+
+                response = await view(request, *args, **kwargs)
+            except (exceptions.APIException, Http404) as exc:
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    exc.auth_header = authenticator.authenticate_header(request)
+                response = exception_handler(exc, {'request': request})
+            return render(response)
+        return csrf_exempt(wrapper)
+    return decorator
+
+
+def save_health_data(serializer):
+    """Save a validated ingest record, queue its processing and serialize it for the response."""
+    with transaction.atomic():
+        health_data, created = serializer.save()
+        schedule_health_data_processing(health_data.user_id, health_data.date)
+    return health_data, created, HealthDataSerializer(health_data).data
+
+
+@async_api_view(['POST'])
+async def health_data_create(request):
+    """
+    POST /data/health
+    Async HealthDataCreateView: create/update HealthData, then queue AI processing.
+    """
+    try:
+        serializer = HealthDataCreateUpdateSerializer(data=request.data, context={'request': request})
+        is_valid = await sync_to_async(serializer.is_valid)()
+
+        if is_valid and settings.HEALTH_INGEST_MODE == 'buffered':
+            # Write-behind: the flusher task upserts buffered rows in bulk
+            await sync_to_async(serializer.enqueue)()
+            return Response({
+                'success': True,
+                'message': 'Health data accepted for processing',
+                'queued': True
+            }, status=status.HTTP_202_ACCEPTED)
+
+        if is_valid:
+            health_data, created, data = await sync_to_async(save_health_data)(serializer)
+            return Response({
+                'success': True,
+                'message': 'Health data saved successfully' if created else 'Health data updated successfully',
+                'data': data,
+                'created': created
+            }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+        return Response({
+            'success': False,
+            'message': 'Invalid data provided',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    except Exception:
+        logger.exception('Error saving health data')
+        return Response({
+            'success': False,
+            'message': 'Server error'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def health_summary(request, user_id):
+    """
+    GET /user/<id>/health-summary
+    Async health_summary.
+    """
+    # The 30-day window moves daily, so today's date is part of the cache key
+    return await acached_user_response(
+        'health-summary', request, user_id,
+        lambda: build_health_summary(user_id),
+        key_parts=[date.today()]
+    )
+
+
+async def build_health_summary(user_id):
+    """Build the health_summary response with the async ORM."""
+    user = await aget_object_or_404(User, id=user_id)
+
+    rollup = await HealthRollup.objects.acurrent(user.id, 30)
+
+    if not rollup.days:
+        return Response({
+            'success': True,
+            'message': 'No recent health data found',
+            'summary': {}
+        })
+
+    latest_data = await HealthData.objects.filter(
+        user=user,
+        date__gte=rollup.start_date
+    ).order_by('-date').afirst()
+
+    if settings.HEALTH_RECOMMENDATION_COUNTERS:
+        recommendations_count = (await RecommendationCounter.objects.afor_user(user.id)).unread_count
+    else:
+        recommendations_count = await Recommendation.objects.filter(user=user, is_read=False).acount()
+
+    return Response({
+        'success': True,
+        'summary': summarize_health(user_id, rollup, latest_data, recommendations_count)
+    })
+
+
+@async_api_view(['GET'])
+async def user_recommendations(request, user_id):
+    """
+    GET /user/<id>/recommendations
+    Async UserRecommendationsView, with the same filters, pagination modes and counters.
+    """
+    return await acached_user_response(
+        'recommendations', request, user_id,
+        lambda: build_recommendations_page(request, user_id)
+    )
+
+
+async def build_recommendations_page(request, user_id):
+    """Return one page plus total/unread/pending counters with the async ORM."""
+    user = await aget_object_or_404(User, id=user_id)
+    queryset = filter_recommendations(Recommendation.objects.filter(user=user), request.query_params)
+    counts = await queryset.acounts()
+
+    if RecommendationKeysetPagination.is_requested(request):
+        paginator = RecommendationKeysetPagination()
+    else:
+        paginator = PrecountedPageNumberPagination()
+        paginator.known_count = counts['count']
+
+    if settings.HEALTH_FAST_LIST_SERIALIZERS:
+        page = await paginator.apaginate_queryset(RecommendationListValuesSerializer.values(queryset), request)
+        data = RecommendationListValuesSerializer.serialize(page)
+    else:
+        page = await paginator.apaginate_queryset(queryset, request)
+        data = RecommendationListSerializer(page, many=True).data
+
+    response = paginator.get_paginated_response(data)
+    return add_recommendation_counts(response, counts, request.query_params)
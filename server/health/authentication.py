@@ -0,0 +1,195 @@
+"""
+Token authentication with a two-tier cache.
+
+DRF's TokenAuthentication reads ``authtoken_token`` joined to ``auth_user`` on
+every request. CachedTokenAuthentication keeps the same checks and error
+messages but looks the token up in an in-process LRU first, then in the shared
+Django cache (``HEALTH_CACHE_ALIAS``), and only then in the database. Cached
+entries hold only what authentication needs (the token key, its user id and the
+user's ``is_active`` and ``is_staff`` flags), never the password hash or other
+user columns; the rest of the user is loaded from the database on first access.
+
+Entries are dropped from both tiers, once the transaction commits, when a token
+is saved or deleted and when its user is saved (e.g. deactivated) or deleted.
+The in-process tier of other processes cannot be reached, so it has a much
+shorter TTL than the shared tier; changes that bypass signals (queryset
+``update()``) are picked up when entries expire.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+
+CACHE_KEY = 'health:auth:token:v2:{digest}'
+TOKEN_FIELDS = ('key', 'user_id')
+USER_FIELDS = ('id', 'is_active', 'is_staff')
+
+_lock = threading.Lock()
+_local = OrderedDict()  # token key -> (expires_at, entry)
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+def _cache_key(key):
+    # Keys are credentials; keep them out of cache key listings
+    return CACHE_KEY.format(digest=hashlib.sha256(key.encode()).hexdigest())
+
+
+def _from_values(model, names, values):
+    """Build a ``model`` instance with only ``names`` loaded; the other fields are deferred."""
+    loaded = dict(zip(names, values))
+    attnames = [field.attname for field in model._meta.concrete_fields if field.attname in loaded]
+    return model.from_db(DEFAULT_DB_ALIAS, attnames, [loaded[name] for name in attnames])
+
+
+def _record(outcome):
+    with _lock:
+        _stats[outcome] += 1
+
+
+def _local_get(key):
+    with _lock:
+        item = _local.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return item[1]
+
+
+def _local_set(key, entry):
+    with _lock:
+        _local[key] = (time.monotonic() + settings.HEALTH_AUTH_CACHE_LOCAL_TTL, entry)
+        _local.move_to_end(key)
+        while len(_local) > settings.HEALTH_AUTH_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def invalidate_tokens(keys):
+    """Drop the given token keys from both cache tiers once the transaction commits."""
+    keys = list(keys)
+    if not keys:
+        return
+
+    def invalidate():
+        with _lock:
+            for key in keys:
+                _local.pop(key, None)
+        caches[settings.HEALTH_CACHE_ALIAS].delete_many([_cache_key(key) for key in keys])
+
+    # Dropping entries before the commit would let a concurrent request cache
+    # the old row again
+    transaction.on_commit(invalidate)
+
+
+def invalidate_user_tokens(user_id):
+    """Drop every cached token of ``user_id``."""
+    invalidate_tokens(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+def auth_cache_stats():
+    """Return token cache hit/miss counters of this process."""
+    with _lock:
+        stats = dict(_stats, local_size=len(_local))
+    lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+    stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+    return stats
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in replacement for TokenAuthentication backed by the token cache."""
+
+    def authenticate_credentials(self, key):
+        entry = _local_get(key)
+        if entry is not None:
+            _record('local_hits')
+        else:
+            shared = caches[settings.HEALTH_CACHE_ALIAS]
+            entry = shared.get(_cache_key(key))
+            if entry is not None:
+                _record('shared_hits')
+            else:
+                _record('misses')
+                try:
+                    token = self.get_queryset().get(key=key)
+                except self.get_model().DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                entry = self.make_entry(token)
+                shared.set(_cache_key(key), entry, timeout=settings.HEALTH_AUTH_CACHE_TTL)
+            _local_set(key, entry)
+        return self.load_entry(entry)
+
+    async def aauthenticate(self, request):
+        """
+        Async version of authenticate() for plain Django async views; the shared
+        cache and the database are read without blocking the event loop.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.')
+            )
+
+        entry = _local_get(key)
+        if entry is not None:
+            _record('local_hits')
+        else:
+            shared = caches[settings.HEALTH_CACHE_ALIAS]
+            entry = await shared.aget(_cache_key(key))
+            if entry is not None:
+                _record('shared_hits')
+            else:
+                _record('misses')
+                try:
+                    token = await self.get_queryset().aget(key=key)
+                except self.get_model().DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                entry = self.make_entry(token)
+                await shared.aset(_cache_key(key), entry, timeout=settings.HEALTH_AUTH_CACHE_TTL)
+            _local_set(key, entry)
+        return self.load_entry(entry)
+
+    def get_queryset(self):
+        """Tokens with only the columns a cache entry holds."""
+        return self.get_model().objects.select_related('user').only(
+            *TOKEN_FIELDS, *(f'user__{name}' for name in USER_FIELDS)
+        )
+
+    def make_entry(self, token):
+        """Return the cacheable values of ``token`` and its user: ``TOKEN_FIELDS`` and ``USER_FIELDS``."""
+        return (
+            [getattr(token, name) for name in TOKEN_FIELDS],
+            [getattr(token.user, name) for name in USER_FIELDS],
+        )
+
+    def load_entry(self, entry):
+        """
+        Build ``(user, token)`` from a cache entry and check that the user is
+        active. Fields missing from the entry are deferred and loaded on access.
+        """
+        token = _from_values(self.get_model(), TOKEN_FIELDS, entry[0])
+        token.user = _from_values(get_user_model(), USER_FIELDS, entry[1])
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
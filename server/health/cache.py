@@ -0,0 +1,177 @@
+"""
+Versioned per-user response cache.
+
+Every user has a version key in Django's cache. Cached responses are stored
+under keys that include that version, and every write to the user's HealthData
+or Recommendations bumps it, so stale entries are simply never read again and
+age out of the cache on their own. Timeouts only reclaim memory, except where a
+response also depends on time (recommendation expiry, "last 30 days").
+
+Clients can send ``X-Cache-Bypass: 1`` to skip the cache; responses carry an
+``X-Cache: HIT|MISS|BYPASS`` header.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+
+VERSION_KEY = 'health:version:{user_id}'
+RESPONSE_KEY = 'health:response:{namespace}:{user_id}:{version}:{request_hash}'
+BYPASS_HEADER = 'HTTP_X_CACHE_BYPASS'
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'bypasses': 0})
+
+
+def get_cache():
+    return caches[settings.HEALTH_CACHE_ALIAS]
+
+
+def _record(namespace, outcome):
+    with _stats_lock:
+        _stats[namespace][outcome] += 1
+
+
+def cache_stats():
+    """Return per-namespace hit/miss counters of this process."""
+    with _stats_lock:
+        stats = {namespace: dict(counters) for namespace, counters in _stats.items()}
+    for counters in stats.values():
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 4) if lookups else None
+    return stats
+
+
+def get_user_version(user_id):
+    """
+    Return the user's cache version, initialising it if missing.
+
+    Versions start from the current time in milliseconds so that a version key
+    evicted from the cache never comes back with a number used before.
+    """
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_user_version(user_id):
+    """Async version of get_user_version()."""
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_user_versions(user_ids):
+    """Invalidate cached responses for ``user_ids`` once the transaction commits."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+
+    def bump():
+        cache = get_cache()
+        for user_id in user_ids:
+            key = VERSION_KEY.format(user_id=user_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def _bypass_requested(request):
+    return request.META.get(BYPASS_HEADER, '').lower() in ('1', 'true')
+
+
+def _response_key(namespace, request, user_id, version, key_parts):
+    request_hash = hashlib.md5(
+        '|'.join([request.build_absolute_uri(), *map(str, key_parts)]).encode()
+    ).hexdigest()
+    return RESPONSE_KEY.format(
+        namespace=namespace,
+        user_id=user_id,
+        version=version,
+        request_hash=request_hash
+    )
+
+
+def _cache_timeout(response):
+    """Return the timeout to store ``response`` with, or None if it must not be stored."""
+    if response.status_code != 200:
+        return None
+    timeout = getattr(response, 'cache_timeout', None)
+    if timeout is not None and timeout <= 0:
+        return None
+    return timeout or settings.HEALTH_CACHE_TIMEOUT
+
+
+def cached_user_response(namespace, request, user_id, build_response, key_parts=()):
+    """
+    Serve ``build_response()`` for ``user_id`` through the versioned cache.
+
+    Only 200 responses are cached. A view may set ``response.cache_timeout``
+    (seconds) when the data goes stale with time rather than with writes.
+    """
+    if _bypass_requested(request):
+        _record(namespace, 'bypasses')
+        response = build_response()
+        response['X-Cache'] = 'BYPASS'
+        return response
+
+    cache = get_cache()
+    key = _response_key(namespace, request, user_id, get_user_version(user_id), key_parts)
+
+    data = cache.get(key)
+    if data is not None:
+        _record(namespace, 'hits')
+        return Response(data, headers={'X-Cache': 'HIT'})
+
+    _record(namespace, 'misses')
+    response = build_response()
+    timeout = _cache_timeout(response)
+    if timeout is not None:
+        cache.set(key, response.data, timeout=timeout)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def acached_user_response(namespace, request, user_id, build_response, key_parts=()):
+    """
+    Async version of cached_user_response(); ``build_response`` is a coroutine
+    function. Entries are shared with the sync views.
+    """
+    if _bypass_requested(request):
+        _record(namespace, 'bypasses')
+        response = await build_response()
+        response['X-Cache'] = 'BYPASS'
+        return response
+
+    cache = get_cache()
+    key = _response_key(namespace, request, user_id, await aget_user_version(user_id), key_parts)
+
+    data = await cache.aget(key)
+    if data is not None:
+        _record(namespace, 'hits')
+        return Response(data, headers={'X-Cache': 'HIT'})
+
+    _record(namespace, 'misses')
+    response = await build_response()
+    timeout = _cache_timeout(response)
+    if timeout is not None:
+        await cache.aset(key, response.data, timeout=timeout)
+    response['X-Cache'] = 'MISS'
+    return response
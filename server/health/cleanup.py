@@ -0,0 +1,154 @@
+"""
+Chunked expiry cleanup for recommendations.
+
+Expired, uncompleted recommendations are removed in bounded primary-key
+batches. Each batch is one short transaction around a single set-based
+statement::
+
+    WITH batch AS (SELECT id ... WHERE id > <last id> ... ORDER BY id LIMIT n FOR UPDATE SKIP LOCKED),
+         deleted AS (DELETE FROM recommendations USING batch ... RETURNING ...)
+    INSERT INTO recommendation_archive (...) SELECT ... FROM deleted
+
+No row is loaded into Python for the delete (no deletion collector, no per-row
+signals) and rows locked by concurrent writers are skipped rather than waited on.
+
+After each batch the last id reached is saved in a JobCheckpoint together with
+the run's cutoff time, so an interrupted run resumes from there with the same
+cutoff. The checkpoint is removed once a run completes.
+
+Archival is ``'table'`` (RecommendationArchive), ``'none'``, or a path to a JSON
+Lines file (gzip-compressed if it ends in ``.gz``) that deleted rows are
+appended to. File archival is at-least-once: a batch that is rolled back after
+being written is written again when the run resumes.
+"""
+import gzip
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import JobCheckpoint, Recommendation, RecommendationArchive, recommendations_changed
+
+
+CHECKPOINT_NAME = 'cleanup_expired_recommendations'
+
+# Recommendation columns kept when a row is archived
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'date', 'title', 'type', 'priority', 'confidence_score',
+    'model_version', 'is_read', 'user_rating', 'created_at', 'expires_at',
+)
+
+
+def _batch_sql(archive):
+    """Build the statement that deletes (and optionally archives) one batch."""
+    qn = connection.ops.quote_name
+    table = qn(Recommendation._meta.db_table)
+    returning = ARCHIVE_FIELDS if archive != 'none' else ('id', 'user_id')
+
+    sql = (
+        f'WITH batch AS ('
+        f'SELECT {qn("id")} FROM {table} '
+        f'WHERE {qn("id")} > %s AND {qn("expires_at")} < %s AND NOT {qn("is_completed")} '
+        f'ORDER BY {qn("id")} LIMIT %s FOR UPDATE SKIP LOCKED'
+        f'), deleted AS ('
+        f'DELETE FROM {table} USING batch WHERE {table}.{qn("id")} = batch.{qn("id")} '
+        f'RETURNING {", ".join(f"{table}.{qn(field)}" for field in returning)}'
+        f') '
+    )
+    if archive != 'table':
+        return sql + f'SELECT {", ".join(qn(field) for field in returning)} FROM deleted'
+
+    archive_table = qn(RecommendationArchive._meta.db_table)
+    columns = ['recommendation_id', *ARCHIVE_FIELDS[1:], 'archived_at']
+    return sql + (
+        f'INSERT INTO {archive_table} ({", ".join(qn(column) for column in columns)}) '
+        f'SELECT {", ".join(qn(field) for field in ARCHIVE_FIELDS)}, %s FROM deleted '
+        f'RETURNING {qn("recommendation_id")}, {qn("user_id")}'
+    )
+
+
+def _open_archive_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'at', encoding='utf-8')
+    return open(path, 'a', encoding='utf-8')
+
+
+def cleanup_expired_recommendations(batch_size=None, archive=None, max_batches=None,
+                                    pause=None, restart=False, progress=None):
+    """
+    Delete expired, uncompleted recommendations in checkpointed batches.
+
+    Resumes from the saved checkpoint unless ``restart`` is true. Stops after
+    ``max_batches`` if given, leaving the checkpoint for the next run. Sleeps
+    ``pause`` seconds between batches to leave room for other writers.
+    ``progress`` is called with the running totals after every batch.
+
+    Returns a dict with ``deleted``, ``batches``, ``elapsed``, ``rows_per_second``
+    and ``complete``.
+    """
+    batch_size = batch_size or settings.HEALTH_CLEANUP_BATCH_SIZE
+    archive = archive or settings.HEALTH_CLEANUP_ARCHIVE
+    pause = settings.HEALTH_CLEANUP_BATCH_PAUSE if pause is None else pause
+
+    checkpoint = None if restart else JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    if checkpoint:
+        cutoff = parse_datetime(checkpoint.state['cutoff'])
+        last_id = checkpoint.state['last_id']
+        resumed = checkpoint.state['deleted']
+    else:
+        cutoff, last_id, resumed = timezone.now(), 0, 0
+
+    sql = _batch_sql(archive)
+    archive_file = _open_archive_file(archive) if archive not in ('table', 'none') else None
+    encoder = DjangoJSONEncoder()
+    stats = {'deleted': 0, 'batches': 0, 'elapsed': 0.0, 'rows_per_second': 0.0, 'complete': False}
+    started = time.monotonic()
+
+    try:
+        while max_batches is None or stats['batches'] < max_batches:
+            with transaction.atomic(), connection.cursor() as cursor:
+                params = [last_id, cutoff, batch_size]
+                if archive == 'table':
+                    params.append(timezone.now())
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                if not rows:
+                    JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).delete()
+                    stats['complete'] = True
+                    break
+
+                if archive_file:
+                    archive_file.write(''.join(
+                        encoder.encode(dict(zip(ARCHIVE_FIELDS, row))) + '\n' for row in rows
+                    ))
+                    archive_file.flush()
+
+                last_id = max(row[0] for row in rows)
+                recommendations_changed(row[1] for row in rows)
+                stats['deleted'] += len(rows)
+                JobCheckpoint.objects.update_or_create(
+                    name=CHECKPOINT_NAME,
+                    defaults={'state': {
+                        'cutoff': cutoff,
+                        'last_id': last_id,
+                        'deleted': resumed + stats['deleted'],
+                    }}
+                )
+
+            stats['batches'] += 1
+            stats['elapsed'] = time.monotonic() - started
+            stats['rows_per_second'] = stats['deleted'] / stats['elapsed'] if stats['elapsed'] else 0.0
+            if progress:
+                progress(stats)
+            if pause:
+                time.sleep(pause)
+    finally:
+        if archive_file:
+            archive_file.close()
+
+    stats['elapsed'] = time.monotonic() - started
+    stats['rows_per_second'] = stats['deleted'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    return stats
@@ -0,0 +1,105 @@
+"""
+Streaming exports of a user's health history.
+
+Rows are read with ``values_list().iterator()`` so PostgreSQL serves them from a
+server-side cursor, and are encoded chunk by chunk into a StreamingHttpResponse.
+Memory use stays flat regardless of how long the history is.
+"""
+import csv
+import io
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import HealthData, Recommendation
+
+
+HEALTH_DATA_EXPORT_FIELDS = [
+    'date', 'steps', 'sleep_hours', 'heart_rate_avg', 'activity_level',
+    'calories_burned', 'weight', 'created_at', 'updated_at',
+]
+
+RECOMMENDATION_EXPORT_FIELDS = [
+    'id', 'date', 'title', 'content', 'type', 'priority', 'confidence_score',
+    'model_version', 'is_read', 'is_completed', 'user_rating',
+    'created_at', 'updated_at', 'expires_at',
+]
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _iter_ndjson(rows, fields, chunk_size):
+    """Encode rows as newline-delimited JSON, one chunk of lines at a time."""
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(fields, row))))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _iter_csv(rows, fields, chunk_size):
+    """Encode rows as CSV with a header line, one chunk of lines at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_queryset(queryset, fields, export_format, filename):
+    """Return a StreamingHttpResponse that exports ``fields`` of ``queryset``."""
+    chunk_size = settings.HEALTH_EXPORT_CHUNK_SIZE
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    encode = _iter_csv if export_format == 'csv' else _iter_ndjson
+
+    response = StreamingHttpResponse(
+        encode(rows, fields, chunk_size),
+        content_type=EXPORT_CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+def export_health_data(user, export_format, start_date=None, end_date=None):
+    """Stream a user's HealthData history, oldest first, optionally between two ``date`` bounds."""
+    queryset = HealthData.objects.filter(user=user)
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+
+    return stream_queryset(
+        queryset.order_by('date'),
+        HEALTH_DATA_EXPORT_FIELDS,
+        export_format,
+        f'health-data-{user.id}'
+    )
+
+
+def export_recommendations(user, export_format, start_date=None, end_date=None):
+    """Stream a user's Recommendation history, oldest first, optionally between two ``date`` bounds."""
+    queryset = Recommendation.objects.filter(user=user)
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+
+    return stream_queryset(
+        queryset.order_by('created_at', 'id'),
+        RECOMMENDATION_EXPORT_FIELDS,
+        export_format,
+        f'recommendations-{user.id}'
+    )
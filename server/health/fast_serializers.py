@@ -0,0 +1,175 @@
+"""
+Read-only list serialization straight from ``values()`` rows.
+
+DRF serializers resolve every field of every row through ``get_attribute`` and
+``to_representation`` on a model instance, which dominates CPU time on large
+pages. A ValuesSerializer is compiled once from the DRF serializer it stands in
+for: each readable field becomes a ``values()`` lookup plus a converter, skipped
+where the database value is already what DRF would return (strings, integers,
+booleans, choices, primary keys). Fields that are not columns are declared in
+``computed`` with the lookups they need. The output is the same as the DRF
+serializer's, built from one query without model instances.
+
+List views opt in with FastListMixin, and deployments with
+``HEALTH_FAST_LIST_SERIALIZERS = True``; otherwise every list is served
+through the DRF serializers.
+"""
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .models import HealthData
+from .serializers import HealthDataSerializer, RecommendationSerializer, RecommendationListSerializer
+
+
+# DRF fields whose to_representation() returns database values unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+def _column_getter(lookup, convert):
+    if convert is None:
+        return itemgetter(lookup)
+
+    def get(row):
+        value = row[lookup]
+        return None if value is None else convert(value)
+    return get
+
+
+def _computed_getter(lookups, function):
+    def get(row):
+        return function(*(row[lookup] for lookup in lookups))
+    return get
+
+
+def _is_expired(expires_at):
+    """Same as Recommendation.is_expired."""
+    if expires_at:
+        return timezone.now() > expires_at
+    return False
+
+
+class ValuesSerializer:
+    """
+    Serialize ``values()`` rows like ``serializer_class`` does model instances.
+
+    ``computed`` maps output names to ``(lookups, function)``; names that are not
+    fields of ``serializer_class`` are appended after its fields.
+    """
+    serializer_class = None
+    computed = {}
+
+    @classmethod
+    def compile(cls):
+        """Return ``(lookups, plan)``, built on first use and kept on the class."""
+        if '_compiled' not in cls.__dict__:
+            lookups = []
+            plan = []
+
+            def add_lookup(lookup):
+                if lookup not in lookups:
+                    lookups.append(lookup)
+                return lookup
+
+            def add_computed(name):
+                needs, function = cls.computed[name]
+                plan.append((name, _computed_getter(tuple(add_lookup(lookup) for lookup in needs), function)))
+
+            fields = cls.serializer_class().fields
+            for name, field in fields.items():
+                if field.write_only:
+                    continue
+                if name in cls.computed:
+                    add_computed(name)
+                    continue
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                plan.append((name, _column_getter(add_lookup(field.source.replace('.', '__')), convert)))
+
+            for name in cls.computed:
+                if name not in fields:
+                    add_computed(name)
+
+            cls._compiled = (tuple(lookups), tuple(plan))
+        return cls._compiled
+
+    @classmethod
+    def values(cls, queryset):
+        """Narrow ``queryset`` to the columns the serializer reads."""
+        lookups, _ = cls.compile()
+        return queryset.values(*lookups)
+
+    @classmethod
+    def serialize(cls, rows):
+        """Return the list of representations of ``rows``."""
+        _, plan = cls.compile()
+        return [{name: get(row) for name, get in plan} for row in rows]
+
+
+class HealthDataValuesSerializer(ValuesSerializer):
+    serializer_class = HealthDataSerializer
+    computed = {
+        'activity_score': (('steps', 'activity_level'), HealthData.score_activity),
+        # Added by HealthDataSerializer.to_representation
+        'user': (
+            ('user_id', 'user__username', 'user__profile__name'),
+            lambda user_id, username, name: {
+                'id': user_id,
+                'username': username,
+                'name': username if name is None else name,
+            }
+        ),
+    }
+
+
+class RecommendationValuesSerializer(ValuesSerializer):
+    serializer_class = RecommendationSerializer
+    computed = {
+        'is_expired': (('expires_at',), _is_expired),
+    }
+
+
+class RecommendationListValuesSerializer(ValuesSerializer):
+    serializer_class = RecommendationListSerializer
+    computed = {
+        'is_expired': (('expires_at',), _is_expired),
+    }
+
+
+class FastListMixin:
+    """
+    Serve the list action of a generic view through ``fast_serializer_class``.
+    Other actions keep using ``serializer_class``.
+    """
+    fast_serializer_class = None
+
+    def use_fast_serializer(self):
+        return self.fast_serializer_class is not None and settings.HEALTH_FAST_LIST_SERIALIZERS
+
+    def get_list_rows(self, queryset):
+        """Return what the list paginates: ``values()`` rows or model instances."""
+        if self.use_fast_serializer():
+            return self.fast_serializer_class.values(queryset)
+        return queryset
+
+    def serialize_list(self, rows):
+        if self.use_fast_serializer():
+            return self.fast_serializer_class.serialize(rows)
+        return self.get_serializer(rows, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        rows = self.get_list_rows(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_list(page))
+        return Response(self.serialize_list(rows))
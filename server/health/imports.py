@@ -0,0 +1,311 @@
+"""
+Bulk import of historical HealthData, e.g. Health Connect or wearable exports.
+
+Input files are CSV with a header row or JSON Lines, optionally gzip-compressed
+(``.csv``, ``.jsonl``, ``.ndjson``, plus ``.gz``). Each record is one day for
+one user: ``user_id`` (username or numeric ID, as for the ingest endpoint) and
+the fields of HealthDataRecordSerializer. Files are streamed and handled in
+chunks; for every chunk:
+
+1. the chunk's user identifiers are resolved with one query (``resolve_users``);
+2. records are validated with HealthDataRecordSerializer, the field rules of
+   HealthDataCreateUpdateSerializer;
+3. valid rows are COPYed into a temporary staging table and merged into
+   ``health_data`` with one ``INSERT ... SELECT ... ON CONFLICT DO UPDATE``.
+   The last record wins for a repeated (user, date), and a missing heart rate
+   does not clear a stored one;
+4. the HealthRollup windows of the chunk's users are rebuilt and the number of
+   records consumed is saved in a JobCheckpoint, in the merge's transaction.
+
+An interrupted import resumes after its last committed chunk. An import can be
+split into shards run in parallel: shard ``k`` of ``n`` imports the users whose
+ID is ``k`` modulo ``n``, so shards never write the same rows. AI processing is
+not queued per row; once every shard is done, ``queue_imported`` queues the
+imported rows that have no recommendations yet in one batch.
+"""
+import csv
+import gzip
+import hashlib
+import json
+import os
+import time
+import zlib
+from datetime import date
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from . import partitions
+from .bulkload import copy_rows
+from .cache import bump_user_versions
+from .models import HealthData, HealthRollup, JobCheckpoint, Recommendation
+from .serializers import HealthDataRecordSerializer
+from .tasks import queue_health_data_batches
+from .users import resolve_users
+
+
+CHECKPOINT_PREFIX = 'import_health_data'
+STAGING_TABLE = 'health_data_import'
+IMPORT_FIELDS = ('date', 'steps', 'sleep_hours', 'heart_rate_avg', 'activity_level')
+
+_STAGING_SQL = (
+    f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} ('
+    f'seq bigint, user_id integer, date date, steps integer, sleep_hours numeric(4, 2), '
+    f'heart_rate_avg integer, activity_level varchar(20)'
+    f') ON COMMIT DELETE ROWS'
+)
+
+
+def read_records(path):
+    """
+    Yield the records of a CSV or JSON Lines file as dicts, without reading it whole.
+
+    Empty CSV cells count as missing; JSON lines that do not parse are yielded as None.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if not name.endswith(('.csv', '.jsonl', '.ndjson')):
+        raise ValueError(f'Unsupported file type: {path} (expected .csv, .jsonl or .ndjson, optionally .gz)')
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as source:
+        if name.endswith('.csv'):
+            for record in csv.DictReader(source):
+                yield {key: value for key, value in record.items() if key and value not in ('', None)}
+            return
+
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def checkpoint_prefix(path):
+    """Checkpoint name prefix of an import of ``path``, tied to its location and size."""
+    path = os.path.abspath(path)
+    digest = hashlib.sha1(f'{path}:{os.path.getsize(path)}'.encode()).hexdigest()[:16]
+    return f'{CHECKPOINT_PREFIX}:{digest}'
+
+
+def clear_checkpoints(path):
+    """Forget the progress of every shard of an import of ``path``."""
+    JobCheckpoint.objects.filter(name__startswith=f'{checkpoint_prefix(path)}:').delete()
+
+
+def shard_of(identifier, user_id, shards):
+    if user_id is not None:
+        return user_id % shards
+    # Unknown users are reported by exactly one shard
+    return zlib.crc32(str(identifier).encode()) % shards
+
+
+def _ensure_partitions(months):
+    table = HealthData._meta.db_table
+    for month in months:
+        try:
+            partitions.create_partition(table, month)
+        except DatabaseError:
+            # Created concurrently by another shard; any other error repeats
+            partitions.create_partition(table, month)
+
+
+def _merge(rows, now):
+    """Stage ``rows`` with COPY and merge them into health_data; returns ``(created, merged)``."""
+    if connection.vendor != 'postgresql':
+        saved = HealthData.objects.upsert([
+            {
+                'user_id': user_id,
+                **{field: value for field, value in zip(IMPORT_FIELDS, values) if value is not None},
+            }
+            for _, user_id, *values in rows
+        ])
+        return sum(1 for *_, created in saved if created), len(saved)
+
+    qn = connection.ops.quote_name
+    table = qn(HealthData._meta.db_table)
+    columns = ', '.join(qn(column) for column in ('user_id', *IMPORT_FIELDS))
+    updates = ', '.join(
+        f'{qn(field)} = EXCLUDED.{qn(field)}' for field in IMPORT_FIELDS[1:] if field != 'heart_rate_avg'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(_STAGING_SQL)
+        # ON COMMIT DELETE ROWS does not empty it between chunks of an enclosing transaction
+        cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+        copy_rows(STAGING_TABLE, ('seq', 'user_id', *IMPORT_FIELDS), rows)
+        # DISTINCT ON keeps the last record per key: ON CONFLICT cannot touch a row twice.
+        # created_at = updated_at only on insert, as in HealthData.objects.upsert
+        cursor.execute(
+            f'WITH merged AS ('
+            f'INSERT INTO {table} ({columns}, {qn("created_at")}, {qn("updated_at")}) '
+            f'SELECT DISTINCT ON (user_id, date) {columns}, %s, %s FROM {STAGING_TABLE} '
+            f'ORDER BY user_id, date, seq DESC '
+            f'ON CONFLICT ({qn("user_id")}, {qn("date")}) DO UPDATE SET {updates}, '
+            f'{qn("heart_rate_avg")} = COALESCE(EXCLUDED.{qn("heart_rate_avg")}, {table}.{qn("heart_rate_avg")}), '
+            f'{qn("updated_at")} = EXCLUDED.{qn("updated_at")} '
+            f'RETURNING ({qn("created_at")} = {qn("updated_at")}) AS created'
+            f') SELECT count(*) FILTER (WHERE created), count(*) FROM merged',
+            [now, now]
+        )
+        return cursor.fetchone()
+
+
+def import_file(path, shard=0, shards=1, chunk_size=None, max_chunks=None, restart=False,
+                errors_path=None, progress=None):
+    """
+    Import shard ``shard`` of ``shards`` of the records in ``path``.
+
+    Resumes from the shard's checkpoint unless ``restart`` is true; a completed
+    shard returns its saved totals. Stops after ``max_chunks`` if given, keeping
+    the checkpoint. Invalid records are appended to ``errors_path`` as JSON lines
+    if given (at least once: a chunk rolled back after its errors were written is
+    reported again on resume). ``progress`` is called with the totals after every chunk.
+
+    Returns a dict with ``records`` (consumed, all shards), ``imported``,
+    ``created``, ``invalid``, ``chunks``, ``first_date``/``last_date`` of the
+    imported rows, ``started``, ``elapsed``, ``rows_per_second`` and ``complete``.
+    """
+    chunk_size = chunk_size or settings.HEALTH_IMPORT_CHUNK_SIZE
+    name = f'{checkpoint_prefix(path)}:{shard}/{shards}'
+    checkpoint = None if restart else JobCheckpoint.objects.filter(name=name).first()
+    if checkpoint:
+        stats = dict(checkpoint.state)
+        stats['started'] = parse_datetime(stats['started'])
+        for key in ('first_date', 'last_date'):
+            stats[key] = stats[key] and date.fromisoformat(stats[key])
+        if stats['complete']:
+            return stats
+    else:
+        stats = {
+            'records': 0, 'imported': 0, 'created': 0, 'invalid': 0, 'chunks': 0,
+            'first_date': None, 'last_date': None, 'started': timezone.now(), 'complete': False,
+        }
+    stats.update(elapsed=0.0, rows_per_second=0.0)
+
+    validator = HealthDataRecordSerializer()
+    partitioned = connection.vendor == 'postgresql' and partitions.is_partitioned(HealthData._meta.db_table)
+    known_months = set()
+    user_ids = {}
+    records = islice(read_records(path), stats['records'], None)
+
+    errors_file = open(errors_path, 'a', encoding='utf-8') if errors_path else None
+    started = time.monotonic()
+    imported = 0
+    chunks = 0
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                stats['complete'] = True
+                JobCheckpoint.objects.update_or_create(name=name, defaults={'state': stats})
+                break
+
+            identifiers = {
+                str(record['user_id']) for record in chunk
+                if isinstance(record, dict) and record.get('user_id') not in (None, '')
+            }
+            missing = identifiers - user_ids.keys()
+            if missing:
+                resolved = resolve_users(missing)
+                user_ids.update((identifier, resolved.get(identifier)) for identifier in missing)
+
+            rows = []
+            errors = []
+            for position, record in enumerate(chunk, stats['records'] + 1):
+                if not isinstance(record, dict):
+                    if position % shards == shard:
+                        errors.append({'record': position, 'errors': {'non_field_errors': ['Not a JSON object.']}})
+                    continue
+                identifier = record.get('user_id')
+                user_id = user_ids.get(str(identifier)) if identifier not in (None, '') else None
+                if shard_of(identifier, user_id, shards) != shard:
+                    continue
+
+                try:
+                    data = validator.run_validation(record)
+                    if user_id is None:
+                        raise serializers.ValidationError({'user_id': [
+                            f"User '{identifier}' not found." if identifier not in (None, '')
+                            else 'This field is required.'
+                        ]})
+                except serializers.ValidationError as exc:
+                    errors.append({'record': position, 'errors': serializers.as_serializer_error(exc)})
+                    continue
+                rows.append((position, user_id, *(data.get(field) for field in IMPORT_FIELDS)))
+
+            if partitioned:
+                months = {partitions.month_start(row[2]) for row in rows} - known_months
+                _ensure_partitions(sorted(months))
+                known_months |= months
+
+            with transaction.atomic():
+                created, merged = _merge(rows, timezone.now()) if rows else (0, 0)
+                chunk_users = {row[1] for row in rows}
+                if chunk_users:
+                    HealthRollup.objects.rebuild(chunk_users)
+                    bump_user_versions(chunk_users)
+
+                dates = [row[2] for row in rows]
+                if dates:
+                    stats['first_date'] = min(filter(None, [stats['first_date'], min(dates)]))
+                    stats['last_date'] = max(filter(None, [stats['last_date'], max(dates)]))
+                stats['records'] += len(chunk)
+                stats['imported'] += merged
+                stats['created'] += created
+                stats['invalid'] += len(errors)
+                stats['chunks'] += 1
+
+                if errors_file and errors:
+                    errors_file.write(''.join(json.dumps(error, default=str) + '\n' for error in errors))
+                    errors_file.flush()
+                JobCheckpoint.objects.update_or_create(name=name, defaults={'state': stats})
+
+            imported += merged
+            chunks += 1
+            stats['elapsed'] = time.monotonic() - started
+            stats['rows_per_second'] = imported / stats['elapsed'] if stats['elapsed'] else 0.0
+            if progress:
+                progress(stats)
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    stats['elapsed'] = time.monotonic() - started
+    stats['rows_per_second'] = imported / stats['elapsed'] if stats['elapsed'] else 0.0
+    return stats
+
+
+def queue_imported(shard_stats, chunk_size=None):
+    """
+    Queue AI processing for the rows written by an import, in one batch.
+
+    ``shard_stats`` are the results of ``import_file`` for every shard. Rows of the
+    imported date range updated since the import started that have no
+    recommendations for their user and date are sent to process_health_data_batch.
+    Returns the number of rows queued.
+    """
+    first_dates = [stats['first_date'] for stats in shard_stats if stats['first_date']]
+    if not first_dates:
+        return 0
+    last_date = max(stats['last_date'] for stats in shard_stats if stats['last_date'])
+    since = min(stats['started'] for stats in shard_stats)
+    chunk_size = chunk_size or settings.HEALTH_BATCH_PROCESS_CHUNK_SIZE
+
+    unprocessed_ids = HealthData.objects.filter(
+        date__range=(min(first_dates), last_date), updated_at__gte=since
+    ).exclude(
+        Exists(Recommendation.objects.filter(user_id=OuterRef('user_id'), date=OuterRef('date')))
+    ).order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+
+    queued, _ = queue_health_data_batches(unprocessed_ids, chunk_size)
+    return queued
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from health.fast_serializers import HealthDataValuesSerializer, RecommendationValuesSerializer
+from health.models import HealthData, Recommendation
+from health.serializers import HealthDataSerializer, RecommendationSerializer
+
+
+def serialize_instances(serializer_class, queryset):
+    return serializer_class(list(queryset), many=True).data
+
+
+def serialize_values(values_serializer, queryset):
+    return values_serializer.serialize(values_serializer.values(queryset))
+
+
+class Command(BaseCommand):
+    help = 'Compare query counts and rows/s of list serialization with and without the fast paths.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per case; the fastest is reported')
+    
+    def handle(self, *args, **options):
+        rows = options['rows']
+        health_data = HealthData.objects.order_by('-date', '-id')
+        recommendations = Recommendation.objects.order_by('-created_at', '-id')
+        
+        cases = [
+            ('health_data', 'drf', lambda: serialize_instances(HealthDataSerializer, health_data[:rows])),
+            ('health_data', 'drf+select_related', lambda: serialize_instances(HealthDataSerializer, health_data.with_user()[:rows])),
+            ('health_data', 'values', lambda: serialize_values(HealthDataValuesSerializer, health_data[:rows])),
+            ('recommendations', 'drf', lambda: serialize_instances(RecommendationSerializer, recommendations[:rows])),
+            ('recommendations', 'drf+select_related', lambda: serialize_instances(RecommendationSerializer, recommendations.with_user_name()[:rows])),
+            ('recommendations', 'values', lambda: serialize_values(RecommendationValuesSerializer, recommendations[:rows])),
+        ]
+        
+        self.stdout.write(f"{'table':<16} {'path':<20} {'rows':>7} {'queries':>8} {'seconds':>9} {'rows/s':>10}")
+        for table, path, run in cases:
+            best = None
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    count = len(run())
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            
+            rate = count / best if best else 0
+            self.stdout.write(f'{table:<16} {path:<20} {count:>7} {len(queries):>8} {best:>9.4f} {rate:>10.0f}')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from health.models import HealthRollup
+from .rebuild_health_rollups import iter_user_id_chunks
+
+
+class Command(BaseCommand):
+    help = 'Compare HealthRollup windows against raw HealthData aggregates.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='Only check this user ID (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users checked per query')
+        parser.add_argument('--fix', action='store_true', help='Rebuild users with mismatches')
+    
+    def handle(self, *args, **options):
+        checked = 0
+        mismatched_users = set()
+        
+        for chunk in iter_user_id_chunks(options['user_ids'], options['chunk_size']):
+            mismatches = HealthRollup.objects.verify(chunk)
+            for user_id, window_days, field, stored, expected in mismatches:
+                self.stdout.write(f'user {user_id} {window_days}d {field}: stored {stored!r}, expected {expected!r}')
+            
+            users = {mismatch[0] for mismatch in mismatches}
+            if users and options['fix']:
+                HealthRollup.objects.rebuild(users)
+            mismatched_users |= users
+            checked += len(chunk)
+        
+        if mismatched_users and not options['fix']:
+            raise CommandError(f'{len(mismatched_users)} of {checked} users have inconsistent rollups')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} users, {len(mismatched_users)} inconsistent'
+            + (' (rebuilt)' if mismatched_users else '')
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from health.cleanup import cleanup_expired_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete expired recommendations in checkpointed batches.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per transaction')
+        parser.add_argument('--archive', help="'table', 'none', or a .jsonl / .jsonl.gz file to append deleted rows to")
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches, keeping the checkpoint')
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between batches')
+        parser.add_argument('--restart', action='store_true', help='Ignore a saved checkpoint and start a new run')
+    
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(
+                f"Deleted {stats['deleted']} rows in {stats['batches']} batches "
+                f"({stats['rows_per_second']:.0f} rows/s)"
+            )
+        
+        stats = cleanup_expired_recommendations(
+            batch_size=options['batch_size'],
+            archive=options['archive'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+            restart=options['restart'],
+            progress=progress
+        )
+        
+        message = (
+            f"Cleaned up {stats['deleted']} expired recommendations in {stats['elapsed']:.2f}s "
+            f"({stats['rows_per_second']:.0f} rows/s)"
+        )
+        if stats['complete']:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.WARNING(f'{message}; checkpoint saved, run again to resume'))
@@ -0,0 +1,213 @@
+import math
+import random
+import time
+from datetime import datetime, time as day_time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from health import partitions
+from health.bulkload import copy_rows
+from health.models import HealthData, HealthRollup, Recommendation, RecommendationCounter, UserProfile
+
+
+TIMEZONES = [
+    'UTC', 'Europe/London', 'Europe/Berlin', 'Europe/Moscow', 'Asia/Dubai', 'Asia/Kolkata',
+    'Asia/Shanghai', 'Asia/Tokyo', 'Australia/Sydney', 'America/Sao_Paulo', 'America/New_York',
+    'America/Chicago', 'America/Los_Angeles',
+]
+
+RECOMMENDATION_TITLES = {
+    'exercise': ['Take a 20-minute walk', 'Try interval training', 'Stretch after long sitting'],
+    'nutrition': ['Add vegetables to lunch', 'Drink more water', 'Cut late-night snacks'],
+    'sleep': ['Keep a regular bedtime', 'Avoid screens before bed', 'Aim for 7-8 hours of sleep'],
+    'mindfulness': ['Five minutes of breathing', 'Try a short meditation', 'Take a mindful break'],
+    'general': ['Review your weekly progress', 'Schedule a check-up', 'Plan an active weekend'],
+}
+
+# Relative frequencies of recommendation types and priorities
+TYPE_WEIGHTS = {'exercise': 30, 'sleep': 25, 'nutrition': 20, 'mindfulness': 15, 'general': 10}
+PRIORITY_WEIGHTS = {'low': 30, 'medium': 45, 'high': 20, 'urgent': 5}
+
+USER_COLUMNS = [
+    'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+    'is_staff', 'is_active', 'date_joined',
+]
+PROFILE_COLUMNS = ['user_id', 'name', 'email', 'created_at', 'updated_at', 'age', 'timezone', 'is_active']
+HEALTH_DATA_COLUMNS = [
+    'user_id', 'date', 'steps', 'sleep_hours', 'heart_rate_avg', 'activity_level',
+    'calories_burned', 'weight', 'created_at', 'updated_at',
+]
+RECOMMENDATION_COLUMNS = [
+    'user_id', 'date', 'fingerprint', 'title', 'content', 'type', 'priority', 'confidence_score', 'model_version',
+    'is_read', 'is_completed', 'user_rating', 'created_at', 'updated_at', 'expires_at',
+]
+
+
+def activity_level(steps):
+    if steps < 3000:
+        return 'sedentary'
+    if steps < 6000:
+        return 'light'
+    if steps < 10000:
+        return 'moderate'
+    if steps < 15000:
+        return 'vigorous'
+    return 'very_active'
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic users, profiles, HealthData histories and Recommendations with COPY. '
+        'HealthData rows are about users x days x (1 - missing rate): e.g. --users 1000 --days 30 '
+        'for ~30k rows, --users 30000 --days 365 for ~10M.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create')
+        parser.add_argument('--days', type=int, default=90, help='Days of HealthData history per user, ending today')
+        parser.add_argument('--recommendations', type=int, default=20, help='Recommendations per user (at most one per type and day)')
+        parser.add_argument('--missing-rate', type=float, default=0.1, help='Share of days without data')
+        parser.add_argument('--prefix', default='synth', help='Username prefix of generated users')
+        parser.add_argument('--batch-users', type=int, default=1000, help='Users loaded per COPY transaction')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['days'] < 1:
+            raise CommandError('--users and --days must be positive')
+        
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+        self.options = options
+        prefix = options['prefix']
+        
+        first = User.objects.filter(username__startswith=prefix).count()
+        usernames = [f'{prefix}{index:08d}' for index in range(first, first + options['users'])]
+        if User.objects.filter(username__in=usernames[:1]).exists():
+            raise CommandError(f'Users named {prefix}NNNNNNNN exist but are not numbered consecutively')
+        
+        self.ensure_partitions(self.today - timedelta(days=options['days']))
+        
+        totals = {'users': 0, 'health_data': 0, 'recommendations': 0}
+        started = time.monotonic()
+        for offset in range(0, len(usernames), options['batch_users']):
+            batch = usernames[offset:offset + options['batch_users']]
+            with transaction.atomic():
+                totals['users'] += copy_rows(User._meta.db_table, USER_COLUMNS, self.user_rows(batch))
+                users = list(User.objects.filter(username__in=batch).values_list('id', 'username'))
+                user_ids = [user_id for user_id, _ in users]
+                copy_rows(UserProfile._meta.db_table, PROFILE_COLUMNS, self.profile_rows(users))
+                totals['health_data'] += copy_rows(
+                    HealthData._meta.db_table, HEALTH_DATA_COLUMNS, self.health_data_rows(user_ids)
+                )
+                totals['recommendations'] += copy_rows(
+                    Recommendation._meta.db_table, RECOMMENDATION_COLUMNS, self.recommendation_rows(user_ids)
+                )
+            
+            # Bulk rows bypass save(), so derived tables are rebuilt per batch
+            HealthRollup.objects.rebuild(user_ids)
+            RecommendationCounter.objects.refresh(user_ids)
+            
+            elapsed = time.monotonic() - started
+            rows = sum(totals.values())
+            self.stdout.write(
+                f"{totals['users']} users, {totals['health_data']} health rows, "
+                f"{totals['recommendations']} recommendations ({rows / elapsed:.0f} rows/s)"
+            )
+        
+        with connection.cursor() as cursor:
+            for model in (User, UserProfile, HealthData, Recommendation):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {sum(totals.values())} rows in {time.monotonic() - started:.1f}s'
+        ))
+    
+    def ensure_partitions(self, start):
+        """Create monthly partitions covering ``start`` through next month, if the tables are partitioned."""
+        for table in partitions.PARTITIONED_TABLES:
+            if not partitions.is_partitioned(table):
+                continue
+            month = partitions.month_start(start)
+            while month <= partitions.month_start(self.today, 1):
+                partitions.create_partition(table, month)
+                month = partitions.month_start(month, 1)
+    
+    def at(self, day, hour):
+        """Timezone-aware datetime on ``day`` near ``hour``, never in the future."""
+        moment = datetime.combine(day, day_time(hour)) + timedelta(minutes=self.rng.randrange(120))
+        return min(timezone.make_aware(moment, timezone.get_default_timezone()), self.now)
+    
+    def user_rows(self, usernames):
+        for username in usernames:
+            # '!' marks an unusable password
+            yield ('!', False, username, '', '', f'{username}@synthetic.example', False, True, self.now)
+    
+    def profile_rows(self, users):
+        for user_id, username in users:
+            yield (
+                user_id, username, f'{username}@synthetic.example', self.now, self.now,
+                self.rng.randint(25, 70), self.rng.choice(TIMEZONES), True,
+            )
+    
+    def health_data_rows(self, user_ids):
+        rng = self.rng
+        for user_id in user_ids:
+            # Per-user baselines, with day-to-day noise and a weekend effect
+            base_steps = rng.lognormvariate(math.log(7000), 0.4)
+            base_sleep = rng.gauss(7.1, 0.6)
+            base_heart_rate = rng.gauss(68, 7)
+            base_weight = rng.gauss(75, 12) if rng.random() < 0.6 else None
+            
+            for offset in range(self.options['days']):
+                if rng.random() < self.options['missing_rate']:
+                    continue
+                day = self.today - timedelta(days=offset)
+                weekend = day.weekday() >= 5
+                steps = int(min(100000, max(0, rng.gauss(base_steps * (0.8 if weekend else 1.0), base_steps * 0.3))))
+                sleep_hours = round(min(12, max(3, rng.gauss(base_sleep + (0.5 if weekend else 0), 0.7))), 2)
+                heart_rate = int(min(180, max(40, rng.gauss(base_heart_rate, 4)))) if rng.random() > 0.05 else None
+                calories = int(min(10000, max(0, 1600 + steps * 0.04 + rng.gauss(0, 100))))
+                weight = (
+                    round(base_weight + rng.gauss(0, 0.3), 2)
+                    if base_weight and rng.random() < 0.3 else None
+                )
+                created_at = self.at(day, 21)
+                yield (
+                    user_id, day, steps, sleep_hours, heart_rate, activity_level(steps),
+                    calories, weight, created_at, created_at,
+                )
+    
+    def recommendation_rows(self, user_ids):
+        rng = self.rng
+        types, type_weights = zip(*TYPE_WEIGHTS.items())
+        priorities, priority_weights = zip(*PRIORITY_WEIGHTS.items())
+        # Dated before today, so today's HealthData is still unprocessed for batch_process_health_data
+        history = max(1, self.options['days'] - 1)
+        
+        for user_id in user_ids:
+            fingerprints = set()
+            for _ in range(self.options['recommendations']):
+                age_days = rng.randint(1, history)
+                day = self.today - timedelta(days=age_days)
+                rec_type = rng.choices(types, type_weights)[0]
+                # One recommendation per type and day, like the real generators
+                fingerprint = Recommendation.fingerprint_for(user_id, day, 'synthetic-1', rec_type)
+                if fingerprint in fingerprints:
+                    continue
+                fingerprints.add(fingerprint)
+                created_at = self.at(day, 22)
+                is_read = rng.random() < min(0.9, 0.2 + age_days / 30)
+                is_completed = is_read and rng.random() < 0.4
+                yield (
+                    user_id, day, fingerprint, rng.choice(RECOMMENDATION_TITLES[rec_type]),
+                    f'Synthetic {rec_type} recommendation.', rec_type,
+                    rng.choices(priorities, priority_weights)[0],
+                    round(rng.uniform(0.5, 0.99), 2), 'synthetic-1',
+                    is_read, is_completed, rng.randint(1, 5) if is_completed and rng.random() < 0.5 else None,
+                    created_at, created_at,
+                    created_at + timedelta(days=rng.randint(7, 30)) if rng.random() < 0.8 else None,
+                )
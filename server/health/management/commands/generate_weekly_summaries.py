@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from health.reports import write_weekly_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or refresh the weekly summary recommendations of every user with data that week, '
+        'in one pass: one GROUP BY user_id aggregate streamed from a server-side cursor, upserted '
+        'in chunks. The hourly scheduler sends them by user timezone; this is for backfills and '
+        'one-off runs.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--end-date', help='Last day of the week, YYYY-MM-DD (default: today)')
+        parser.add_argument('--shard', help='Only users whose ID is K-1 modulo N (shard K/N, 1-based)')
+        parser.add_argument('--chunk-size', type=int, help='Summaries upserted per statement')
+    
+    def handle(self, *args, **options):
+        try:
+            end_date = date.fromisoformat(options['end_date']) if options['end_date'] else timezone.now().date()
+        except ValueError:
+            raise CommandError('--end-date must look like YYYY-MM-DD')
+        
+        shard, shards = None, 1
+        if options['shard']:
+            try:
+                shard, shards = (int(part) for part in options['shard'].split('/'))
+            except ValueError:
+                raise CommandError('--shard must look like K/N, e.g. 2/4')
+            if not 1 <= shard <= shards:
+                raise CommandError('--shard K/N needs 1 <= K <= N')
+            shard -= 1
+        
+        stats = write_weekly_summaries(end_date, shard=shard, shards=shards, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['users']} weekly summaries ({stats['created']} new) for the week ending {end_date} "
+            f"in {stats['elapsed']:.2f}s ({stats['rows_per_second']:.0f} users/s)"
+        ))
@@ -0,0 +1,125 @@
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from health.imports import clear_checkpoints, import_file, queue_imported, read_records
+
+
+def report_progress(stats):
+    # Module level, so worker processes can call it
+    sys.stdout.write(
+        f"[shard {stats['shard']}] {stats['records']} records read, {stats['imported']} rows imported "
+        f"({stats['created']} new), {stats['invalid']} invalid ({stats['rows_per_second']:.0f} rows/s)\n"
+    )
+    sys.stdout.flush()
+
+
+def import_shard(path, shard, shards, **options):
+    stats = import_file(path, shard=shard, shards=shards, progress=lambda stats: report_progress(
+        dict(stats, shard=f'{shard + 1}/{shards}')
+    ), **options)
+    connections.close_all()
+    return stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical health data from a CSV or JSON Lines file (optionally .gz), e.g. a '
+        'Health Connect export: one record per user and day with user_id (username or ID), date, '
+        'steps, sleep_hours, heart_rate_avg and activity_level. Records are validated like the '
+        'ingest endpoint, merged into health_data in COPY-staged chunks and checkpointed, so an '
+        'interrupted import resumes when run again. AI processing is queued once, at the end.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import (.csv, .jsonl or .ndjson, optionally .gz)')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes, each importing a shard of the users')
+        parser.add_argument(
+            '--shard', help="Only import shard K/N (1-based), e.g. to spread one import over several hosts"
+        )
+        parser.add_argument('--chunk-size', type=int, help='Records validated and merged per transaction')
+        parser.add_argument('--max-chunks', type=int, help='Stop each shard after this many chunks, keeping the checkpoint')
+        parser.add_argument('--errors', help='Append invalid records to this JSON Lines file (one file per shard)')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved checkpoints and start over')
+        parser.add_argument('--no-enqueue', action='store_true', help='Do not queue AI processing of the imported rows')
+    
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            next(read_records(path), None)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        
+        if options['shard']:
+            try:
+                shard, shards = (int(part) for part in options['shard'].split('/'))
+            except ValueError:
+                raise CommandError('--shard must look like K/N, e.g. 2/4')
+            if not 1 <= shard <= shards:
+                raise CommandError('--shard K/N needs 1 <= K <= N')
+            selected = [shard - 1]
+        else:
+            shards = max(1, options['workers'])
+            selected = range(shards)
+        
+        import_options = {
+            'chunk_size': options['chunk_size'],
+            'max_chunks': options['max_chunks'],
+            'restart': options['restart'],
+        }
+        
+        def errors_path(shard):
+            if not options['errors']:
+                return None
+            return options['errors'] if shards == 1 else f"{options['errors']}.{shard + 1}"
+        
+        if len(selected) == 1:
+            results = [import_shard(path, selected[0], shards, errors_path=errors_path(selected[0]), **import_options)]
+        else:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(len(selected), mp_context=multiprocessing.get_context('fork')) as pool:
+                futures = [
+                    pool.submit(import_shard, path, shard, shards, errors_path=errors_path(shard), **import_options)
+                    for shard in selected
+                ]
+                results = []
+                failures = []
+                for shard, future in zip(selected, futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        failures.append(f'shard {shard + 1}/{shards}: {e}')
+            if failures:
+                raise CommandError(
+                    'Import failed, completed chunks are checkpointed; run again to resume. ' + '; '.join(failures)
+                )
+        
+        imported = sum(stats['imported'] for stats in results)
+        created = sum(stats['created'] for stats in results)
+        invalid = sum(stats['invalid'] for stats in results)
+        elapsed = max(stats['elapsed'] for stats in results)
+        message = (
+            f"Imported {imported} rows ({created} new), {invalid} invalid records, "
+            f"in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+        if not all(stats['complete'] for stats in results):
+            self.stdout.write(self.style.WARNING(f'{message}; checkpoint saved, run again to resume'))
+            return
+        self.stdout.write(self.style.SUCCESS(message))
+        
+        if options['shard']:
+            self.stdout.write(
+                f"Shard {options['shard']} done. Once all shards are, run with --workers {shards} and "
+                f"without --shard to queue AI processing and clear checkpoints (completed shards are "
+                f"not imported again)."
+            )
+            return
+        
+        if not options['no_enqueue']:
+            queued = queue_imported(results)
+            self.stdout.write(f'Queued {queued} health data records for AI processing')
+        clear_checkpoints(path)
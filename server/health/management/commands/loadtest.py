@@ -0,0 +1,126 @@
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+ENDPOINTS = ('summary', 'recommendations', 'ingest')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the health summary, recommendation list and ingest endpoints of running servers '
+        'and compare throughput and tail latency. Start the same code under both servers, e.g. '
+        '"gunicorn synaptica.wsgi -w 4 --threads 8 -b :8000" and '
+        '"HEALTH_ASYNC_VIEWS=true uvicorn synaptica.asgi:application --workers 4 --port 8001", then run '
+        '"manage.py loadtest wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001 --token ... --user-id ...".'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='label=base_url of each server, e.g. asgi=http://127.0.0.1:8001')
+        parser.add_argument('--token', required=True, help='API token of the user the requests run as')
+        parser.add_argument('--user-id', type=int, required=True, help='ID of that user')
+        parser.add_argument('--username', help='user_id sent in ingest payloads (defaults to --user-id)')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Endpoints to test (default: all)')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and target')
+        parser.add_argument('--concurrency', type=int, default=64, help='Concurrent client connections')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--bypass-cache', action='store_true', help='Send X-Cache-Bypass: 1 on reads')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+    
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            label, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f'Invalid target "{target}", expected label=http://host:port')
+            targets.append((label, url.rstrip('/')))
+        
+        results = []
+        self.stdout.write(
+            f"{'target':<10} {'endpoint':<16} {'requests':>8} {'errors':>7} {'req/s':>9} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for label, url in targets:
+            for endpoint in options['endpoint'] or ENDPOINTS:
+                result = self.run(url, endpoint, options)
+                result.update(target=label, endpoint=endpoint)
+                results.append(result)
+                self.stdout.write(
+                    f"{label:<10} {endpoint:<16} {result['requests']:>8} {result['errors']:>7} "
+                    f"{result['requests_per_second']:>9.1f} {result['p50_ms']!s:>8} {result['p95_ms']!s:>8} "
+                    f"{result['p99_ms']!s:>8} {result['max_ms']!s:>8}"
+                )
+        
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+    
+    def make_request(self, url, endpoint, options):
+        """Return a urllib Request for one call of ``endpoint``."""
+        headers = {'Authorization': f"Token {options['token']}", 'Accept': 'application/json'}
+        user_id = options['user_id']
+        
+        if endpoint == 'ingest':
+            # Spread writes over a year so concurrent upserts rarely hit the same row
+            payload = {
+                'user_id': options['username'] or str(user_id),
+                'date': (date.today() - timedelta(days=random.randrange(365))).isoformat(),
+                'steps': random.randint(0, 20000),
+                'sleep_hours': round(random.uniform(4, 10), 1),
+                'heart_rate_avg': random.randint(55, 95),
+                'activity_level': random.choice(['sedentary', 'light', 'moderate', 'vigorous', 'very_active']),
+            }
+            headers['Content-Type'] = 'application/json'
+            return urllib.request.Request(
+                f'{url}/api/data/health', data=json.dumps(payload).encode(), headers=headers, method='POST'
+            )
+        
+        if options['bypass_cache']:
+            headers['X-Cache-Bypass'] = '1'
+        path = 'health-summary' if endpoint == 'summary' else 'recommendations'
+        return urllib.request.Request(f'{url}/api/user/{user_id}/{path}', headers=headers)
+    
+    def run(self, url, endpoint, options):
+        """Send ``--requests`` calls over ``--concurrency`` connections; return throughput and latencies."""
+        def call(_):
+            request = self.make_request(url, endpoint, options)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    ok = response.status < 400
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return ok, time.perf_counter() - started
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            outcomes = list(pool.map(call, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        
+        latencies = sorted(round(seconds * 1000, 1) for ok, seconds in outcomes if ok)
+        return {
+            'requests': len(outcomes),
+            'errors': sum(1 for ok, _ in outcomes if not ok),
+            'concurrency': options['concurrency'],
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0,
+            'mean_ms': round(statistics.fmean(latencies), 1) if latencies else None,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+        }
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from health.partitions import maintain_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions and detach or drop expired ones.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.HEALTH_PARTITION_MONTHS_AHEAD,
+            help='Create partitions through this many months ahead'
+        )
+        parser.add_argument(
+            '--retain-months', type=int, default=settings.HEALTH_PARTITION_RETENTION_MONTHS,
+            help='Detach partitions that ended more than this many months ago'
+        )
+        parser.add_argument(
+            '--drop', action='store_true', default=settings.HEALTH_PARTITION_DROP_DETACHED,
+            help='Drop detached partitions instead of keeping them as standalone tables'
+        )
+    
+    def handle(self, *args, **options):
+        try:
+            report = maintain_partitions(
+                options['months_ahead'],
+                retain_months=options['retain_months'],
+                drop=options['drop']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        
+        if not report:
+            self.stdout.write(self.style.WARNING('No partitioned tables; run migrate on PostgreSQL first'))
+        for table, changes in report.items():
+            for name in changes['created']:
+                self.stdout.write(f'Created {name}')
+            for name in changes['detached']:
+                self.stdout.write(f"{'Dropped' if options['drop'] else 'Detached'} {name}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{table}: {len(changes['created'])} created, {len(changes['detached'])} removed"
+            ))
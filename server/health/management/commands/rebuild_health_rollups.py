@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from health.models import HealthRollup
+
+
+def iter_user_id_chunks(user_ids, chunk_size):
+    """Yield lists of user IDs, either the given ones or all users in ID order."""
+    if user_ids:
+        ids = iter(user_ids)
+    else:
+        ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    
+    chunk = []
+    for user_id in ids:
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Rebuild HealthRollup windows from raw HealthData.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='Only rebuild this user ID (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users rebuilt per query')
+    
+    def handle(self, *args, **options):
+        total = 0
+        for chunk in iter_user_id_chunks(options['user_ids'], options['chunk_size']):
+            HealthRollup.objects.rebuild(chunk)
+            total += len(chunk)
+            self.stdout.write(f'Rebuilt rollups for {total} users')
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {total} users'))
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from health import metrics, outbox
+from health.models import OutboxMessage
+
+
+class Command(BaseCommand):
+    help = (
+        'Publish due Celery task messages from the task outbox. Runs in a loop, polling every '
+        '--interval seconds, as a dedicated relay process; --once publishes what is due and exits.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Publish due messages once and exit')
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--batch-size', type=int, help='Messages published per transaction')
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.HEALTH_OUTBOX_BATCH_SIZE
+        while True:
+            close_old_connections()
+            stats = outbox.relay(batch_size=batch_size)
+            if metrics.publish_due():
+                metrics.publish_safely()
+            if stats['published'] or stats['failed']:
+                self.stdout.write(
+                    f"Published {stats['published']} messages in {stats['batches']} batches "
+                    f"({stats['elapsed']:.2f}s), {stats['failed']} failed"
+                )
+            if options['once']:
+                break
+            # relay() returns once nothing is due; after a failed publish, wait for the broker
+            time.sleep(max(options['interval'], 1) if stats['failed'] else options['interval'])
+        
+        backlog = OutboxMessage.objects.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Outbox: {backlog['depth']} messages, {backlog['due']} due, oldest due waited {backlog['lag_seconds']}s"
+        ))
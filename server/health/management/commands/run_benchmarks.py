@@ -0,0 +1,264 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from health import cleanup, reports
+from health.models import HealthData, Recommendation
+from health.pagination import estimate_count
+from health.tasks import batch_process_health_data, generate_weekly_summary
+from synaptica.celery import app
+
+
+CASES = (
+    'ingest', 'summary', 'summary_cached', 'recommendations', 'recommendations_cached',
+    'batch_process', 'cleanup', 'weekly_summary', 'weekly_summary_bulk',
+)
+JOBS = ('batch_process', 'cleanup', 'weekly_summary', 'weekly_summary_bulk')
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the hot paths (ingest, health summary, recommendation list, '
+        'batch_process_health_data, cleanup, weekly summaries per user and in one pass) against '
+        'the current database, e.g. one filled by generate_synthetic_data. Every case runs in a transaction that is rolled back, so runs are '
+        'repeatable; on_commit callbacks (cache and token invalidation, counter refreshes) are run inline and timed with their '
+        'operation, since the rollback would otherwise skip them. Results (throughput, latency percentiles, queries per operation) can be saved '
+        'as a JSON baseline and compared with a previous one.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', choices=CASES, help='Cases to run (default: all)')
+        parser.add_argument('--iterations', type=int, default=200, help='Requests per request case')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests before each request case')
+        parser.add_argument('--users', type=int, default=100, help='Users sampled for request cases')
+        parser.add_argument('--prefix', default='synth', help='Username prefix of the users to sample')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Compare with a baseline JSON file written by --output')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Relative change of p95 latency or throughput counted as a regression'
+        )
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions')
+    
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        # Sampled with the seeded generator, so query counts are comparable between runs
+        candidates = sorted(
+            User.objects.filter(username__startswith=options['prefix'], health_data__isnull=False)
+            .distinct().values_list('id', flat=True)
+        )
+        user_ids = self.rng.sample(candidates, min(options['users'], len(candidates)))
+        if not user_ids:
+            raise CommandError(f"No users named {options['prefix']}* with health data, run generate_synthetic_data first")
+        
+        results = {
+            'generated_at': timezone.now().isoformat(),
+            'commit': self.git_commit(),
+            'database': connection.vendor,
+            'dataset': {
+                'users': estimate_count(User.objects.all()),
+                'health_data': estimate_count(HealthData.objects.all()),
+                'recommendations': estimate_count(Recommendation.objects.all()),
+                'sampled_users': len(user_ids),
+            },
+            'cases': {},
+        }
+        
+        self.stdout.write(
+            'Cases run in rolled-back transactions; on_commit callbacks run inline and are timed with their operation.'
+        )
+        self.stdout.write(
+            f"{'case':<24} {'ops':>6} {'ops/s':>9} {'rows/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries/op':>10}"
+        )
+        for case in options['case'] or CASES:
+            result = self.run_case(case, user_ids)
+            results['cases'][case] = result
+            self.stdout.write(
+                f"{case:<24} {result['operations']:>6} {result['ops_per_second']:>9.1f} "
+                f"{result.get('rows_per_second', ''):>9} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+                f"{result['p99_ms']:>8} {result['queries_per_op']:>10}"
+            )
+        
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Baseline written to {options['output']}")
+        
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                regressions = self.compare(json.load(baseline), results)
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regressions: {', '.join(regressions)}")
+    
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    
+    def run_case(self, case, user_ids):
+        """Run ``case`` in a rolled-back transaction and summarize its timings."""
+        timings = []
+        queries = []
+        rows = None
+        try:
+            with transaction.atomic():
+                if case in JOBS:
+                    rows = self.run_job(case, timings, queries)
+                else:
+                    self.run_requests(case, user_ids, timings, queries)
+                raise Rollback()
+        except Rollback:
+            pass
+        
+        latencies = sorted(seconds * 1000 for seconds in timings)
+        total = sum(timings)
+        result = {
+            'operations': len(timings),
+            'seconds': round(total, 4),
+            'ops_per_second': round(len(timings) / total, 1) if total else 0,
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'queries_per_op': round(statistics.fmean(queries), 1),
+            'max_queries': max(queries),
+        }
+        if rows is not None:
+            result['rows'] = rows
+            result['rows_per_second'] = round(rows / total) if total else 0
+        return result
+    
+    def run_on_commit(self):
+        """
+        Run the on_commit callbacks registered inside the block when it exits, as a
+        commit would; the case's transaction is rolled back, which discards them.
+        """
+        return TestCase.captureOnCommitCallbacks(execute=True)
+    
+    def run_requests(self, case, user_ids, timings, queries):
+        client = APIClient()
+        tokens = {user_id: Token.objects.get_or_create(user_id=user_id)[0].key for user_id in user_ids}
+        usernames = dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+        today = timezone.localdate()
+        
+        def request(user_id):
+            client.credentials(HTTP_AUTHORIZATION=f'Token {tokens[user_id]}')
+            if case == 'ingest':
+                day = (today - timedelta(days=self.rng.randrange(30))).isoformat()
+                return client.post('/api/data/health', {
+                    'user_id': usernames[user_id],
+                    'date': day,
+                    'steps': self.rng.randint(0, 20000),
+                    'sleep_hours': round(self.rng.uniform(4, 10), 1),
+                    'heart_rate_avg': self.rng.randint(55, 95),
+                    'activity_level': self.rng.choice(['sedentary', 'light', 'moderate', 'vigorous']),
+                }, format='json')
+            path = 'health-summary' if case.startswith('summary') else 'recommendations'
+            headers = {} if case.endswith('_cached') else {'HTTP_X_CACHE_BYPASS': '1'}
+            return client.get(f'/api/user/{user_id}/{path}', **headers)
+        
+        # Ingest is measured up to the AI task's outbox message, which is rolled back
+        # with the case, not the task itself; its on_commit cache invalidation is included
+        for _ in range(self.options['warmup']):
+            request(self.rng.choice(user_ids))
+        
+        for _ in range(self.options['iterations']):
+            user_id = self.rng.choice(user_ids)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                with self.run_on_commit():
+                    response = request(user_id)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                raise CommandError(f'{case} returned {response.status_code}: {response.content[:200]}')
+    
+    def run_job(self, case, timings, queries):
+        """Run a batch job once; returns the rows it processed."""
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            with self.run_on_commit():
+                if case == 'batch_process':
+                    rows = HealthData.objects.filter(date=timezone.now().date()).count()
+                    # The dispatched process_health_data_batch tasks run inline and are included
+                    eager = app.conf.task_always_eager
+                    app.conf.task_always_eager = True
+                    try:
+                        batch_process_health_data()
+                    finally:
+                        app.conf.task_always_eager = eager
+                elif case == 'cleanup':
+                    rows = cleanup.cleanup_expired_recommendations(archive='table', pause=0, restart=True)['deleted']
+                elif case == 'weekly_summary':
+                    # The per-user task for every user with data this week
+                    end_date = timezone.now().date()
+                    user_ids = list(
+                        HealthData.objects.filter(
+                            date__range=[end_date - timedelta(days=reports.WEEKLY_SUMMARY_DAYS), end_date]
+                        ).order_by().values_list('user_id', flat=True).distinct()
+                    )
+                    rows = sum(
+                        1 for user_id in user_ids
+                        if generate_weekly_summary(user_id, end_date).startswith('Generated')
+                    )
+                else:
+                    rows = reports.write_weekly_summaries(timezone.now().date())['users']
+            timings.append(time.perf_counter() - started)
+        queries.append(len(captured))
+        return rows
+    
+    def compare(self, baseline, results):
+        """Print changes against ``baseline``; returns the names of regressed metrics."""
+        tolerance = self.options['tolerance']
+        regressions = []
+        self.stdout.write(f"\nCompared with {baseline.get('commit') or 'baseline'} of {baseline['generated_at']}:")
+        for case, current in results['cases'].items():
+            previous = baseline['cases'].get(case)
+            if previous is None:
+                continue
+            checks = [
+                ('p95_ms', 1), ('ops_per_second', -1), ('rows_per_second', -1), ('queries_per_op', 1),
+            ]
+            for metric, worse in checks:
+                if metric not in current or not previous.get(metric):
+                    continue
+                change = (current[metric] - previous[metric]) / previous[metric]
+                # Query counts are deterministic, so any increase is a regression
+                limit = 0 if metric == 'queries_per_op' else tolerance
+                regressed = change * worse > limit
+                if regressed:
+                    regressions.append(f'{case}.{metric}')
+                self.stdout.write(
+                    f"  {case:<24} {metric:<16} {previous[metric]:>10} -> {current[metric]:>10} "
+                    f"({change:+.1%}){'  REGRESSION' if regressed else ''}"
+                )
+        return regressions
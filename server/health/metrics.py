@@ -0,0 +1,413 @@
+"""
+Request, database and Celery task metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records, per route (the URL pattern, e.g.
+``api/user/<int:user_id>/recommendations``) and method: a request counter by
+status, latency, DB query count and DB time, and response size histograms.
+Requests that run more than ``HEALTH_METRICS_QUERY_BUDGET`` queries are counted
+and logged. Celery signal handlers record, per task: runs by outcome, the wait
+between publishing and start, run time, DB queries and rows written.
+
+Queries are counted by an execute wrapper installed on every database
+connection. It adds to the observer of the current request or task, which is
+kept in a context variable so queries run through ``sync_to_async`` by async
+views are counted too. Rows written are the row counts of non-SELECT
+statements.
+
+Every process keeps its own registry and publishes a snapshot of it to the
+shared cache (``HEALTH_CACHE_ALIAS``): web processes at most every
+``HEALTH_METRICS_PUBLISH_INTERVAL`` seconds, Celery workers after every task.
+The ``/metrics`` endpoint sums the snapshots of all live processes, so it can be
+scraped from any web worker. Snapshots of stopped processes expire, after which
+their counts drop out of the totals (Prometheus treats that as a counter reset).
+Gauges of shared state, such as the write-behind buffer depth, are read from the
+database at scrape time instead. Scrapers authenticate with the ``HEALTH_METRICS_TOKEN`` bearer secret.
+"""
+import contextvars
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'health_http_requests_total': ('counter', 'HTTP requests by route, method and status.', None),
+    'health_http_request_duration_seconds': ('histogram', 'HTTP request latency.', LATENCY_BUCKETS),
+    'health_http_db_queries': ('histogram', 'Database queries per HTTP request.', QUERY_BUCKETS),
+    'health_http_db_duration_seconds': ('histogram', 'Database time per HTTP request.', LATENCY_BUCKETS),
+    'health_http_response_size_bytes': ('histogram', 'HTTP response body size.', SIZE_BUCKETS),
+    'health_http_query_budget_exceeded_total': (
+        'counter', 'HTTP requests that ran more queries than HEALTH_METRICS_QUERY_BUDGET.', None
+    ),
+    'health_task_runs_total': ('counter', 'Celery task runs by outcome (success, failure, retry).', None),
+    'health_task_queue_wait_seconds': ('histogram', 'Time between publishing a task and its start.', TASK_BUCKETS),
+    'health_task_duration_seconds': ('histogram', 'Celery task run time.', TASK_BUCKETS),
+    'health_task_db_queries_total': ('counter', 'Database queries run by Celery tasks.', None),
+    'health_task_rows_written_total': ('counter', 'Rows inserted, updated or deleted by Celery tasks.', None),
+    'health_ai_dispatch_total': (
+        'counter', 'AI processing requests by outcome (queued, or coalesced into a pending run).', None
+    ),
+    'health_batch_process_batches_total': (
+        'counter', 'Health data batches of the AI sweep by outcome (queued, or coalesced into a waiting one).', None
+    ),
+    'health_batch_process_rows_total': ('counter', 'Health data rows in batches of the AI sweep, by outcome.', None),
+    'health_reports_queued_total': ('counter', 'Users whose scheduled report was queued, by report.', None),
+    'health_anomalies_total': ('counter', 'Anomalous user-day metrics flagged, by metric and direction.', None),
+    'health_ingest_buffer_flushed_total': ('counter', 'Buffered health records flushed into HealthData.', None),
+    'health_ingest_buffer_flush_lag_seconds': (
+        'histogram', 'Age of the oldest record of a write-behind buffer batch when it is flushed.', TASK_BUCKETS
+    ),
+    'health_ingest_buffer_depth': ('gauge', 'Health records waiting in the write-behind buffer.', None),
+    'health_ingest_buffer_lag_seconds': ('gauge', 'Age of the oldest record in the write-behind buffer.', None),
+    'health_outbox_messages_total': ('counter', 'Outbox messages by relay outcome (published, failed).', None),
+    'health_outbox_lag_seconds': (
+        'histogram', 'Time between an outbox message becoming due and its publishing.', TASK_BUCKETS
+    ),
+}
+
+PROCESS_KEY = 'health:metrics:process:{process}'
+PROCESSES_KEY = 'health:metrics:processes'
+PUBLISHED_AT_HEADER = 'health_published_at'
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_state = {'pid': os.getpid(), 'published': 0.0}
+_tasks = {}  # task id -> (observer, context token, started)
+
+_observer = contextvars.ContextVar('health_metrics_observer', default=None)
+
+
+class Observer:
+    """Database work of one request or task."""
+    __slots__ = ('queries', 'seconds', 'rows', 'failed')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.failed = False
+
+
+def label_set(**labels):
+    """Label tuple of a series, as ``inc`` and ``observe`` take it."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _check_fork():
+    # A forked child (Celery prefork, gunicorn --preload) starts from a copy of the parent's registry
+    pid = os.getpid()
+    if _state['pid'] != pid:
+        _counters.clear()
+        _histograms.clear()
+        _state.update(pid=pid, published=0.0)
+
+
+def inc(name, labels, value=1):
+    with _lock:
+        _check_fork()
+        _counters[name, labels] = _counters.get((name, labels), 0) + value
+
+
+def observe(name, labels, value):
+    buckets = METRICS[name][2]
+    with _lock:
+        _check_fork()
+        series = _histograms.get((name, labels))
+        if series is None:
+            series = _histograms[name, labels] = [0] * (len(buckets) + 2)
+        series[bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+
+def mark_failed():
+    """Record the running task as failed; for tasks that catch their own exceptions."""
+    observer = _observer.get()
+    if observer is not None:
+        observer.failed = True
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current observer."""
+    observer = _observer.get()
+    if observer is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        observer.queries += 1
+        observer.seconds += time.perf_counter() - started
+        rowcount = getattr(context['cursor'], 'rowcount', -1)
+        if rowcount > 0 and sql.lstrip()[:6].upper() != 'SELECT':
+            observer.rows += rowcount
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _process_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def snapshot():
+    """Return a copy of this process's registry."""
+    with _lock:
+        _check_fork()
+        return {
+            'counters': dict(_counters),
+            'histograms': {key: list(series) for key, series in _histograms.items()},
+        }
+
+
+def publish():
+    """Store this process's snapshot in the shared cache and register the process."""
+    cache = caches[settings.HEALTH_CACHE_ALIAS]
+    now = time.time()
+    ttl = settings.HEALTH_METRICS_PROCESS_TTL
+    process = _process_id()
+    _state['published'] = now
+
+    cache.set(PROCESS_KEY.format(process=process), snapshot(), timeout=ttl)
+    # Read-modify-write: a process dropped by a concurrent update re-registers on its next publish
+    processes = cache.get(PROCESSES_KEY) or {}
+    processes = {name: seen for name, seen in processes.items() if seen > now - ttl}
+    processes[process] = now
+    cache.set(PROCESSES_KEY, processes, timeout=None)
+
+
+def publish_safely():
+    try:
+        publish()
+    except Exception as e:
+        logger.warning(f"Failed to publish metrics: {str(e)}")
+
+
+def publish_due():
+    return time.time() - _state['published'] >= settings.HEALTH_METRICS_PUBLISH_INTERVAL
+
+
+def read_gauges():
+    """Gauges are read from the database when scraped, not kept per process."""
+    from .models import BufferedHealthData
+
+    buffer = BufferedHealthData.objects.stats()
+    return {
+        ('health_ingest_buffer_depth', ()): buffer['depth'],
+        ('health_ingest_buffer_lag_seconds', ()): buffer['lag_seconds'],
+    }
+
+
+def collect():
+    """Return the registries of all live processes summed into one snapshot, plus the gauges."""
+    cache = caches[settings.HEALTH_CACHE_ALIAS]
+    own = _process_id()
+    processes = [name for name in (cache.get(PROCESSES_KEY) or {}) if name != own]
+    snapshots = [snapshot()]
+    snapshots.extend(cache.get_many([PROCESS_KEY.format(process=name) for name in processes]).values())
+
+    total = {'counters': {}, 'histograms': {}, 'gauges': read_gauges()}
+    for data in snapshots:
+        for key, value in data['counters'].items():
+            if key[0] not in METRICS:
+                continue
+            total['counters'][key] = total['counters'].get(key, 0) + value
+        for key, series in data['histograms'].items():
+            # Skip series from processes running code with other metrics or buckets
+            if key[0] not in METRICS or len(series) != len(METRICS[key[0]][2]) + 2:
+                continue
+            summed = total['histograms'].setdefault(key, [0] * len(series))
+            for index, value in enumerate(series):
+                summed[index] += value
+    return total
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value != int(value):
+        return repr(value)
+    return str(int(value))
+
+
+def render(data=None):
+    """Render ``data`` (default: collect()) in the Prometheus text exposition format."""
+    data = collect() if data is None else data
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if kind in ('counter', 'gauge'):
+            values = data['counters'] if kind == 'counter' else data.get('gauges', {})
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        else:
+            series = sorted((labels, value) for (metric, labels), value in data['histograms'].items() if metric == name)
+        if not series:
+            continue
+
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels((*labels, ("le", str(bound))))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(value[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Record latency, DB work and response size of every request by route."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        observer = Observer()
+        token = _observer.set(observer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _observer.reset(token)
+        self.record(request, response, observer, time.perf_counter() - started)
+        if publish_due():
+            publish_safely()
+        return response
+
+    async def __acall__(self, request):
+        observer = Observer()
+        token = _observer.set(observer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _observer.reset(token)
+        self.record(request, response, observer, time.perf_counter() - started)
+        if publish_due():
+            # Keep the cache round trip off the event loop
+            await sync_to_async(publish_safely, thread_sensitive=False)()
+        return response
+
+    def record(self, request, response, observer, elapsed):
+        match = request.resolver_match
+        route = match.route if match else '<unmatched>'
+        labels = label_set(route=route, method=request.method)
+
+        inc('health_http_requests_total', label_set(route=route, method=request.method, status=response.status_code))
+        observe('health_http_request_duration_seconds', labels, elapsed)
+        observe('health_http_db_queries', labels, observer.queries)
+        observe('health_http_db_duration_seconds', labels, observer.seconds)
+
+        if observer.queries > settings.HEALTH_METRICS_QUERY_BUDGET:
+            inc('health_http_query_budget_exceeded_total', labels)
+            logger.warning(
+                f"{request.method} {request.path} ({route}) ran {observer.queries} queries, "
+                f"budget is {settings.HEALTH_METRICS_QUERY_BUDGET}"
+            )
+
+        if response.streaming:
+            # Exports: the size is only known once the body has been sent
+            response.streaming_content = self.count_streamed(response, labels)
+        else:
+            observe('health_http_response_size_bytes', labels, len(response.content))
+
+    def count_streamed(self, response, labels):
+        content = response.streaming_content
+        if response.is_async:
+            async def counted():
+                size = 0
+                try:
+                    async for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    observe('health_http_response_size_bytes', labels, size)
+        else:
+            def counted():
+                size = 0
+                try:
+                    for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    observe('health_http_response_size_bytes', labels, size)
+        return counted()
+
+
+@before_task_publish.connect
+def stamp_published_at(sender=None, headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def start_task(sender=None, task_id=None, task=None, **kwargs):
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at:
+        observe('health_task_queue_wait_seconds', label_set(task=task.name), max(0.0, time.time() - published_at))
+
+    observer = Observer()
+    _tasks[task_id] = (observer, _observer.set(observer), time.perf_counter())
+
+
+@task_postrun.connect
+def finish_task(sender=None, task_id=None, task=None, state=None, **kwargs):
+    started = _tasks.pop(task_id, None)
+    if started is None:
+        return
+    observer, token, started_at = started
+    _observer.reset(token)
+
+    labels = label_set(task=task.name)
+    if state == 'RETRY':
+        outcome = 'retry'
+    elif state == 'FAILURE' or observer.failed:
+        outcome = 'failure'
+    else:
+        outcome = 'success'
+    inc('health_task_runs_total', label_set(task=task.name, outcome=outcome))
+    observe('health_task_duration_seconds', labels, time.perf_counter() - started_at)
+    inc('health_task_db_queries_total', labels, observer.queries)
+    inc('health_task_rows_written_total', labels, observer.rows)
+
+    # Workers may sit idle for long, so publish after every task
+    publish_safely()
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:06
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BufferedHealthData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Date of the health data')),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Validated health metrics')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buffered_health_data', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Buffered Health Data',
+                'verbose_name_plural': 'Buffered Health Data',
+                'db_table': 'health_data_buffer',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:08
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build indexes without locking writes on large tables
+    atomic = False
+
+    dependencies = [
+        ('health', '0002_health_data_buffer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='healthdata',
+            index=models.Index(fields=['-date', '-id'], name='health_data_date_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='rec_user_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(fields=['-created_at', '-id'], name='rec_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:12
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0004_recommendation_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HealthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveSmallIntegerField(help_text='Length of the trailing window')),
+                ('as_of', models.DateField(help_text='Last day covered by the window')),
+                ('days', models.PositiveIntegerField(default=0, help_text='Days with health data')),
+                ('steps_sum', models.BigIntegerField(default=0)),
+                ('sleep_hours_sum', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10)),
+                ('heart_rate_sum', models.BigIntegerField(default=0)),
+                ('heart_rate_days', models.PositiveIntegerField(default=0, help_text='Days with a heart rate reading')),
+                ('activity_counts', models.JSONField(default=dict, help_text='Days per activity level')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='health_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Health Rollup',
+                'verbose_name_plural': 'Health Rollups',
+                'db_table': 'health_rollups',
+                'unique_together': {('user', 'window_days')},
+            },
+        ),
+    ]
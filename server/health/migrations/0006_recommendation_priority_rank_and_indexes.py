@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:14
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build indexes without locking writes on large tables
+    atomic = False
+
+    dependencies = [
+        ('health', '0005_health_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recommendation',
+            options={'ordering': ['-created_at', '-priority_rank'], 'verbose_name': 'Recommendation', 'verbose_name_plural': 'Recommendations'},
+        ),
+        migrations.AddField(
+            model_name='recommendation',
+            name='priority_rank',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(priority='low', then=models.Value(1)), models.When(priority='medium', then=models.Value(2)), models.When(priority='high', then=models.Value(3)), models.When(priority='urgent', then=models.Value(4)), default=models.Value(0)), output_field=models.SmallIntegerField()),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='rec_user_unread_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['user', '-created_at'], name='rec_user_pending_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(fields=['user', '-priority_rank', '-created_at'], name='rec_user_priority_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['expires_at'], name='rec_expires_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:16
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build indexes without locking writes on large tables
+    atomic = False
+
+    dependencies = [
+        ('health', '0006_recommendation_priority_rank_and_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='recommendation',
+            index=models.Index(fields=['user', 'date'], name='rec_user_date_idx'),
+        ),
+    ]
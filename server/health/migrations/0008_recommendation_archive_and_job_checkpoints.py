@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:18
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0007_recommendation_user_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('state', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Job Checkpoint',
+                'verbose_name_plural': 'Job Checkpoints',
+                'db_table': 'job_checkpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecommendationArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recommendation_id', models.BigIntegerField(help_text='ID of the deleted recommendation', unique=True)),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('date', models.DateField()),
+                ('title', models.CharField(max_length=255)),
+                ('type', models.CharField(max_length=20)),
+                ('priority', models.CharField(max_length=10)),
+                ('confidence_score', models.DecimalField(blank=True, decimal_places=2, max_digits=3, null=True)),
+                ('model_version', models.CharField(blank=True, max_length=50, null=True)),
+                ('is_read', models.BooleanField()),
+                ('user_rating', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archived Recommendation',
+                'verbose_name_plural': 'Archived Recommendations',
+                'db_table': 'recommendation_archive',
+            },
+        ),
+    ]
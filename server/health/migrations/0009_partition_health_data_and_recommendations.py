@@ -0,0 +1,160 @@
+from datetime import date
+
+from django.db import migrations
+
+
+# This migration is the only owner of the conversion DDL; health.partitions only
+# maintains partitions of tables that are already partitioned
+TABLES = ('health_data', 'recommendations')
+PARTITION_KEY = 'date'
+MONTHS_AHEAD = 3
+
+
+def month_start(day, months=0):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def insertable_columns(cursor, table):
+    cursor.execute(
+        'SELECT column_name FROM information_schema.columns '
+        "WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER' "
+        'ORDER BY ordinal_position',
+        [table]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_definitions(cursor, table):
+    """Primary key, unique and foreign key constraints, and other index definitions of ``table``."""
+    cursor.execute(
+        'SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint '
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f')",
+        [table]
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index '
+        'WHERE indrelid = to_regclass(%s) '
+        'AND indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = to_regclass(%s))',
+        [table, table]
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    return constraints, indexes
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def partition(cursor, qn, table):
+    """Rebuild ``table`` as a monthly range-partitioned table with a default partition."""
+    legacy = f'{table}_unpartitioned'
+    sequence = f'{table}_id_seq'
+
+    cursor.execute(f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE')
+    constraints, indexes = table_definitions(cursor, table)
+    cursor.execute(f'SELECT MIN({qn(PARTITION_KEY)}), MAX({qn("id")}) FROM {qn(table)}')
+    first_date, max_id = cursor.fetchone()
+
+    cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+    cursor.execute(f'ALTER TABLE {qn(legacy)} ALTER COLUMN {qn("id")} DROP IDENTITY IF EXISTS')
+    cursor.execute(
+        f'CREATE TABLE {qn(table)} '
+        f'(LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED) '
+        f'PARTITION BY RANGE ({qn(PARTITION_KEY)})'
+    )
+    cursor.execute(f'CREATE SEQUENCE {qn(sequence)} START WITH %s', [(max_id or 0) + 1])
+    cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN {qn('id')} SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f'ALTER SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.{qn("id")}')
+    cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+    today = date.today()
+    month = month_start(min(first_date or today, today))
+    while month <= month_start(today, MONTHS_AHEAD):
+        name = f'{table}_p{month.year}_{month.month:02d}'
+        cursor.execute(
+            f'CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)',
+            [month, month_start(month, 1)]
+        )
+        month = month_start(month, 1)
+
+    columns = ', '.join(qn(column) for column in insertable_columns(cursor, table))
+    cursor.execute(f'INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(legacy)}')
+    cursor.execute(f'DROP TABLE {qn(legacy)}')
+
+    for name, kind, definition in constraints:
+        if kind == 'p':
+            definition = f'PRIMARY KEY ({qn("id")}, {qn(PARTITION_KEY)})'
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def unpartition(cursor, qn, table):
+    """Rebuild partitioned ``table`` as a plain table with an identity ``id`` primary key."""
+    legacy = f'{table}_partitioned'
+
+    cursor.execute(f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE')
+    constraints, indexes = table_definitions(cursor, table)
+    cursor.execute(f'SELECT MAX({qn("id")}) FROM {qn(table)}')
+    max_id = cursor.fetchone()[0]
+
+    cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+    cursor.execute(
+        f'CREATE TABLE {qn(table)} '
+        f'(LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)'
+    )
+    cursor.execute(f'ALTER TABLE {qn(table)} ALTER COLUMN {qn("id")} DROP DEFAULT')
+    columns = ', '.join(qn(column) for column in insertable_columns(cursor, table))
+    cursor.execute(f'INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(legacy)}')
+    # Drops the partitions and the id sequence owned by the partitioned table
+    cursor.execute(f'DROP TABLE {qn(legacy)}')
+    cursor.execute(
+        f'ALTER TABLE {qn(table)} ALTER COLUMN {qn("id")} ADD GENERATED BY DEFAULT AS IDENTITY '
+        f'(START WITH {(max_id or 0) + 1})'
+    )
+
+    for name, kind, definition in constraints:
+        if kind == 'p':
+            definition = f'PRIMARY KEY ({qn("id")})'
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+    for definition in indexes:
+        # Indexes of a partitioned table are defined ON ONLY the parent
+        cursor.execute(definition.replace(' ON ONLY ', ' ON ', 1))
+
+
+def partition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            if not is_partitioned(cursor, table):
+                partition(cursor, connection.ops.quote_name, table)
+
+
+def unpartition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            if is_partitioned(cursor, table):
+                unpartition(cursor, connection.ops.quote_name, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0008_recommendation_archive_and_job_checkpoints'),
+    ]
+
+    operations = [
+        # Partitioning is invisible to Django's model state. Reversing copies the
+        # rows back into plain tables with an (id) primary key, under an exclusive
+        # lock like the forward conversion.
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
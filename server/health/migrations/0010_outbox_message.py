@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:58
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0009_partition_health_data_and_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(help_text='Celery task name', max_length=200)),
+                ('args', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('kwargs', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('dedupe_key', models.CharField(blank=True, help_text='At most one waiting message per key', max_length=200, null=True, unique=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not published before this time')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Outbox Message',
+                'verbose_name_plural': 'Outbox Messages',
+                'db_table': 'task_outbox',
+                'indexes': [models.Index(fields=['available_at', 'id'], name='task_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,132 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import migrations, models, transaction
+
+
+# Titles of the built-in rules, which generated recommendations before they had
+# fingerprints, by rule ID
+RULE_TITLES = {
+    'Increase Daily Steps': 'low_steps',
+    'Improve Sleep Quality': 'short_sleep',
+    'Sleep Schedule Optimization': 'long_sleep',
+    'Monitor Heart Rate': 'high_heart_rate',
+}
+
+
+def content_digest(title, content):
+    # Manual recommendations are told apart by their text
+    return hashlib.md5(f'{title}\n{content}'.encode()).hexdigest()
+
+
+def source_sql():
+    cases = ' '.join(f"WHEN '{title}' THEN 'rule:{rule_id}'" for title, rule_id in RULE_TITLES.items())
+    return (
+        f"CASE title {cases} ELSE CASE WHEN model_version LIKE 'summary%' THEN 'weekly_summary' "
+        f"ELSE COALESCE(model_version, 'manual') || ':' || md5(title || chr(10) || content) END END"
+    )
+
+
+def source_of(title, content, model_version):
+    if title in RULE_TITLES:
+        return f'rule:{RULE_TITLES[title]}'
+    if model_version and model_version.startswith('summary'):
+        return 'weekly_summary'
+    return f"{model_version or 'manual'}:{content_digest(title, content)}"
+
+
+def bump_response_versions(user_ids):
+    """Invalidate cached responses of ``user_ids`` once the migration commits."""
+    # Inlined from health.cache, so that the migration does not depend on it
+    cache = caches[settings.HEALTH_CACHE_ALIAS]
+
+    def bump():
+        for user_id in user_ids:
+            key = f'health:version:{user_id}'
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), timeout=None)
+
+    if user_ids:
+        transaction.on_commit(bump)
+
+
+def fingerprint_recommendations(apps, schema_editor):
+    """
+    Fingerprint existing recommendations like their generators now do, and
+    delete the duplicates that repeated processing created. Of each set of
+    duplicates, the one the user acted on (read, completed, rated) is kept,
+    otherwise the most recently updated.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE recommendations SET fingerprint = md5("
+                f"user_id::text || ':' || date::text || ':' || ({source_sql()}) || ':' || type)"
+            )
+            cursor.execute(
+                'WITH ranked AS ('
+                '  SELECT id, date, row_number() OVER ('
+                '    PARTITION BY fingerprint, date'
+                '    ORDER BY (is_read OR is_completed OR user_rating IS NOT NULL) DESC, updated_at DESC, id DESC'
+                '  ) AS n FROM recommendations'
+                ') '
+                'DELETE FROM recommendations USING ranked '
+                'WHERE recommendations.id = ranked.id AND recommendations.date = ranked.date AND ranked.n > 1 '
+                'RETURNING recommendations.user_id'
+            )
+            user_ids = {user_id for user_id, in cursor.fetchall()}
+    else:
+        Recommendation = apps.get_model('health', 'Recommendation')
+        kept = {}
+        duplicates = []
+        user_ids = set()
+        for recommendation in Recommendation.objects.order_by('id').iterator():
+            source = source_of(recommendation.title, recommendation.content, recommendation.model_version)
+            recommendation.fingerprint = hashlib.md5(
+                f'{recommendation.user_id}:{recommendation.date}:{source}:{recommendation.type}'.encode()
+            ).hexdigest()
+            touched = recommendation.is_read or recommendation.is_completed or recommendation.user_rating is not None
+            rank = (touched, recommendation.updated_at, recommendation.id)
+            key = (recommendation.fingerprint, recommendation.date)
+            if key in kept:
+                previous_rank, previous = kept[key]
+                loser = recommendation if rank < previous_rank else previous
+                if loser is previous:
+                    kept[key] = (rank, recommendation)
+                duplicates.append(loser.id)
+                user_ids.add(loser.user_id)
+            else:
+                kept[key] = (rank, recommendation)
+        Recommendation.objects.filter(id__in=duplicates).delete()
+        Recommendation.objects.bulk_update([recommendation for _, recommendation in kept.values()], ['fingerprint'], batch_size=1000)
+
+    # Counters of these users are recomputed on their next read
+    RecommendationCounter = apps.get_model('health', 'RecommendationCounter')
+    RecommendationCounter.objects.filter(user_id__in=user_ids).delete()
+    bump_response_versions(user_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('health', '0010_outbox_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendation',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, help_text='Hash of user, date, generating rule or model, and type (see fingerprint_for)', max_length=32),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fingerprint_recommendations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='recommendation',
+            constraint=models.UniqueConstraint(fields=('fingerprint', 'date'), name='rec_fingerprint_date_uniq'),
+        ),
+    ]
@@ -1,7 +1,18 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, connections, transaction
 from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+import hashlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from .authentication import invalidate_tokens, invalidate_user_tokens
+from .cache import bump_user_versions
+from .users import invalidate_user
 
 
 class UserProfile(models.Model):
@@ -27,6 +38,118 @@ class UserProfile(models.Model):
         return f"{self.name} ({self.email})"
 
 
+class HealthDataQuerySet(models.QuerySet):
+    """QuerySet with set-based write helpers for HealthData."""
+    
+    # Metric columns that may be written by an upsert, in column order
+    UPSERT_FIELDS = (
+        'steps', 'sleep_hours', 'heart_rate_avg', 'activity_level',
+        'calories_burned', 'weight',
+    )
+    UPSERT_CHUNK_SIZE = 1000
+    
+    def upsert(self, rows):
+        """
+        Insert or update many rows with ``INSERT ... ON CONFLICT (user_id, date) DO UPDATE``.
+        
+        Each row is a dict with ``user_id``, ``date`` and any of the UPSERT_FIELDS.
+        New rows get model defaults for missing fields, but existing rows only have
+        the fields present in the row updated, so rows are grouped by their field
+        set and each group goes out as one statement (per chunk). Duplicate
+        (user_id, date) keys keep the last row. Affected HealthRollup windows are
+        updated with the old and new values of every row.
+        
+        Returns a list of ``(id, user_id, date, created)`` tuples.
+        """
+        latest = {}
+        for row in rows:
+            latest[(row['user_id'], row['date'])] = row
+        
+        groups = {}
+        for row in latest.values():
+            fields = tuple(field for field in self.UPSERT_FIELDS if field in row)
+            groups.setdefault(fields, []).append(row)
+        
+        results = []
+        now = timezone.now()
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        
+        defaults = {
+            field: self.model._meta.get_field(field).get_default()
+            for field in self.UPSERT_FIELDS
+        }
+        columns = ['user_id', 'date', *self.UPSERT_FIELDS, 'created_at', 'updated_at']
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        
+        changes = []
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            for fields, group in groups.items():
+                updates = ', '.join(
+                    f'{qn(column)} = EXCLUDED.{qn(column)}'
+                    for column in (*fields, 'updated_at')
+                )
+                
+                for start in range(0, len(group), self.UPSERT_CHUNK_SIZE):
+                    chunk = group[start:start + self.UPSERT_CHUNK_SIZE]
+                    existing = self._locked_rollup_values(chunk)
+                    params = []
+                    for row in chunk:
+                        params.extend([row['user_id'], row['date']])
+                        params.extend(row.get(field, defaults[field]) for field in self.UPSERT_FIELDS)
+                        params.extend([now, now])
+                    
+                    # An update keeps the original created_at, so created_at = updated_at
+                    # only on insert (xmax cannot be read from a partitioned table)
+                    cursor.execute(
+                        f'INSERT INTO {table} ({", ".join(qn(c) for c in columns)}) '
+                        f'VALUES {", ".join([placeholders] * len(chunk))} '
+                        f'ON CONFLICT ({qn("user_id")}, {qn("date")}) DO UPDATE SET {updates} '
+                        f'RETURNING {qn("id")}, {qn("user_id")}, {qn("date")}, ({qn("created_at")} = {qn("updated_at")})',
+                        params
+                    )
+                    saved = cursor.fetchall()
+                    results.extend(saved)
+                    
+                    rows_by_key = {(row['user_id'], row['date']): row for row in chunk}
+                    for health_data_id, user_id, row_date, created in saved:
+                        old = existing.get((user_id, row_date))
+                        row = rows_by_key[(user_id, row_date)]
+                        new = dict(old) if old else {
+                            field: defaults[field] for field in HealthData.ROLLUP_FIELDS
+                            if field in defaults
+                        }
+                        new.update({field: row[field] for field in HealthData.ROLLUP_FIELDS if field in row})
+                        new['id'] = health_data_id
+                        changes.append((old, new))
+            
+            HealthRollup.objects.apply_changes(changes)
+            bump_user_versions(latest_key[0] for latest_key in latest)
+        
+        return results
+    
+    def with_user(self):
+        """Load the owner and profile shown by HealthDataSerializer in the same query."""
+        return self.select_related('user__profile').only(
+            *(field.name for field in self.model._meta.concrete_fields),
+            'user__username', 'user__profile__name'
+        )
+    
+    def _locked_rollup_values(self, rows):
+        """Lock the existing rows matching ``rows`` and return their rollup values by key."""
+        keys = {(row['user_id'], row['date']) for row in rows}
+        existing = self.model.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in keys},
+            date__in={row_date for _, row_date in keys}
+        ).order_by().values(*HealthData.ROLLUP_FIELDS)
+        return {
+            (values['user_id'], values['date']): values
+            for values in existing
+            if (values['user_id'], values['date']) in keys
+        }
+
+
 class HealthData(models.Model):
     """Daily health metrics for users."""
     
@@ -38,6 +161,9 @@ class HealthData(models.Model):
         ('very_active', 'Very Active'),
     ]
     
+    # Fields tracked by HealthRollup
+    ROLLUP_FIELDS = ('id', 'user_id', 'date', 'steps', 'sleep_hours', 'heart_rate_avg', 'activity_level')
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='health_data')
     date = models.DateField(help_text="Date of the health data")
     
@@ -87,31 +213,461 @@ class HealthData(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = HealthDataQuerySet.as_manager()
+    
     class Meta:
         db_table = 'health_data'
         verbose_name = 'Health Data'
         verbose_name_plural = 'Health Data'
         unique_together = ['user', 'date']
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Keyset pagination over the whole table (admin /v1/ viewset)
+            models.Index(fields=['-date', '-id'], name='health_data_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.date}"
     
+    def save(self, *args, **kwargs):
+        """Save and apply the change to the user's HealthRollup windows."""
+        with transaction.atomic():
+            old = None
+            if self.pk:
+                old = HealthData.objects.filter(pk=self.pk).values(*self.ROLLUP_FIELDS).first()
+            super().save(*args, **kwargs)
+            HealthRollup.objects.apply_changes([(old, self.rollup_values())])
+            bump_user_versions({self.user_id, old['user_id'] if old else self.user_id})
+    
+    def rollup_values(self):
+        """Return the values tracked by HealthRollup."""
+        return {field: getattr(self, field) for field in self.ROLLUP_FIELDS}
+    
+    ACTIVITY_MULTIPLIERS = {
+        'sedentary': 0.5,
+        'light': 0.7,
+        'moderate': 1.0,
+        'vigorous': 1.3,
+        'very_active': 1.5,
+    }
+    
     @property
     def activity_score(self):
         """Calculate a simple activity score based on steps and activity level."""
-        activity_multiplier = {
-            'sedentary': 0.5,
-            'light': 0.7,
-            'moderate': 1.0,
-            'vigorous': 1.3,
-            'very_active': 1.5,
+        return self.score_activity(self.steps, self.activity_level)
+    
+    @classmethod
+    def score_activity(cls, steps, activity_level):
+        """Activity score from raw values, for callers that have no instance."""
+        base_score = min(steps / 100, 100)  # 100 steps = 1 point, max 100
+        multiplier = cls.ACTIVITY_MULTIPLIERS.get(activity_level, 1.0)
+        
+        return round(base_score * multiplier, 2)
+
+
+class HealthRollupQuerySet(models.QuerySet):
+    """
+    Maintenance helpers for HealthRollup.
+    
+    Rollups are anchored at ``as_of`` (today). Writes apply old/new deltas to the
+    current rows; rows that are missing or anchored on an earlier day are rebuilt
+    from HealthData, which also slides the windows forward.
+    
+    Rebuilds and delta applications of a user are serialized by a transaction-level
+    advisory lock, so concurrent first writes cannot each rebuild from a snapshot
+    that misses the other's row. HealthData ``save()``, ``upsert()`` and deletes
+    (instance, queryset or cascade, through a post_delete receiver) maintain
+    rollups; after a queryset ``update()`` or raw SQL, call ``rebuild()`` for the
+    affected users.
+    """
+    
+    # First key of the (namespace, user_id) advisory locks taken on rollups
+    LOCK_NAMESPACE = 6001
+    
+    def lock_users(self, user_ids):
+        """
+        Take the rollup advisory lock of ``user_ids`` until the end of the current
+        transaction, in user ID order so that concurrent writers cannot deadlock.
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql' or not user_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, user_id) FROM unnest(%s::integer[]) AS user_id',
+                [self.LOCK_NAMESPACE, sorted(user_ids)]
+            )
+    
+    def compute(self, user_ids, as_of=None):
+        """Aggregate raw HealthData into unsaved rollups for ``user_ids``."""
+        as_of = as_of or date.today()
+        user_ids = set(user_ids)
+        window_filters = {
+            window_days: models.Q(date__gte=as_of - timedelta(days=window_days))
+            for window_days in HealthRollup.WINDOWS
         }
+        recent = HealthData.objects.filter(
+            user_id__in=user_ids,
+            date__gte=as_of - timedelta(days=max(HealthRollup.WINDOWS)),
+            date__lte=as_of
+        ).order_by()
         
-        base_score = min(self.steps / 100, 100)  # 100 steps = 1 point, max 100
-        multiplier = activity_multiplier.get(self.activity_level, 1.0)
+        rollups = {
+            (user_id, window_days): HealthRollup(user_id=user_id, window_days=window_days, as_of=as_of)
+            for user_id in user_ids
+            for window_days in HealthRollup.WINDOWS
+        }
         
-        return round(base_score * multiplier, 2)
+        annotations = {}
+        for window_days, window_filter in window_filters.items():
+            annotations.update({
+                f'days_{window_days}': models.Count('id', filter=window_filter),
+                f'steps_{window_days}': models.Sum('steps', filter=window_filter),
+                f'sleep_{window_days}': models.Sum('sleep_hours', filter=window_filter),
+                f'heart_rate_{window_days}': models.Sum('heart_rate_avg', filter=window_filter),
+                f'heart_rate_days_{window_days}': models.Count('heart_rate_avg', filter=window_filter),
+            })
+        for row in recent.values('user_id').annotate(**annotations):
+            for window_days in HealthRollup.WINDOWS:
+                rollup = rollups[(row['user_id'], window_days)]
+                rollup.days = row[f'days_{window_days}']
+                rollup.steps_sum = row[f'steps_{window_days}'] or 0
+                rollup.sleep_hours_sum = row[f'sleep_{window_days}'] or Decimal('0')
+                rollup.heart_rate_sum = row[f'heart_rate_{window_days}'] or 0
+                rollup.heart_rate_days = row[f'heart_rate_days_{window_days}']
+        
+        histogram = recent.values('user_id', 'activity_level').annotate(**{
+            f'days_{window_days}': models.Count('id', filter=window_filter)
+            for window_days, window_filter in window_filters.items()
+        })
+        for row in histogram:
+            for window_days in HealthRollup.WINDOWS:
+                if row[f'days_{window_days}']:
+                    rollup = rollups[(row['user_id'], window_days)]
+                    rollup.activity_counts[row['activity_level']] = row[f'days_{window_days}']
+        
+        return rollups
+    
+    def rebuild(self, user_ids, as_of=None):
+        """Recompute and store rollups for ``user_ids`` from raw HealthData."""
+        with transaction.atomic(using=self.db):
+            # Locked before computing, so the aggregate sees every committed write
+            self.lock_users(set(user_ids))
+            rollups = self.compute(user_ids, as_of)
+            self.bulk_create(
+                rollups.values(),
+                update_conflicts=True,
+                unique_fields=['user', 'window_days'],
+                update_fields=[
+                    'as_of', 'days', 'steps_sum', 'sleep_hours_sum', 'heart_rate_sum',
+                    'heart_rate_days', 'activity_counts', 'updated_at',
+                ]
+            )
+        return rollups
+    
+    def verify(self, user_ids, as_of=None):
+        """
+        Compare stored rollups with raw aggregates.
+        
+        Returns ``(user_id, window_days, field, stored, expected)`` for every
+        mismatch. Missing or stale rows are skipped, they are rebuilt on next use.
+        """
+        as_of = as_of or date.today()
+        expected = self.compute(user_ids, as_of)
+        stored = {
+            (rollup.user_id, rollup.window_days): rollup
+            for rollup in self.filter(user_id__in=set(user_ids))
+        }
+        
+        mismatches = []
+        for key, computed in expected.items():
+            rollup = stored.get(key)
+            if rollup is None or rollup.as_of != as_of:
+                continue
+            for field in HealthRollup.TOTAL_FIELDS:
+                if getattr(rollup, field) != getattr(computed, field):
+                    mismatches.append((*key, field, getattr(rollup, field), getattr(computed, field)))
+        return mismatches
+    
+    def current(self, user_id, window_days):
+        """Return the up-to-date rollup for a user and window, rebuilding it if stale."""
+        rollup = self.filter(user_id=user_id, window_days=window_days, as_of=date.today()).first()
+        if rollup is None:
+            rollup = self.rebuild([user_id])[(user_id, window_days)]
+        return rollup
+    
+    async def acurrent(self, user_id, window_days):
+        """Async version of current(); a stale rollup is rebuilt in a worker thread."""
+        rollup = await self.filter(user_id=user_id, window_days=window_days, as_of=date.today()).afirst()
+        if rollup is None:
+            rollup = (await sync_to_async(self.rebuild)([user_id]))[(user_id, window_days)]
+        return rollup
+    
+    def apply_changes(self, changes):
+        """
+        Apply HealthData changes to the affected rollups.
+        
+        ``changes`` is a list of ``(old, new)`` pairs of HealthData rollup values
+        (``None`` for an insert's old or a delete's new side). Must be called after
+        the change is written so that rebuilt users already include it.
+        """
+        changes = [(old, new) for old, new in changes if old or new]
+        if not changes:
+            return
+        
+        as_of = date.today()
+        user_ids = {values['user_id'] for change in changes for values in change if values}
+        
+        with transaction.atomic(using=self.db):
+            self.lock_users(user_ids)
+            rollups = {
+                (rollup.user_id, rollup.window_days): rollup
+                for rollup in self.select_for_update().filter(user_id__in=user_ids, as_of=as_of)
+            }
+            current_users = {
+                user_id for user_id in user_ids
+                if all((user_id, window_days) in rollups for window_days in HealthRollup.WINDOWS)
+            }
+            if user_ids - current_users:
+                self.rebuild(user_ids - current_users, as_of)
+            
+            changed = set()
+            for old, new in changes:
+                for values, sign in ((old, -1), (new, 1)):
+                    if not values or values['user_id'] not in current_users:
+                        continue
+                    for window_days in HealthRollup.WINDOWS:
+                        rollup = rollups[(values['user_id'], window_days)]
+                        if rollup.add(values, sign):
+                            changed.add(rollup)
+            
+            if changed:
+                self.bulk_update(changed, [*HealthRollup.TOTAL_FIELDS, 'updated_at'])
+
+
+class HealthRollup(models.Model):
+    """
+    Running per-user totals of HealthData over a trailing window of days.
+    
+    One row per (user, window) covers dates from ``as_of - window_days`` to
+    ``as_of``, so summaries read averages and activity distribution from a
+    single row instead of re-aggregating HealthData.
+    """
+    
+    WINDOWS = (7, 30, 90)
+    TOTAL_FIELDS = (
+        'days', 'steps_sum', 'sleep_hours_sum', 'heart_rate_sum', 'heart_rate_days',
+        'activity_counts',
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='health_rollups')
+    window_days = models.PositiveSmallIntegerField(help_text="Length of the trailing window")
+    as_of = models.DateField(help_text="Last day covered by the window")
+    
+    days = models.PositiveIntegerField(default=0, help_text="Days with health data")
+    steps_sum = models.BigIntegerField(default=0)
+    sleep_hours_sum = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))
+    heart_rate_sum = models.BigIntegerField(default=0)
+    heart_rate_days = models.PositiveIntegerField(default=0, help_text="Days with a heart rate reading")
+    activity_counts = models.JSONField(default=dict, help_text="Days per activity level")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = HealthRollupQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'health_rollups'
+        verbose_name = 'Health Rollup'
+        verbose_name_plural = 'Health Rollups'
+        unique_together = ['user', 'window_days']
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.window_days}d as of {self.as_of}"
+    
+    @property
+    def start_date(self):
+        """First day covered by the window."""
+        return self.as_of - timedelta(days=self.window_days)
+    
+    @property
+    def avg_steps(self):
+        return self.steps_sum / self.days if self.days else 0
+    
+    @property
+    def avg_sleep_hours(self):
+        return self.sleep_hours_sum / self.days if self.days else 0
+    
+    @property
+    def avg_heart_rate(self):
+        return self.heart_rate_sum / self.heart_rate_days if self.heart_rate_days else None
+    
+    def add(self, values, sign=1):
+        """
+        Add (``sign=1``) or subtract (``sign=-1``) one day of HealthData values.
+        Returns False if the day falls outside the window.
+        """
+        if not self.start_date <= values['date'] <= self.as_of:
+            return False
+        
+        self.days += sign
+        self.steps_sum += sign * values['steps']
+        self.sleep_hours_sum += sign * Decimal(str(values['sleep_hours']))
+        if values['heart_rate_avg'] is not None:
+            self.heart_rate_sum += sign * values['heart_rate_avg']
+            self.heart_rate_days += sign
+        
+        level = values['activity_level']
+        self.activity_counts[level] = self.activity_counts.get(level, 0) + sign
+        if not self.activity_counts[level]:
+            del self.activity_counts[level]
+        return True
+
+
+class BufferedHealthDataQuerySet(models.QuerySet):
+    """QuerySet helpers for the write-behind buffer."""
+    
+    def stats(self):
+        """Return buffer depth and the age in seconds of the oldest buffered row."""
+        stats = self.aggregate(depth=models.Count('id'), oldest=models.Min('received_at'))
+        lag = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+        return {'depth': stats['depth'], 'lag_seconds': round(lag, 3)}
+
+
+class BufferedHealthData(models.Model):
+    """
+    Write-behind staging row for health data accepted in buffered ingest mode.
+    
+    Rows are appended by the ingest endpoint and drained into HealthData by the
+    ``flush_health_data_buffer`` task, which coalesces them per (user, date).
+    """
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='buffered_health_data')
+    date = models.DateField(help_text="Date of the health data")
+    payload = models.JSONField(encoder=DjangoJSONEncoder, help_text="Validated health metrics")
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = BufferedHealthDataQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'health_data_buffer'
+        verbose_name = 'Buffered Health Data'
+        verbose_name_plural = 'Buffered Health Data'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.date} (buffered)"
+
+
+class RecommendationQuerySet(models.QuerySet):
+    """QuerySet helpers for Recommendation."""
+    
+    COUNTS = {
+        'count': models.Count('id'),
+        'unread_count': models.Count('id', filter=models.Q(is_read=False)),
+        'pending_count': models.Count('id', filter=models.Q(is_completed=False)),
+        'next_expiry': models.Min('expires_at'),
+    }
+    
+    def active(self):
+        """Recommendations without an expiry date or expiring in the future."""
+        return self.filter(models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()))
+    
+    def unread(self):
+        """Active recommendations the user has not read (rec_user_unread_idx)."""
+        return self.active().filter(is_read=False)
+    
+    def pending(self):
+        """Active recommendations the user has not completed (rec_user_pending_idx)."""
+        return self.active().filter(is_completed=False)
+    
+    def by_priority(self):
+        """Most urgent first, newest first within a priority."""
+        return self.order_by('-priority_rank', '-created_at')
+    
+    def counts(self):
+        """
+        Total, unread and pending counts in a single conditional aggregate,
+        plus the earliest ``expires_at`` (when the counts may next change by themselves).
+        """
+        return self.aggregate(**self.COUNTS)
+    
+    async def acounts(self):
+        """Async version of counts()."""
+        return await self.aaggregate(**self.COUNTS)
+    
+    def with_user_name(self):
+        """Load the owner's profile name shown by RecommendationSerializer in the same query."""
+        return self.select_related('user__profile').only(
+            *(field.name for field in self.model._meta.concrete_fields),
+            'user__profile__name'
+        )
+    
+    def active_counts(self):
+        """Per-user unread and pending counts of non-expired recommendations."""
+        return self.active().order_by().values('user_id').annotate(
+            unread_count=models.Count('id', filter=models.Q(is_read=False)),
+            pending_count=models.Count('id', filter=models.Q(is_completed=False)),
+        )
+    
+    def upsert(self, recommendations):
+        """
+        Insert or refresh many unsaved Recommendations with
+        ``INSERT ... ON CONFLICT (fingerprint, date) DO UPDATE``.
+        
+        A recommendation that already exists gets its REFRESH_FIELDS updated in
+        place; what the user did with it (read, completed, rating) is kept.
+        Duplicate fingerprints keep the last recommendation. Refreshes the
+        counters and cached responses of the affected users.
+        
+        Returns a list of ``(id, user_id, date, created)`` tuples.
+        """
+        latest = {}
+        for recommendation in recommendations:
+            recommendation.ensure_fingerprint()
+            latest[(recommendation.fingerprint, recommendation.date)] = recommendation
+        if not latest:
+            return []
+        
+        results = []
+        now = timezone.now()
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        
+        fields = [self.model._meta.get_field(name) for name in self.model.INSERT_FIELDS]
+        columns = [field.column for field in fields] + ['created_at', 'updated_at']
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        updates = ', '.join(
+            f'{qn(column)} = EXCLUDED.{qn(column)}'
+            for column in (*self.model.REFRESH_FIELDS, 'updated_at')
+        )
+        
+        recommendations = list(latest.values())
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            for start in range(0, len(recommendations), self.model.UPSERT_CHUNK_SIZE):
+                chunk = recommendations[start:start + self.model.UPSERT_CHUNK_SIZE]
+                params = []
+                for recommendation in chunk:
+                    params.extend(
+                        field.get_db_prep_save(getattr(recommendation, field.attname), connection)
+                        for field in fields
+                    )
+                    params.extend([now, now])
+                
+                # An update keeps the original created_at, so created_at = updated_at
+                # only on insert (xmax cannot be read from a partitioned table)
+                cursor.execute(
+                    f'INSERT INTO {table} ({", ".join(qn(c) for c in columns)}) '
+                    f'VALUES {", ".join([placeholders] * len(chunk))} '
+                    f'ON CONFLICT ({qn("fingerprint")}, {qn("date")}) DO UPDATE SET {updates} '
+                    f'RETURNING {qn("id")}, {qn("user_id")}, {qn("date")}, ({qn("created_at")} = {qn("updated_at")})',
+                    params
+                )
+                results.extend(cursor.fetchall())
+            
+            recommendations_changed(user_id for _, user_id, _, _ in results)
+        
+        return results
 
 
 class Recommendation(models.Model):
@@ -150,6 +706,15 @@ class Recommendation(models.Model):
         default='medium',
         help_text="Priority level of the recommendation"
     )
+    # Numeric priority for correct, index-assisted ordering (computed by the database)
+    priority_rank = models.GeneratedField(
+        expression=models.Case(
+            *[models.When(priority=level, then=models.Value(rank)) for rank, (level, _) in enumerate(PRIORITY_LEVELS, start=1)],
+            default=models.Value(0),
+        ),
+        output_field=models.SmallIntegerField(),
+        db_persist=True,
+    )
     
     # AI/ML related fields
     confidence_score = models.DecimalField(
@@ -166,6 +731,11 @@ class Recommendation(models.Model):
         blank=True,
         help_text="Version of the AI model used"
     )
+    fingerprint = models.CharField(
+        max_length=32,
+        editable=False,
+        help_text="Hash of user, date, generating rule or model, and type (see fingerprint_for)"
+    )
     
     # User interaction
     is_read = models.BooleanField(default=False, help_text="Has user read this recommendation")
@@ -186,15 +756,82 @@ class Recommendation(models.Model):
         help_text="When this recommendation expires"
     )
     
+    # Written by RecommendationQuerySet.upsert(); REFRESH_FIELDS are updated when
+    # a recommendation with the same fingerprint already exists
+    INSERT_FIELDS = (
+        'user', 'date', 'fingerprint', 'title', 'content', 'type', 'priority', 'confidence_score',
+        'model_version', 'is_read', 'is_completed', 'user_rating', 'expires_at',
+    )
+    REFRESH_FIELDS = ('title', 'content', 'priority', 'confidence_score', 'model_version', 'expires_at')
+    UPSERT_CHUNK_SIZE = 1000
+    
+    objects = RecommendationQuerySet.as_manager()
+    
     class Meta:
         db_table = 'recommendations'
         verbose_name = 'Recommendation'
         verbose_name_plural = 'Recommendations'
-        ordering = ['-created_at', '-priority']
+        ordering = ['-created_at', '-priority_rank']
+        indexes = [
+            # Keyset pagination per user and over the whole table
+            models.Index(fields=['user', '-created_at', '-id'], name='rec_user_created_id_idx'),
+            models.Index(fields=['-created_at', '-id'], name='rec_created_id_idx'),
+            # Unread / pending lists and badge counts
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(is_read=False),
+                name='rec_user_unread_idx'
+            ),
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(is_completed=False),
+                name='rec_user_pending_idx'
+            ),
+            # Priority ordering
+            models.Index(fields=['user', '-priority_rank', '-created_at'], name='rec_user_priority_idx'),
+            # "Already processed" anti-join of HealthData against (user, date)
+            models.Index(fields=['user', 'date'], name='rec_user_date_idx'),
+            # Expiry cleanup only looks at uncompleted recommendations
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(is_completed=False),
+                name='rec_expires_pending_idx'
+            ),
+        ]
+        constraints = [
+            # One recommendation per generator and type per user-day; includes the
+            # partition key, as unique constraints on partitioned tables must
+            models.UniqueConstraint(fields=['fingerprint', 'date'], name='rec_fingerprint_date_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.user.username} ({self.date})"
     
+    @staticmethod
+    def fingerprint_for(user_id, day, source, rec_type):
+        """
+        Deterministic fingerprint of a recommendation: the user, the day, what
+        generated it (``source``: a rule, a job, a model) and its type.
+        """
+        if isinstance(day, datetime):
+            day = timezone.localdate(day) if timezone.is_aware(day) else day.date()
+        return hashlib.md5(f'{user_id}:{day}:{source}:{rec_type}'.encode()).hexdigest()
+    
+    def ensure_fingerprint(self):
+        """
+        Fingerprint a recommendation its generator did not (e.g. one created
+        through the API), by its model version and a hash of its title and
+        content: resending it refreshes it, a different one is added.
+        """
+        if not self.fingerprint:
+            digest = hashlib.md5(f'{self.title}\n{self.content}'.encode()).hexdigest()
+            source = f"{self.model_version or 'manual'}:{digest}"
+            self.fingerprint = self.fingerprint_for(self.user_id, self.date, source, self.type)
+    
+    def save(self, *args, **kwargs):
+        self.ensure_fingerprint()
+        super().save(*args, **kwargs)
+    
     @property
     def is_expired(self):
         """Check if the recommendation has expired."""
@@ -211,10 +848,237 @@ class Recommendation(models.Model):
         """Mark recommendation as completed."""
         self.is_completed = True
         self.save(update_fields=['is_completed', 'updated_at'])
+    
+
+
+class RecommendationCounterQuerySet(models.QuerySet):
+    """Maintenance helpers for per-user recommendation counters."""
+    
+    def refresh(self, user_ids):
+        """
+        Recompute counters for ``user_ids`` with one grouped query and one upsert.
+        
+        Counts exclude recommendations that are expired at refresh time; expired
+        rows drop out for good when the cleanup task deletes them.
+        """
+        user_ids = set(user_ids)
+        if not user_ids or not settings.HEALTH_RECOMMENDATION_COUNTERS:
+            return
+        
+        counts = {
+            row['user_id']: row
+            for row in Recommendation.objects.filter(user_id__in=user_ids).active_counts()
+        }
+        self.bulk_create(
+            [
+                RecommendationCounter(
+                    user_id=user_id,
+                    unread_count=counts.get(user_id, {}).get('unread_count', 0),
+                    pending_count=counts.get(user_id, {}).get('pending_count', 0),
+                )
+                for user_id in user_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['unread_count', 'pending_count', 'updated_at']
+        )
+    
+    def for_user(self, user_id):
+        """Return the user's counter, creating it on first access."""
+        counter = self.filter(user_id=user_id).first()
+        if counter is None:
+            self.refresh([user_id])
+            counter = self.get(user_id=user_id)
+        return counter
+    
+    async def afor_user(self, user_id):
+        """Async version of for_user()."""
+        counter = await self.filter(user_id=user_id).afirst()
+        if counter is None:
+            await sync_to_async(self.refresh)([user_id])
+            counter = await self.aget(user_id=user_id)
+        return counter
+    
+    def refresh_on_commit(self, user_ids):
+        """Refresh counters once the surrounding transaction commits."""
+        user_ids = set(user_ids)
+        transaction.on_commit(lambda: self.refresh(user_ids), using=self.db)
+
+
+class RecommendationCounter(models.Model):
+    """
+    Denormalized unread/pending recommendation counts per user.
+    
+    Kept up to date by the recommendation write paths so that badge counts in
+    the app are a single primary-key read.
+    """
+    
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recommendation_counter'
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = RecommendationCounterQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'recommendation_counters'
+        verbose_name = 'Recommendation Counter'
+        verbose_name_plural = 'Recommendation Counters'
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.unread_count} unread, {self.pending_count} pending"
+
+
+class RecommendationArchive(models.Model):
+    """
+    Compact copy of a Recommendation removed by the expiry cleanup.
+    
+    Keeps what is needed for engagement analytics and drops the long ``content``
+    text. ``user_id`` is a plain column so archived rows outlive their user.
+    """
+    
+    recommendation_id = models.BigIntegerField(unique=True, help_text="ID of the deleted recommendation")
+    user_id = models.IntegerField(db_index=True)
+    date = models.DateField()
+    title = models.CharField(max_length=255)
+    type = models.CharField(max_length=20)
+    priority = models.CharField(max_length=10)
+    confidence_score = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True)
+    model_version = models.CharField(max_length=50, null=True, blank=True)
+    is_read = models.BooleanField()
+    user_rating = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'recommendation_archive'
+        verbose_name = 'Archived Recommendation'
+        verbose_name_plural = 'Archived Recommendations'
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.title} (archived)"
+
+
+class JobCheckpoint(models.Model):
+    """
+    Progress of a long-running maintenance job, so an interrupted run resumes
+    where it stopped instead of starting over.
+    """
+    
+    name = models.CharField(max_length=100, primary_key=True)
+    state = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'job_checkpoints'
+        verbose_name = 'Job Checkpoint'
+        verbose_name_plural = 'Job Checkpoints'
+    
+    def __str__(self):
+        return f"{self.name}: {self.state}"
+
+
+class OutboxMessageQuerySet(models.QuerySet):
+    """Writes and stats of the task outbox; publishing is in outbox.py."""
+    
+    def enqueue(self, task, args=(), kwargs=None, dedupe_key=None, delay=0):
+        """
+        Add a message for Celery task ``task`` (its name) in the current transaction.
+        
+        It becomes due ``delay`` seconds from now. While a message with the same
+        ``dedupe_key`` is waiting, nothing is added. Returns True if added.
+        """
+        now = timezone.now()
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        encoder = DjangoJSONEncoder()
+        columns = ['task', 'args', 'kwargs', 'dedupe_key', 'available_at', 'attempts', 'last_error', 'created_at']
+        
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(self.model._meta.db_table)} ({", ".join(qn(column) for column in columns)}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))}) ON CONFLICT DO NOTHING RETURNING {qn("id")}',
+                [
+                    task, encoder.encode(list(args)), encoder.encode(kwargs or {}), dedupe_key,
+                    now + timedelta(seconds=delay), 0, '', now,
+                ]
+            )
+            return cursor.fetchone() is not None
+    
+    def due(self):
+        return self.filter(available_at__lte=timezone.now())
+    
+    def stats(self):
+        """Return outbox depth, due messages and the seconds the oldest due message has waited."""
+        now = timezone.now()
+        stats = self.aggregate(
+            depth=models.Count('id'),
+            due=models.Count('id', filter=models.Q(available_at__lte=now)),
+            oldest=models.Min('available_at', filter=models.Q(available_at__lte=now))
+        )
+        lag = (now - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+        return {'depth': stats['depth'], 'due': stats['due'], 'lag_seconds': round(lag, 3)}
+
+
+class OutboxMessage(models.Model):
+    """
+    A Celery task message waiting to be published by the outbox relay.
+    
+    Written in the same transaction as the data the task works on, so the task is
+    published only if that data committed, and never before it is visible.
+    """
+    
+    task = models.CharField(max_length=200, help_text="Celery task name")
+    args = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+    kwargs = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    dedupe_key = models.CharField(
+        max_length=200,
+        null=True,
+        blank=True,
+        unique=True,
+        help_text="At most one waiting message per key"
+    )
+    available_at = models.DateTimeField(default=timezone.now, help_text="Not published before this time")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = OutboxMessageQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'task_outbox'
+        verbose_name = 'Outbox Message'
+        verbose_name_plural = 'Outbox Messages'
+        indexes = [
+            # Relay claims due messages in this order
+            models.Index(fields=['available_at', 'id'], name='task_outbox_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} {self.args} (attempts: {self.attempts})"
+
+
+def recommendations_changed(user_ids):
+    """
+    Propagate a change to the recommendations of ``user_ids``: refresh their
+    RecommendationCounter rows and invalidate their cached responses.
+    Saves and deletes (including queryset and cascade deletes) call it through
+    signal receivers; bulk_create, queryset update() and raw SQL must call it
+    explicitly, as RecommendationQuerySet.upsert() does.
+    """
+    user_ids = set(user_ids)
+    RecommendationCounter.objects.refresh_on_commit(user_ids)
+    bump_user_versions(user_ids)
 
 
 # Signal handlers for automatic profile creation
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 
 @receiver(post_save, sender=User)
@@ -232,3 +1096,70 @@ def save_user_profile(sender, instance, **kwargs):
     """Save UserProfile when User is saved."""
     if hasattr(instance, 'profile'):
         instance.profile.save()
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_resolved_user(sender, instance, **kwargs):
+    """Forget cached user_id resolutions of a changed or deleted user."""
+    invalidate_user(instance.pk, instance.get_username())
+
+# User fields that decide whether a cached token still authenticates
+TOKEN_AUTH_FIELDS = ('is_active', 'is_staff', 'password')
+
+def _token_auth_state(user):
+    """Loaded values of TOKEN_AUTH_FIELDS, read without fetching deferred ones."""
+    return tuple(user.__dict__.get(field) for field in TOKEN_AUTH_FIELDS)
+
+@receiver(post_init, sender=User)
+def remember_token_auth_state(sender, instance, **kwargs):
+    instance._token_auth_state = _token_auth_state(instance)
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Re-check tokens of a user against the database once is_active, is_staff or
+    password change; saves such as the last_login update on every login skip it.
+    """
+    if update_fields is not None and not set(TOKEN_AUTH_FIELDS) & set(update_fields):
+        return
+    state = _token_auth_state(instance)
+    changed = state != instance._token_auth_state
+    instance._token_auth_state = state
+    if changed and not created:
+        invalidate_user_tokens(instance.pk)
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_tokens(sender, instance, **kwargs):
+    """Forget cached tokens of a deleted user."""
+    invalidate_user_tokens(instance.pk)
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    """Forget a rotated or deleted token."""
+    invalidate_tokens([instance.key])
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_responses(sender, instance, **kwargs):
+    """Drop cached responses of a deleted user (its rows' receivers skip that)."""
+    bump_user_versions([instance.pk])
+
+def _deleting_user(origin):
+    """True if a deletion cascades from deleting users, whose rollups and counters go too."""
+    return isinstance(origin, User) or (isinstance(origin, models.QuerySet) and origin.model is User)
+
+@receiver(post_delete, sender=HealthData)
+def subtract_deleted_health_data(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted row from the owner's rollups, for instance and queryset deletes alike."""
+    if _deleting_user(origin):
+        return
+    HealthRollup.objects.apply_changes([(instance.rollup_values(), None)])
+    bump_user_versions([instance.user_id])
+
+@receiver(post_save, sender=Recommendation)
+@receiver(post_delete, sender=Recommendation)
+def refresh_recommendation_counter(sender, instance, origin=None, **kwargs):
+    """Keep the owner's counters and cached responses in sync with saves and deletes."""
+    if _deleting_user(origin):
+        return
+    recommendations_changed([instance.user_id])
@@ -0,0 +1,119 @@
+"""
+Transactional outbox for Celery tasks.
+
+Request handlers do not publish to the broker. ``enqueue`` adds an
+OutboxMessage in the caller's transaction instead, so a task message exists
+exactly when the data it refers to was committed, no worker can pick it up
+before that data is visible, and a slow broker never adds to request latency.
+
+The relay publishes due messages: the ``relay_outbox`` task on the beat
+schedule, or ``manage.py relay_outbox`` as a dedicated process (lower latency,
+and independent of a busy worker queue). Each batch is claimed with
+``FOR UPDATE SKIP LOCKED``, so several relays can run, published over one broker
+connection and deleted in the same transaction.
+
+Delivery is at least once: if a relay dies after publishing a batch but before
+committing, the batch is published again, so tasks sent through the outbox must
+be idempotent. A message that fails to publish is retried with exponential
+backoff, capped at HEALTH_OUTBOX_MAX_BACKOFF seconds, and never dropped.
+Messages with a ``dedupe_key`` are coalesced: while one is waiting, enqueueing
+another with the same key adds nothing.
+"""
+import contextlib
+import logging
+import time
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, args=(), kwargs=None, dedupe_key=None, delay=0):
+    """
+    Publish Celery task ``task`` with ``args``/``kwargs`` once the current
+    transaction commits and ``delay`` seconds have passed. Returns False if a
+    waiting message with the same ``dedupe_key`` made this one redundant.
+    """
+    return OutboxMessage.objects.enqueue(task.name, args, kwargs, dedupe_key=dedupe_key, delay=delay)
+
+
+def _backoff(attempts):
+    return min(2 ** attempts, settings.HEALTH_OUTBOX_MAX_BACKOFF)
+
+
+def relay(batch_size=None, max_batches=None):
+    """
+    Publish due outbox messages in batches until none is left.
+
+    Stops at the first message that fails to publish (the broker is likely
+    down), after scheduling its retry. Returns a dict with ``published``,
+    ``failed``, ``batches`` and ``elapsed``.
+    """
+    batch_size = batch_size or settings.HEALTH_OUTBOX_BATCH_SIZE
+    eager = current_app.conf.task_always_eager
+    if eager:
+        # Eager tasks run inline here, so their modules must be imported
+        current_app.loader.import_default_modules()
+    stats = {'published': 0, 'failed': 0, 'batches': 0, 'elapsed': 0.0}
+    started = time.monotonic()
+
+    while max_batches is None or stats['batches'] < max_batches:
+        with transaction.atomic():
+            messages = list(
+                OutboxMessage.objects.due().select_for_update(skip_locked=True)
+                .order_by('available_at', 'id')[:batch_size]
+            )
+            if not messages:
+                break
+
+            published = []
+            failed = None
+            now = timezone.now()
+            # Eager tasks run inline and need no broker connection
+            publisher = contextlib.nullcontext() if eager else current_app.producer_or_acquire()
+            with publisher as producer:
+                for message in messages:
+                    try:
+                        if eager:
+                            current_app.tasks[message.task].apply(message.args, message.kwargs)
+                        else:
+                            # By name: a relay process need not have imported the task modules
+                            current_app.send_task(message.task, message.args, message.kwargs, producer=producer)
+                    except Exception as e:
+                        failed = message
+                        failed.last_error = str(e)
+                        break
+                    published.append(message.id)
+                    metrics.observe(
+                        'health_outbox_lag_seconds', (), (now - message.available_at).total_seconds()
+                    )
+
+            OutboxMessage.objects.filter(id__in=published).delete()
+            if failed:
+                failed.attempts += 1
+                failed.available_at = timezone.now() + timedelta(seconds=_backoff(failed.attempts))
+                failed.save(update_fields=['attempts', 'last_error', 'available_at'])
+
+        stats['published'] += len(published)
+        stats['batches'] += 1
+        metrics.inc('health_outbox_messages_total', (('outcome', 'published'),), len(published))
+        if failed:
+            stats['failed'] += 1
+            metrics.inc('health_outbox_messages_total', (('outcome', 'failed'),))
+            logger.error(
+                f"Failed to publish outbox message {failed.id} ({failed.task}, attempt {failed.attempts}): "
+                f"{failed.last_error}"
+            )
+            break
+        if len(messages) < batch_size:
+            break
+
+    stats['elapsed'] = time.monotonic() - started
+    return stats
@@ -0,0 +1,273 @@
+"""
+Keyset (cursor) pagination for long histories.
+
+Page-number pagination runs ``OFFSET n`` plus ``COUNT(*)`` on every page, which
+gets linearly slower with depth. Keyset pagination instead remembers the sort
+key of the last row served and asks for rows strictly after it, so every page is
+a bounded index range scan. Cursors are opaque, base64-encoded sort keys.
+
+Views opt in with ``KeysetPaginationMixin``; clients opt in per request with
+``?pagination=keyset`` and then follow the ``next`` link.
+"""
+import base64
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Return the planner's row estimate for ``queryset``.
+
+    On PostgreSQL this reads ``Plan Rows`` from ``EXPLAIN`` instead of scanning
+    the rows; other databases fall back to an exact ``count()``.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class PrecountedPageNumberPagination(PageNumberPagination):
+    """
+    Page-number pagination that reuses a total computed by the view.
+    
+    Set ``known_count`` before ``paginate_queryset()`` (e.g. from an aggregate
+    that also returns other counters) to skip the paginator's own ``COUNT(*)``.
+    """
+    known_count = None
+
+    def django_paginator_class(self, object_list, per_page):
+        paginator = DjangoPaginator(object_list, per_page)
+        if self.known_count is not None:
+            paginator.count = self.known_count
+        return paginator
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset(). The page is read with the async
+        ORM; without ``known_count`` the total is counted first.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        if self.known_count is None:
+            self.known_count = await queryset.acount()
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+
+        self.request = request
+        return [row async for row in self.page.object_list]
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate on the sort key of the queryset, e.g. ``('-date', '-id')``.
+
+    The key is the queryset's own ``order_by()`` (``ordering`` if it has none),
+    with ``id`` appended as a tie-breaker so that it is a total order, so keyset
+    pages come in the same order as page-number pages. Ordering by expressions
+    or nullable fields cannot be resumed from a cursor and is rejected with a
+    400. Pass ``?with_count=true`` to get an estimated total.
+    """
+    ordering = None
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'with_count'
+
+    @classmethod
+    def is_requested(cls, request):
+        """Return True if the client asked for keyset pagination."""
+        return (
+            request.query_params.get(cls.mode_query_param) == 'keyset'
+            or cls.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        count = estimate_count(queryset) if self.count_requested(request) else None
+        return self.finish_page(list(self.start_page(queryset, request, count)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async version of paginate_queryset()."""
+        count = await sync_to_async(estimate_count)(queryset) if self.count_requested(request) else None
+        return self.finish_page([row async for row in self.start_page(queryset, request, count)])
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() == 'true'
+
+    def get_ordering(self, queryset):
+        """Return the sort key of ``queryset``: its ordering plus a trailing ``id``."""
+        ordering = []
+        for field in queryset.query.order_by or self.ordering:
+            descending = isinstance(field, str) and field.startswith('-')
+            name = field.lstrip('-') if isinstance(field, str) else None
+            name = 'id' if name == 'pk' else name
+            try:
+                if name is None or queryset.model._meta.get_field(name).null:
+                    raise FieldDoesNotExist(name)
+            except FieldDoesNotExist:
+                raise ValidationError({'ordering': f'Ordering by {field} is not supported with keyset pagination'})
+            ordering.append(f'-{name}' if descending else name)
+
+        if ordering[-1].lstrip('-') != 'id':
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def start_page(self, queryset, request, count=None):
+        """Return the unevaluated queryset of the page rows plus one look-ahead row."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.count = count
+
+        queryset = queryset.order_by(*self.ordering)
+        if queryset._fields:
+            # values() rows must carry the sort key the next cursor is built from
+            missing = [field for field in self.fields if field not in queryset._fields]
+            if missing:
+                queryset = queryset.values(*queryset._fields, *missing)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, results):
+        """Drop the look-ahead row from the fetched ``results`` and remember the next position."""
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = (
+            [self.get_row_value(results[-1], field) for field in self.fields] if self.has_next else None
+        )
+        return results
+
+    @staticmethod
+    def get_row_value(row, field):
+        """Read ``field`` from a model instance or a ``values()`` dict."""
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_position_filter(self, position):
+        """
+        Build the filter for rows after ``position``.
+
+        ``(a, b, c) < (x, y, z)`` is written as
+        ``a <= x AND (a < x OR (a = x AND (b < y OR (b = y AND c < z))))`` so the
+        leading ``a <= x`` bound can drive an index range scan.
+        """
+        ops = ['lt' if field.startswith('-') else 'gt' for field in self.ordering]
+        after = None
+        for field, op, value in reversed(list(zip(self.fields, ops, position))):
+            strictly = Q(**{f'{field}__{op}': value})
+            after = strictly if after is None else strictly | (Q(**{field: value}) & after)
+        return Q(**{f'{self.fields[0]}__{ops[0]}e': position[0]}) & after
+
+    def encode_cursor(self, position):
+        raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in position])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if len(raw) != len(self.fields):
+                raise ValueError(raw)
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, raw)
+            ]
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, 'keyset')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Estimated total, only with with_count=true'},
+                'results': schema,
+            },
+        }
+
+
+class HealthDataKeysetPagination(KeysetPagination):
+    """Keyset pagination for HealthData, newest day first unless the queryset is ordered."""
+    ordering = ('-date', '-id')
+
+
+class RecommendationKeysetPagination(KeysetPagination):
+    """Keyset pagination for Recommendations, newest first unless the queryset is ordered."""
+    ordering = ('-created_at', '-id')
+
+
+class KeysetPaginationMixin:
+    """
+    Let a generic view switch from the default paginator to
+    ``keyset_pagination_class`` when the client requests keyset pagination.
+    """
+    keyset_pagination_class = None
+
+    def keyset_requested(self):
+        return (
+            self.keyset_pagination_class is not None
+            and self.keyset_pagination_class.is_requested(self.request)
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.keyset_requested():
+                self._paginator = self.keyset_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
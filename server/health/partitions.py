@@ -0,0 +1,199 @@
+"""
+Monthly range partitioning of ``health_data`` and ``recommendations``.
+
+Both tables are partitioned by their ``date`` column, one partition per calendar
+month (``health_data_p2026_01`` holds January 2026), plus a default partition
+that catches dates no monthly partition covers yet. Django does not need to know:
+the models, the ``(user, date)`` unique constraint and all indexes live on the
+parent table and apply to every partition. Queries filtering on ``date`` (recent
+windows, the hourly anti-join, weekly summaries) only scan the matching
+partitions.
+
+PostgreSQL requires primary keys of partitioned tables to contain the partition
+key, so the primary key becomes ``(id, date)``; ``id`` stays unique because it
+comes from one sequence. Indexes added to these tables later cannot be built
+``CONCURRENTLY`` on the parent. The tables are converted once, by migration
+``0009_partition_health_data_and_recommendations``, which owns that DDL.
+
+Partitions are created ahead of time by ``manage.py manage_partitions`` (and the
+daily ``maintain_partitions`` task), which also detaches and optionally drops
+partitions older than the retention period instead of deleting row by row.
+"""
+import re
+from datetime import date
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+PARTITIONED_TABLES = ('health_data', 'recommendations')
+PARTITION_KEY = 'date'
+
+_BOUND_RE = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def month_start(day, months=0):
+    """Return the first day of the month of ``day``, shifted by ``months``."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month.year}_{month.month:02d}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def is_partitioned(table, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def list_partitions(table, using=DEFAULT_DB_ALIAS):
+    """
+    Return the monthly partitions of ``table`` as ``(name, start, end)`` tuples
+    in date order; the default partition is not included.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+            'FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s)',
+            [table]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, date.fromisoformat(match[1]), date.fromisoformat(match[2])))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _insertable_columns(table, cursor):
+    """Columns of ``table`` that accept values (generated columns excluded)."""
+    cursor.execute(
+        'SELECT column_name FROM information_schema.columns '
+        "WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER' "
+        'ORDER BY ordinal_position',
+        [table]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(table, month, using=DEFAULT_DB_ALIAS):
+    """
+    Create the partition of ``table`` for ``month`` if it does not exist.
+
+    Rows that already landed in the default partition for that month are moved
+    into the new partition in the same transaction. Returns True if created.
+    """
+    name = partition_name(table, month)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    start, end = month_start(month), month_start(month, 1)
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+
+        default = default_partition_name(table)
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [default])
+        has_default = cursor.fetchone()[0]
+
+        cursor.execute(
+            f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)'
+        )
+        if has_default:
+            columns = ', '.join(qn(column) for column in _insertable_columns(table, cursor))
+            cursor.execute(
+                f'WITH moved AS ('
+                f'DELETE FROM {qn(default)} WHERE {qn(PARTITION_KEY)} >= %s AND {qn(PARTITION_KEY)} < %s '
+                f'RETURNING {columns}'
+                f') INSERT INTO {qn(name)} ({columns}) SELECT {columns} FROM moved',
+                [start, end]
+            )
+        cursor.execute(
+            f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)',
+            [start, end]
+        )
+    return True
+
+
+def ensure_partitions(table, months_ahead, using=DEFAULT_DB_ALIAS, today=None):
+    """
+    Make sure ``table`` has partitions from the current month through
+    ``months_ahead`` months ahead. Returns the names of created partitions.
+    """
+    current = month_start(today or date.today())
+    return [
+        partition_name(table, month)
+        for month in (month_start(current, offset) for offset in range(months_ahead + 1))
+        if create_partition(table, month, using=using)
+    ]
+
+
+def detach_partitions(table, before, drop=False, using=DEFAULT_DB_ALIAS):
+    """
+    Detach every monthly partition of ``table`` that ends on or before
+    ``before``, and drop it if ``drop`` is true. Detached tables keep their data
+    and can be archived or dropped later. Returns ``(name, user_ids)`` per
+    partition, where ``user_ids`` are the users that had rows in it.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    detached = []
+    for name, start, end in list_partitions(table, using=using):
+        if end > before:
+            continue
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT {qn("user_id")} FROM {qn(name)}')
+            user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+        detached.append((name, user_ids))
+    return detached
+
+
+def maintain_partitions(months_ahead, retain_months=None, drop=False, using=DEFAULT_DB_ALIAS):
+    """
+    Create upcoming partitions of every partitioned table and, if
+    ``retain_months`` is set, detach (or drop) the ones older than that.
+
+    Retention may not cut into the HealthRollup windows, which are maintained
+    incrementally and would not see the rows disappear. Returns
+    ``{table: {'created': [...], 'detached': [...]}}``.
+    """
+    from .cache import bump_user_versions
+    from .models import HealthRollup, recommendations_changed
+
+    today = date.today()
+    before = month_start(today, -retain_months) if retain_months else None
+    if before and (today - before).days < max(HealthRollup.WINDOWS):
+        raise ValueError(
+            f'Retention of {retain_months} months is shorter than the '
+            f'{max(HealthRollup.WINDOWS)}-day health rollup window'
+        )
+
+    report = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table, using=using):
+            continue
+        created = ensure_partitions(table, months_ahead, using=using, today=today)
+        detached = detach_partitions(table, before, drop=drop, using=using) if before else []
+
+        user_ids = {user_id for _, partition_user_ids in detached for user_id in partition_user_ids}
+        if table == 'recommendations':
+            recommendations_changed(user_ids)
+        else:
+            bump_user_versions(user_ids)
+        report[table] = {'created': created, 'detached': [name for name, _ in detached]}
+    return report
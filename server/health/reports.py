@@ -0,0 +1,241 @@
+"""
+Weekly summaries: computed set-based, sent at the same local time to every user.
+
+Users are bucketed by the UTC offset their ``UserProfile.timezone`` has at a
+given hour (all zones sharing an offset share a local time). Every hour, the
+``schedule_weekly_summaries`` task queues the summaries of the buckets whose
+local time is HEALTH_WEEKLY_SUMMARY_HOUR on HEALTH_WEEKLY_SUMMARY_WEEKDAY, so
+users get them at e.g. Monday 8:00 their time, and each run only touches the
+users whose time it is.
+
+A bucket's users are queued in chunks of HEALTH_REPORT_CHUNK_SIZE, each as one
+``generate_weekly_summaries`` outbox message becoming due
+HEALTH_REPORT_CHUNK_INTERVAL seconds after the previous one, so workers and the
+database get a steady trickle instead of the whole bucket at once.
+
+Progress is saved in a JobCheckpoint in the transaction that queues each
+chunk: the UTC hour being scheduled, the bucket and the last user queued. A
+restarted or late run resumes after the last queued chunk, and catches up on
+hours it missed (at most HEALTH_REPORT_CATCH_UP_HOURS), so no bucket is sent
+twice or skipped. Summaries are upserted by fingerprint, so the at-least-once
+delivery of the outbox cannot duplicate them either.
+
+Summaries themselves are computed set-based by ``write_weekly_summaries``: one
+``GROUP BY user_id`` aggregate over the week's HealthData partitions, for a
+chunk of users, a shard or everyone, streamed from a server-side cursor,
+rendered in Python and upserted HEALTH_REPORT_WRITE_CHUNK_SIZE recommendations
+at a time.
+"""
+import logging
+import time
+from datetime import timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics, outbox
+from .models import HealthData, JobCheckpoint, Recommendation, UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+CHECKPOINT_NAME = 'schedule_weekly_summaries'
+
+# Generator name in the fingerprints of weekly summary recommendations
+WEEKLY_SUMMARY_SOURCE = 'weekly_summary'
+WEEKLY_SUMMARY_DAYS = 7
+
+
+def weekly_summary_stats(end_date, user_ids=None, shard=None, shards=1, chunk_size=None):
+    """
+    Stream ``(user_id, stats)`` for the week ending on ``end_date``, in user ID
+    order, from one ``GROUP BY user_id`` query. Limited to ``user_ids`` or to the
+    users whose ID is ``shard`` modulo ``shards`` if given; users without data
+    that week are left out.
+    """
+    start_date = end_date - timedelta(days=WEEKLY_SUMMARY_DAYS)
+    queryset = HealthData.objects.filter(date__range=[start_date, end_date])
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    if shard is not None:
+        queryset = queryset.alias(shard=F('user_id') % shards).filter(shard=shard)
+
+    rows = queryset.order_by('user_id').values('user_id').annotate(
+        avg_steps=Avg('steps'),
+        total_steps=Sum('steps'),
+        avg_sleep=Avg('sleep_hours'),
+        avg_heart_rate=Avg('heart_rate_avg')
+    ).iterator(chunk_size=chunk_size or settings.HEALTH_REPORT_WRITE_CHUNK_SIZE)
+    for row in rows:
+        yield row.pop('user_id'), row
+
+
+def render_weekly_summary(user_id, end_date, stats, expires_at):
+    """Return the unsaved weekly summary Recommendation of ``stats``."""
+    start_date = end_date - timedelta(days=WEEKLY_SUMMARY_DAYS)
+    heart_rate = f"{stats['avg_heart_rate']:.0f} BPM average" if stats['avg_heart_rate'] is not None else 'no data'
+    content = f"""Weekly Health Summary:
+        
+        📊 Steps: {stats['total_steps']:,} total ({stats['avg_steps']:.0f} daily average)
+        😴 Sleep: {stats['avg_sleep']:.1f} hours average
+        ❤️ Heart Rate: {heart_rate}
+        
+        Keep up the great work! Review your detailed metrics in the app.
+        """
+    return Recommendation(
+        user_id=user_id,
+        date=end_date,
+        fingerprint=Recommendation.fingerprint_for(user_id, end_date, WEEKLY_SUMMARY_SOURCE, 'general'),
+        title=f'Weekly Health Summary - {start_date.strftime("%b %d")} to {end_date.strftime("%b %d")}',
+        content=content,
+        type='general',
+        priority='low',
+        confidence_score=1.0,
+        model_version='summary_v1.0',
+        expires_at=expires_at
+    )
+
+
+def write_weekly_summaries(end_date, user_ids=None, shard=None, shards=1, chunk_size=None):
+    """
+    Create or refresh the weekly summaries ending on ``end_date`` of every user
+    with data that week, or of ``user_ids``, or of one shard of the users.
+
+    Returns a dict with ``users`` (summaries written), ``created``, ``elapsed``
+    and ``rows_per_second``.
+    """
+    chunk_size = chunk_size or settings.HEALTH_REPORT_WRITE_CHUNK_SIZE
+    expires_at = timezone.now() + timedelta(days=30)
+    stats = {'users': 0, 'created': 0, 'elapsed': 0.0, 'rows_per_second': 0.0}
+    started = time.monotonic()
+
+    def write(chunk):
+        saved = Recommendation.objects.upsert(chunk)
+        stats['users'] += len(saved)
+        stats['created'] += sum(1 for *_, created in saved if created)
+
+    chunk = []
+    for user_id, week in weekly_summary_stats(end_date, user_ids, shard, shards, chunk_size):
+        chunk.append(render_weekly_summary(user_id, end_date, week, expires_at))
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            chunk = []
+    if chunk:
+        write(chunk)
+
+    stats['elapsed'] = time.monotonic() - started
+    stats['rows_per_second'] = stats['users'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    return stats
+
+
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def active_timezones():
+    """Timezone names of active users."""
+    return set(
+        UserProfile.objects.filter(is_active=True, user__is_active=True)
+        .order_by().values_list('timezone', flat=True).distinct()
+    )
+
+
+def timezone_buckets(hour, timezones):
+    """
+    Group ``timezones`` by their UTC offset at ``hour`` (an aware datetime).
+    Returns ``{offset: (local datetime, [timezone names])}``, offsets as timedeltas.
+    """
+    buckets = {}
+    for name in sorted(timezones):
+        local = hour.astimezone(_zone(name))
+        offset = local.utcoffset()
+        buckets.setdefault(offset, (local, []))[1].append(name)
+    return buckets
+
+
+def due_buckets(hour, timezones):
+    """The buckets of ``timezones`` whose local time at ``hour`` is the weekly summary time, by offset."""
+    return sorted(
+        (offset, local.date(), names)
+        for offset, (local, names) in timezone_buckets(hour, timezones).items()
+        if local.hour == settings.HEALTH_WEEKLY_SUMMARY_HOUR
+        and local.weekday() == settings.HEALTH_WEEKLY_SUMMARY_WEEKDAY
+    )
+
+
+def _save_checkpoint(hour, offset=None, last_user_id=0):
+    JobCheckpoint.objects.update_or_create(name=CHECKPOINT_NAME, defaults={'state': {
+        'hour': hour,
+        'offset': offset.total_seconds() if offset is not None else None,
+        'last_user_id': last_user_id,
+    }})
+
+
+def schedule_weekly_summaries(now=None, chunk_size=None, chunk_interval=None):
+    """
+    Queue the weekly summaries of every bucket that became due since the last
+    run, up to the current hour. Returns a dict with ``hours``, ``buckets``,
+    ``users`` and ``chunks``.
+    """
+    from .tasks import generate_weekly_summaries
+
+    chunk_size = chunk_size or settings.HEALTH_REPORT_CHUNK_SIZE
+    chunk_interval = settings.HEALTH_REPORT_CHUNK_INTERVAL if chunk_interval is None else chunk_interval
+    current = (now or timezone.now()).replace(minute=0, second=0, microsecond=0)
+    oldest = current - timedelta(hours=settings.HEALTH_REPORT_CATCH_UP_HOURS)
+
+    checkpoint = JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    if checkpoint:
+        hour = parse_datetime(checkpoint.state['hour'])
+        resume_offset = checkpoint.state['offset']
+        resume_user_id = checkpoint.state['last_user_id']
+        if hour < oldest:
+            logger.warning(f"Weekly summary schedule was {current - hour} behind, skipping to {oldest}")
+            hour, resume_offset, resume_user_id = oldest, None, 0
+    else:
+        hour, resume_offset, resume_user_id = current, None, 0
+
+    stats = {'hours': 0, 'buckets': 0, 'users': 0, 'chunks': 0}
+    timezones = active_timezones()
+    while hour <= current:
+        for offset, local_date, names in due_buckets(hour, timezones):
+            if resume_offset is not None and offset.total_seconds() < resume_offset:
+                continue
+            last_user_id = resume_user_id if resume_offset == offset.total_seconds() else 0
+
+            users = (
+                UserProfile.objects.filter(is_active=True, user__is_active=True, timezone__in=names)
+                .order_by('user_id').values_list('user_id', flat=True)
+            )
+            while True:
+                user_ids = list(users.filter(user_id__gt=last_user_id)[:chunk_size])
+                if not user_ids:
+                    break
+                last_user_id = user_ids[-1]
+                with transaction.atomic():
+                    outbox.enqueue(
+                        generate_weekly_summaries, (user_ids, local_date),
+                        dedupe_key=f'generate_weekly_summaries:{local_date}:{user_ids[0]}',
+                        delay=stats['chunks'] * chunk_interval
+                    )
+                    _save_checkpoint(hour, offset, last_user_id)
+                stats['users'] += len(user_ids)
+                stats['chunks'] += 1
+                metrics.inc('health_reports_queued_total', (('report', 'weekly_summary'),), len(user_ids))
+
+            stats['buckets'] += 1
+            logger.info(f"Queued weekly summaries of {', '.join(names)} for {local_date}")
+            resume_offset, resume_user_id = None, 0
+
+        hour += timedelta(hours=1)
+        stats['hours'] += 1
+        _save_checkpoint(hour)
+
+    return stats
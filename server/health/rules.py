@@ -0,0 +1,268 @@
+"""
+Declarative, vectorized recommendation rules.
+
+A ruleset is data: a version string plus a list of threshold rules on one
+HealthData metric each. HealthData rows are loaded a chunk at a time into NumPy
+columns, every rule is evaluated as one boolean mask over the chunk, and the
+resulting Recommendations are upserted per chunk. ``model_version`` on each
+Recommendation is the version of the ruleset.
+
+Processing is idempotent: each recommendation is fingerprinted by user, day,
+rule ID and type (``Recommendation.fingerprint_for``), and written with
+``Recommendation.objects.upsert``, so a user-day has at most one recommendation
+per rule. Re-processing a day, e.g. after the app synced it again, refreshes
+those recommendations in place from the latest data, and removes ones whose
+rule no longer fires unless the user has already read, completed or rated them.
+
+With HEALTH_ANOMALY_DETECTION on, each chunk also gets the anomaly
+recommendations of analytics.py (days far from the user's own rolling norm),
+written and removed the same way.
+
+Set ``HEALTH_RULESET_PATH`` to a JSON file to replace the built-in ruleset::
+
+    {"version": "v1.1.0", "rules": [
+        {"id": "low_steps", "metric": "steps", "op": "lt", "value": 5000,
+         "title": "Increase Daily Steps", "content": "You walked {steps} steps today.",
+         "type": "exercise", "priority": "medium", "confidence_score": 0.85}
+    ]}
+"""
+import json
+import operator
+import string
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics
+from .models import HealthData, Recommendation
+
+
+# Columns loaded for rule evaluation; metrics are the ones rules may test
+COLUMNS = ('id', 'user_id', 'date', 'steps', 'sleep_hours', 'heart_rate_avg', 'calories_burned')
+METRICS = ('steps', 'sleep_hours', 'heart_rate_avg', 'calories_burned')
+
+OPERATORS = {
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+DEFAULT_RULESET = {
+    'version': 'v1.0.0',
+    'rules': [
+        {
+            'id': 'low_steps',
+            'metric': 'steps', 'op': 'lt', 'value': 5000,
+            'title': 'Increase Daily Steps',
+            'content': 'You walked {steps} steps today. Try to reach 10,000 steps daily for better health.',
+            'type': 'exercise', 'priority': 'medium', 'confidence_score': 0.85,
+        },
+        {
+            'id': 'short_sleep',
+            'metric': 'sleep_hours', 'op': 'lt', 'value': 6,
+            'title': 'Improve Sleep Quality',
+            'content': 'You slept only {sleep_hours} hours. Aim for 7-9 hours of quality sleep.',
+            'type': 'sleep', 'priority': 'high', 'confidence_score': 0.90,
+        },
+        {
+            'id': 'long_sleep',
+            'metric': 'sleep_hours', 'op': 'gt', 'value': 9,
+            'title': 'Sleep Schedule Optimization',
+            'content': 'You slept {sleep_hours} hours. Consider a consistent sleep schedule.',
+            'type': 'sleep', 'priority': 'low', 'confidence_score': 0.75,
+        },
+        {
+            'id': 'high_heart_rate',
+            'metric': 'heart_rate_avg', 'op': 'gt', 'value': 100,
+            'title': 'Monitor Heart Rate',
+            'content': 'Your average heart rate was {heart_rate_avg} BPM. Consider stress management techniques.',
+            'type': 'mindfulness', 'priority': 'medium', 'confidence_score': 0.80,
+        },
+    ],
+}
+
+
+@dataclass(frozen=True)
+class Rule:
+    """A threshold on one metric that produces one recommendation."""
+
+    id: str
+    metric: str
+    op: str
+    value: float
+    title: str
+    content: str
+    type: str
+    priority: str
+    confidence_score: float
+
+    @property
+    def source(self):
+        """Generator name in the fingerprints of this rule's recommendations."""
+        return f'rule:{self.id}'
+
+    def mask(self, columns):
+        """Boolean mask of the rows in ``columns`` that trigger this rule (NaN never does)."""
+        return OPERATORS[self.op](columns[self.metric], self.value)
+
+
+@dataclass(frozen=True)
+class Ruleset:
+    version: str
+    rules: tuple
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build and validate a ruleset from its JSON form."""
+        type_choices = {choice for choice, _ in Recommendation.RECOMMENDATION_TYPES}
+        priority_choices = {choice for choice, _ in Recommendation.PRIORITY_LEVELS}
+
+        rules = []
+        for rule_data in data['rules']:
+            try:
+                rule = Rule(**rule_data)
+            except TypeError as e:
+                raise ImproperlyConfigured(f"Rule '{rule_data.get('id')}': {e}")
+            if rule.metric not in METRICS:
+                raise ImproperlyConfigured(f"Rule '{rule.id}': unknown metric '{rule.metric}'")
+            if rule.op not in OPERATORS:
+                raise ImproperlyConfigured(f"Rule '{rule.id}': unknown op '{rule.op}'")
+            if rule.type not in type_choices or rule.priority not in priority_choices:
+                raise ImproperlyConfigured(f"Rule '{rule.id}': invalid type or priority")
+            # content is formatted with a row's COLUMNS
+            try:
+                placeholders = {field for _, field, _, _ in string.Formatter().parse(rule.content) if field is not None}
+            except ValueError as e:
+                raise ImproperlyConfigured(f"Rule '{rule.id}': invalid content: {e}")
+            unknown = placeholders - set(COLUMNS)
+            if unknown:
+                raise ImproperlyConfigured(
+                    f"Rule '{rule.id}': unknown placeholders in content: {', '.join(sorted(unknown))}"
+                )
+            rules.append(rule)
+
+        return cls(version=data['version'], rules=tuple(rules))
+
+
+@lru_cache(maxsize=None)
+def load_ruleset(path=None):
+    """Load the ruleset from ``path`` (JSON) or the built-in default."""
+    if not path:
+        return Ruleset.from_dict(DEFAULT_RULESET)
+    with open(path) as ruleset_file:
+        return Ruleset.from_dict(json.load(ruleset_file))
+
+
+def get_ruleset():
+    return load_ruleset(settings.HEALTH_RULESET_PATH)
+
+
+def to_columns(rows):
+    """Turn ``COLUMNS`` tuples into float arrays per metric (NULL becomes NaN)."""
+    columns = {}
+    for index, name in enumerate(COLUMNS):
+        if name in METRICS:
+            columns[name] = np.array(
+                [row[index] if row[index] is not None else np.nan for row in rows],
+                dtype=np.float64
+            )
+    return columns
+
+
+def evaluate(rows, ruleset):
+    """Return unsaved Recommendations for ``rows`` (``COLUMNS`` tuples)."""
+    if not rows:
+        return []
+
+    columns = to_columns(rows)
+    expires_at = timezone.now() + timedelta(days=7)  # Expire in 7 days
+    recommendations = []
+
+    for rule in ruleset.rules:
+        for index in np.flatnonzero(rule.mask(columns)):
+            row = dict(zip(COLUMNS, rows[index]))
+            recommendations.append(Recommendation(
+                user_id=row['user_id'],
+                date=row['date'],
+                fingerprint=Recommendation.fingerprint_for(row['user_id'], row['date'], rule.source, rule.type),
+                title=rule.title,
+                content=rule.content.format(**row),
+                type=rule.type,
+                priority=rule.priority,
+                confidence_score=rule.confidence_score,
+                model_version=ruleset.version,
+                expires_at=expires_at
+            ))
+
+    return recommendations
+
+
+def generate_recommendations(queryset, ruleset=None, chunk_size=None):
+    """
+    Evaluate ``ruleset`` over every HealthData row in ``queryset``.
+
+    Rows are streamed in chunks; each chunk is evaluated with vectorized masks
+    and upserted. Returns ``(rows, recommendations created)``.
+    """
+    ruleset = ruleset or get_ruleset()
+    chunk_size = chunk_size or settings.HEALTH_RULES_CHUNK_SIZE
+    row_count = 0
+    created_count = 0
+
+    rows = queryset.order_by().values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            created_count += _write_chunk(chunk, ruleset)
+            row_count += len(chunk)
+            chunk = []
+    if chunk:
+        created_count += _write_chunk(chunk, ruleset)
+        row_count += len(chunk)
+
+    return row_count, created_count
+
+
+def _write_chunk(rows, ruleset):
+    """Upsert the recommendations of ``rows``; returns the number created."""
+    with transaction.atomic():
+        # Locking the rows serializes runs over the same user-days and re-reads
+        # their latest values
+        rows = list(
+            HealthData.objects.filter(id__in=[row[0] for row in rows], date__in={row[2] for row in rows})
+            .order_by('id').select_for_update().values_list(*COLUMNS)
+        )
+        days = {(row[1], row[2]) for row in rows}
+        generated = evaluate(rows, ruleset)
+        if settings.HEALTH_ANOMALY_DETECTION:
+            generated += analytics.detect(rows)
+        saved = Recommendation.objects.upsert(generated)
+
+        # Fingerprints of the rules that did not fire for these user-days
+        fired = {rec.fingerprint for rec in generated}
+        unfired = {
+            Recommendation.fingerprint_for(user_id, day, rule.source, rule.type)
+            for user_id, day in days for rule in ruleset.rules
+        }
+        if settings.HEALTH_ANOMALY_DETECTION:
+            for user_id, day in days:
+                unfired |= analytics.fingerprints(user_id, day)
+        unfired -= fired
+        existing = Recommendation.objects.filter(
+            user_id__in={user_id for user_id, _ in days},
+            date__in={day for _, day in days},
+            is_read=False, is_completed=False, user_rating__isnull=True
+        ).values_list('id', 'fingerprint')
+        stale = [rec_id for rec_id, fingerprint in existing if fingerprint in unfired]
+        if stale:
+            # The post_delete receiver refreshes the owners' counters and caches
+            Recommendation.objects.filter(id__in=stale).delete()
+    return sum(1 for *_, created in saved if created)
@@ -1,9 +1,10 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
+from django.conf import settings
 from django.utils import timezone
 from datetime import date
 
-from .models import UserProfile, HealthData, Recommendation
+from .models import UserProfile, HealthData, Recommendation, BufferedHealthData
+from .users import resolve_user
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -21,12 +22,27 @@ class UserProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class HealthDataSerializer(serializers.ModelSerializer):
+class UserIdentifierMixin:
+    """Resolve a ``user_id`` field given as a username or numeric ID."""
+    
+    user_not_found_message = "User '{value}' not found."
+    
+    def validate_user_id(self, value):
+        """Find user by username or ID, reusing the authenticated user and cached lookups."""
+        user = resolve_user(value, self.context.get('request'))
+        if user is None:
+            raise serializers.ValidationError(self.user_not_found_message.format(value=value))
+        return user
+
+
+class HealthDataSerializer(UserIdentifierMixin, serializers.ModelSerializer):
     """Serializer for HealthData model."""
     
     user_id = serializers.CharField(write_only=True, help_text="User ID as string")
     activity_score = serializers.ReadOnlyField()
     
+    user_not_found_message = "User with identifier '{value}' does not exist."
+    
     class Meta:
         model = HealthData
         fields = [
@@ -36,19 +52,6 @@ class HealthDataSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'activity_score', 'created_at', 'updated_at']
     
-    def validate_user_id(self, value):
-        """Validate that user_id exists and get User instance."""
-        try:
-            user = User.objects.get(username=value)
-            return user
-        except User.DoesNotExist:
-            # Try to get by ID if username doesn't work
-            try:
-                user = User.objects.get(id=int(value))
-                return user
-            except (User.DoesNotExist, ValueError):
-                raise serializers.ValidationError(f"User with identifier '{value}' does not exist.")
-    
     def validate_date(self, value):
         """Validate date is not in the future."""
         if value > date.today():
@@ -80,8 +83,7 @@ class HealthDataSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """Create or update HealthData instance."""
-        user_id = validated_data.pop('user_id')
-        user = self.validate_user_id(user_id)
+        user = validated_data.pop('user_id')
         
         # Use update_or_create to handle duplicate dates
         health_data, created = HealthData.objects.update_or_create(
@@ -89,6 +91,8 @@ class HealthDataSerializer(serializers.ModelSerializer):
             date=validated_data['date'],
             defaults=validated_data
         )
+        # Updated rows are re-read without their user; reuse the resolved one
+        health_data.user = user
         
         return health_data
     
@@ -178,10 +182,9 @@ class RecommendationActionSerializer(serializers.Serializer):
         return data
 
 
-class HealthDataCreateUpdateSerializer(serializers.Serializer):
-    """Specialized serializer for creating/updating health data from mobile app."""
+class HealthDataRecordSerializer(serializers.Serializer):
+    """Validates a single day of health metrics sent by the mobile app."""
     
-    user_id = serializers.CharField(help_text="User identifier")
     date = serializers.DateField(help_text="Date of the health data (YYYY-MM-DD)")
     steps = serializers.IntegerField(min_value=0, max_value=100000)
     sleep_hours = serializers.DecimalField(
@@ -201,23 +204,17 @@ class HealthDataCreateUpdateSerializer(serializers.Serializer):
         default='moderate'
     )
     
-    def validate_user_id(self, value):
-        """Find user by username or ID."""
-        try:
-            # Try username first
-            return User.objects.get(username=value)
-        except User.DoesNotExist:
-            try:
-                # Try ID
-                return User.objects.get(id=int(value))
-            except (User.DoesNotExist, ValueError):
-                raise serializers.ValidationError(f"User '{value}' not found.")
-    
     def validate_date(self, value):
         """Ensure date is not in future."""
         if value > date.today():
             raise serializers.ValidationError("Date cannot be in the future.")
         return value
+
+
+class HealthDataCreateUpdateSerializer(UserIdentifierMixin, HealthDataRecordSerializer):
+    """Specialized serializer for creating/updating health data from mobile app."""
+    
+    user_id = serializers.CharField(help_text="User identifier")
     
     def save(self):
         """Create or update health data record."""
@@ -229,5 +226,84 @@ class HealthDataCreateUpdateSerializer(serializers.Serializer):
             date=validated_data['date'],
             defaults=validated_data
         )
+        # Updated rows are re-read without their user; reuse the resolved one
+        health_data.user = user
         
         return health_data, created
+    
+    def enqueue(self):
+        """Append the record to the write-behind buffer instead of writing it."""
+        validated_data = self.validated_data.copy()
+        user = validated_data.pop('user_id')
+        
+        return BufferedHealthData.objects.create(
+            user=user,
+            date=validated_data.pop('date'),
+            payload=validated_data
+        )
+
+
+class HealthDataBatchSerializer(UserIdentifierMixin, serializers.Serializer):
+    """
+    Batch of daily health records for one user, e.g. a Health Connect backfill.
+    
+    Records are validated one by one so that a bad day does not reject the whole
+    batch; valid records are written with a single set-based upsert.
+    """
+    
+    user_id = serializers.CharField(help_text="User identifier")
+    records = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.HEALTH_DATA_BATCH_MAX_RECORDS,
+        help_text="List of daily health records"
+    )
+    
+    def validate(self, data):
+        """Validate each record and keep the last record for every date."""
+        results = []
+        valid = {}
+        
+        for index, record in enumerate(data['records']):
+            record_serializer = HealthDataRecordSerializer(data=record)
+            if not record_serializer.is_valid():
+                results.append({
+                    'index': index,
+                    'date': record.get('date'),
+                    'status': 'invalid',
+                    'errors': record_serializer.errors,
+                })
+                continue
+            
+            record_data = record_serializer.validated_data
+            if record_data['date'] in valid:
+                # Last write wins for repeated dates within a batch
+                superseded = valid[record_data['date']]
+                superseded['status'] = 'superseded'
+                superseded.pop('data')
+            
+            result = {'index': index, 'date': record_data['date'], 'data': record_data}
+            valid[record_data['date']] = result
+            results.append(result)
+        
+        data['results'] = results
+        return data
+    
+    def save(self):
+        """Upsert all valid records and return per-record outcomes."""
+        user = self.validated_data['user_id']
+        results = self.validated_data['results']
+        pending = [result for result in results if 'data' in result]
+        
+        rows = [dict(result['data'], user_id=user.id) for result in pending]
+        saved = {
+            row_date: (health_data_id, created)
+            for health_data_id, _, row_date, created in HealthData.objects.upsert(rows)
+        }
+        
+        for result in pending:
+            result.pop('data')
+            result['id'], created = saved[result['date']]
+            result['status'] = 'created' if created else 'updated'
+        
+        return results
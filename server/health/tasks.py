@@ -1,9 +1,17 @@
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
+from decimal import Decimal
+import hashlib
 import logging
+import time
 
-from .models import HealthData, Recommendation
+from .models import HealthData, Recommendation, BufferedHealthData
+from . import cleanup as expiry_cleanup, metrics, outbox, partitions, reports
+from .rules import generate_recommendations
 
 logger = logging.getLogger(__name__)
 
@@ -12,152 +20,277 @@ logger = logging.getLogger(__name__)
 def process_health_data_ai(health_data_id):
     """
     Process health data and generate AI recommendations.
-    This is a placeholder for AI integration.
+    Thin wrapper over the batch rule engine for a single row.
     """
     try:
-        health_data = HealthData.objects.get(id=health_data_id)
-        logger.info(f"Processing health data for user {health_data.user.username}, date {health_data.date}")
-        
-        # Placeholder AI logic - replace with actual AI service calls
-        recommendations = []
-        
-        # Example: Step count recommendations
-        if health_data.steps < 5000:
-            recommendations.append({
-                'title': 'Increase Daily Steps',
-                'content': f'You walked {health_data.steps} steps today. Try to reach 10,000 steps daily for better health.',
-                'type': 'exercise',
-                'priority': 'medium',
-                'confidence_score': 0.85
-            })
-        
-        # Example: Sleep recommendations
-        if health_data.sleep_hours < 6:
-            recommendations.append({
-                'title': 'Improve Sleep Quality',
-                'content': f'You slept only {health_data.sleep_hours} hours. Aim for 7-9 hours of quality sleep.',
-                'type': 'sleep',
-                'priority': 'high',
-                'confidence_score': 0.90
-            })
-        elif health_data.sleep_hours > 9:
-            recommendations.append({
-                'title': 'Sleep Schedule Optimization',
-                'content': f'You slept {health_data.sleep_hours} hours. Consider a consistent sleep schedule.',
-                'type': 'sleep',
-                'priority': 'low',
-                'confidence_score': 0.75
-            })
-        
-        # Example: Heart rate recommendations
-        if health_data.heart_rate_avg and health_data.heart_rate_avg > 100:
-            recommendations.append({
-                'title': 'Monitor Heart Rate',
-                'content': f'Your average heart rate was {health_data.heart_rate_avg} BPM. Consider stress management techniques.',
-                'type': 'mindfulness',
-                'priority': 'medium',
-                'confidence_score': 0.80
-            })
-        
-        # Create recommendation objects
-        for rec_data in recommendations:
-            Recommendation.objects.create(
-                user=health_data.user,
-                date=health_data.date,
-                title=rec_data['title'],
-                content=rec_data['content'],
-                type=rec_data['type'],
-                priority=rec_data['priority'],
-                confidence_score=rec_data['confidence_score'],
-                model_version='v1.0.0',
-                expires_at=timezone.now() + timedelta(days=7)  # Expire in 7 days
-            )
+        rows, created = generate_recommendations(HealthData.objects.filter(id=health_data_id))
         
-        logger.info(f"Generated {len(recommendations)} recommendations for user {health_data.user.username}")
-        return f"Processed health data and generated {len(recommendations)} recommendations"
+        if not rows:
+            logger.error(f"HealthData with ID {health_data_id} not found")
+            return f"HealthData with ID {health_data_id} not found"
+        
+        logger.info(f"Generated {created} recommendations for health data {health_data_id}")
+        return f"Processed health data and generated {created} recommendations"
         
-    except HealthData.DoesNotExist:
-        logger.error(f"HealthData with ID {health_data_id} not found")
-        return f"HealthData with ID {health_data_id} not found"
-    
     except Exception as e:
+        metrics.mark_failed()
         logger.error(f"Error processing health data {health_data_id}: {str(e)}")
         return f"Error processing health data: {str(e)}"
 
 
 @shared_task
-def cleanup_expired_recommendations():
+def process_health_data_batch(health_data_ids):
+    """
+    Process many HealthData rows in one task, e.g. after a batch upload.
+    Rules are evaluated column-wise over all rows and written with bulk inserts.
+    """
+    try:
+        rows, created = generate_recommendations(HealthData.objects.filter(id__in=health_data_ids))
+        
+        logger.info(f"Generated {created} recommendations for {rows} health data records")
+        return f"Processed {rows} health data records and generated {created} recommendations"
+        
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error processing health data batch: {str(e)}")
+        return f"Error processing health data batch: {str(e)}"
+
+
+def schedule_health_data_processing(user_id, day):
+    """
+    Queue AI processing of one user-day through the outbox, coalescing repeated updates.
+    
+    Call in the transaction that writes the data. The first call for a (user, date)
+    adds an outbox message for process_health_data_day, published
+    HEALTH_AI_DEBOUNCE_SECONDS later. Calls while it waits add nothing: the run
+    reads the day's latest data, so it covers every update made before it starts.
+    Returns True if a run was queued.
+    """
+    queued = outbox.enqueue(
+        process_health_data_day, (user_id, str(day)),
+        dedupe_key=f'process_health_data_day:{user_id}:{day}',
+        delay=settings.HEALTH_AI_DEBOUNCE_SECONDS
+    )
+    metrics.inc('health_ai_dispatch_total', (('outcome', 'queued' if queued else 'coalesced'),))
+    return queued
+
+
+@shared_task
+def process_health_data_day(user_id, day):
+    """
+    Generate recommendations for one user-day from its latest HealthData.
+    Queued by schedule_health_data_processing; recommendations are upserted, so
+    running it again for the same data changes nothing.
+    """
+    try:
+        rows, created = generate_recommendations(HealthData.objects.filter(user_id=user_id, date=day))
+        
+        logger.info(f"Generated {created} recommendations for user {user_id} on {day}")
+        return f"Processed {rows} health data records and generated {created} recommendations"
+        
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error processing health data of user {user_id} on {day}: {str(e)}")
+        return f"Error processing health data: {str(e)}"
+
+
+@shared_task
+def flush_health_data_buffer(batch_size=None, max_batches=None):
+    """
+    Drain the write-behind buffer into HealthData.
+    
+    Buffered rows are claimed in id order with SKIP LOCKED so several flushers can
+    run at once, coalesced per (user, date) by applying payloads in arrival order
+    (last write wins), upserted in one statement and deleted in the same transaction.
+    """
+    batch_size = batch_size or settings.HEALTH_INGEST_FLUSH_BATCH_SIZE
+    flushed = 0
+    batches = 0
+    max_lag = 0.0
+    started = time.monotonic()
+    
+    try:
+        while max_batches is None or batches < max_batches:
+            with transaction.atomic():
+                buffered = list(
+                    BufferedHealthData.objects.select_for_update(skip_locked=True)
+                    .order_by('id')[:batch_size]
+                )
+                if not buffered:
+                    break
+                
+                coalesced = {}
+                for entry in buffered:
+                    row = coalesced.setdefault(
+                        (entry.user_id, entry.date),
+                        {'user_id': entry.user_id, 'date': entry.date}
+                    )
+                    row.update(entry.payload)
+                    if row.get('sleep_hours') is not None:
+                        row['sleep_hours'] = Decimal(str(row['sleep_hours']))
+                
+                saved = HealthData.objects.upsert(coalesced.values())
+                BufferedHealthData.objects.filter(id__in=[entry.id for entry in buffered]).delete()
+                
+                outbox.enqueue(process_health_data_batch, ([health_data_id for health_data_id, *_ in saved],))
+            
+            lag = (timezone.now() - buffered[0].received_at).total_seconds()
+            max_lag = max(max_lag, lag)
+            flushed += len(buffered)
+            batches += 1
+            metrics.inc('health_ingest_buffer_flushed_total', (), len(buffered))
+            metrics.observe('health_ingest_buffer_flush_lag_seconds', (), lag)
+            
+            if len(buffered) < batch_size:
+                break
+        
+        stats = BufferedHealthData.objects.stats()
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Flushed {flushed} buffered health records in {batches} batches ({elapsed:.2f}s), "
+            f"max flush lag {max_lag:.1f}s, buffer depth {stats['depth']}"
+        )
+        return f"Flushed {flushed} buffered health records, buffer depth {stats['depth']}"
+        
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error flushing health data buffer: {str(e)}")
+        return f"Error flushing health data buffer: {str(e)}"
+
+
+@shared_task
+def relay_outbox(batch_size=None, max_batches=None):
+    """
+    Publish due task outbox messages to the broker (see outbox.py).
+    Runs on the beat schedule; ``manage.py relay_outbox`` does the same in a loop.
+    """
+    try:
+        stats = outbox.relay(batch_size=batch_size, max_batches=max_batches)
+        
+        if stats['failed']:
+            metrics.mark_failed()
+        logger.info(f"Published {stats['published']} outbox messages in {stats['elapsed']:.2f}s")
+        return f"Published {stats['published']} outbox messages, {stats['failed']} failed"
+        
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error relaying outbox: {str(e)}")
+        return f"Error relaying outbox: {str(e)}"
+
+
+@shared_task
+def cleanup_expired_recommendations(batch_size=None, max_batches=None):
     """
     Clean up expired recommendations.
     Run this task daily.
+    
+    Rows are archived and deleted in checkpointed primary-key batches by
+    health.cleanup, so an interrupted run resumes where it stopped.
     """
     try:
-        expired_count = Recommendation.objects.filter(
-            expires_at__lt=timezone.now(),
-            is_completed=False
-        ).delete()[0]
+        stats = expiry_cleanup.cleanup_expired_recommendations(
+            batch_size=batch_size,
+            max_batches=max_batches
+        )
         
-        logger.info(f"Cleaned up {expired_count} expired recommendations")
-        return f"Cleaned up {expired_count} expired recommendations"
+        logger.info(
+            f"Cleaned up {stats['deleted']} expired recommendations in {stats['batches']} batches "
+            f"({stats['elapsed']:.2f}s, {stats['rows_per_second']:.0f} rows/s)"
+            + ("" if stats['complete'] else ", checkpoint saved")
+        )
+        return f"Cleaned up {stats['deleted']} expired recommendations"
         
     except Exception as e:
+        metrics.mark_failed()
         logger.error(f"Error cleaning up expired recommendations: {str(e)}")
         return f"Error cleaning up expired recommendations: {str(e)}"
 
 
 @shared_task
-def generate_weekly_summary(user_id):
+def maintain_partitions():
     """
-    Generate weekly health summary for a user.
+    Create upcoming monthly partitions and detach expired ones.
+    Run this task daily.
     """
     try:
-        from django.contrib.auth.models import User
-        from django.db.models import Avg, Sum
+        report = partitions.maintain_partitions(
+            settings.HEALTH_PARTITION_MONTHS_AHEAD,
+            retain_months=settings.HEALTH_PARTITION_RETENTION_MONTHS,
+            drop=settings.HEALTH_PARTITION_DROP_DETACHED
+        )
         
-        user = User.objects.get(id=user_id)
+        for table, changes in report.items():
+            logger.info(
+                f"Partitions of {table}: created {changes['created'] or 'none'}, "
+                f"detached {changes['detached'] or 'none'}"
+            )
+        return f"Maintained partitions of {len(report)} tables"
         
-        # Get last 7 days of data
-        end_date = timezone.now().date()
-        start_date = end_date - timedelta(days=7)
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error maintaining partitions: {str(e)}")
+        return f"Error maintaining partitions: {str(e)}"
+
+
+@shared_task
+def schedule_weekly_summaries():
+    """
+    Queue the weekly summaries of the users whose local time it is (see reports.py).
+    Run this task hourly, on the hour.
+    """
+    try:
+        stats = reports.schedule_weekly_summaries()
         
-        weekly_data = HealthData.objects.filter(
-            user=user,
-            date__range=[start_date, end_date]
+        logger.info(
+            f"Queued weekly summaries of {stats['users']} users in {stats['buckets']} timezone buckets "
+            f"({stats['chunks']} chunks, {stats['hours']} hours scheduled)"
         )
+        return f"Queued weekly summaries of {stats['users']} users"
         
-        if not weekly_data.exists():
-            return f"No data available for user {user.username} in the last 7 days"
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error scheduling weekly summaries: {str(e)}")
+        return f"Error scheduling weekly summaries: {str(e)}"
+
+
+@shared_task(rate_limit=settings.HEALTH_REPORT_RATE_LIMIT)
+def generate_weekly_summaries(user_ids, end_date):
+    """
+    Generate the weekly summaries ending on ``end_date`` of a chunk of users
+    queued by schedule_weekly_summaries, with one aggregate query for the chunk.
+    """
+    try:
+        stats = reports.write_weekly_summaries(date.fromisoformat(str(end_date)), user_ids=user_ids)
         
-        # Calculate averages
-        stats = weekly_data.aggregate(
-            avg_steps=Avg('steps'),
-            total_steps=Sum('steps'),
-            avg_sleep=Avg('sleep_hours'),
-            avg_heart_rate=Avg('heart_rate_avg')
+        logger.info(
+            f"Generated {stats['users']} weekly summaries of {len(user_ids)} users in {stats['elapsed']:.2f}s"
         )
+        return f"Generated {stats['users']} weekly summaries"
         
-        # Generate summary recommendation
-        summary_content = f"""Weekly Health Summary:
-        
-        📊 Steps: {stats['total_steps']:,} total ({stats['avg_steps']:.0f} daily average)
-        😴 Sleep: {stats['avg_sleep']:.1f} hours average
-        ❤️ Heart Rate: {stats['avg_heart_rate']:.0f} BPM average
-        
-        Keep up the great work! Review your detailed metrics in the app.
-        """
-        
-        # Create weekly summary recommendation
-        Recommendation.objects.create(
-            user=user,
-            date=end_date,
-            title=f'Weekly Health Summary - {start_date.strftime("%b %d")} to {end_date.strftime("%b %d")}',
-            content=summary_content,
-            type='general',
-            priority='low',
-            confidence_score=1.0,
-            model_version='summary_v1.0',
-            expires_at=timezone.now() + timedelta(days=30)
-        )
+    except Exception as e:
+        metrics.mark_failed()
+        logger.error(f"Error generating weekly summaries: {str(e)}")
+        return f"Error generating weekly summaries: {str(e)}"
+
+
+@shared_task
+def generate_weekly_summary(user_id, end_date=None):
+    """
+    Generate weekly health summary for a user.
+    
+    The week ends on ``end_date`` (the user's local date when scheduled),
+    today in UTC by default. For many users, reports.write_weekly_summaries
+    does the same with one query per chunk of users.
+    """
+    try:
+        from django.contrib.auth.models import User
+        
+        user = User.objects.get(id=user_id)
+        end_date = date.fromisoformat(str(end_date)) if end_date else timezone.now().date()
+        
+        stats = reports.write_weekly_summaries(end_date, user_ids=[user.id])
+        if not stats['users']:
+            return f"No data available for user {user.username} in the last 7 days"
         
         logger.info(f"Generated weekly summary for user {user.username}")
         return f"Generated weekly summary for user {user.username}"
@@ -167,38 +300,96 @@ def generate_weekly_summary(user_id):
         return f"User with ID {user_id} not found"
         
     except Exception as e:
+        metrics.mark_failed()
         logger.error(f"Error generating weekly summary for user {user_id}: {str(e)}")
         return f"Error generating weekly summary: {str(e)}"
 
 
+def queue_health_data_batches(health_data_ids, chunk_size=None):
+    """
+    Queue AI processing for an iterable of HealthData IDs through the outbox.
+    
+    IDs are consumed lazily and enqueued as process_health_data_batch messages of
+    ``chunk_size`` rows, HEALTH_BATCH_PROCESS_GROUP_SIZE messages per transaction.
+    Each message is deduplicated by a hash of its IDs, so a sweep that is re-run
+    before the relay published the last one adds no duplicate batches.
+    Returns ``(queued_rows, chunk_count)``.
+    """
+    chunk_size = chunk_size or settings.HEALTH_BATCH_PROCESS_CHUNK_SIZE
+    group_size = settings.HEALTH_BATCH_PROCESS_GROUP_SIZE
+    started = time.monotonic()
+    
+    processed_count = 0
+    chunk_count = 0
+    chunk = []
+    chunks = []
+    
+    def dispatch():
+        nonlocal processed_count, chunk_count
+        with transaction.atomic():
+            outcomes = [
+                outbox.enqueue(
+                    process_health_data_batch, (ids,),
+                    dedupe_key=f'process_health_data_batch:{hashlib.md5(str(ids).encode()).hexdigest()}'
+                )
+                for ids in chunks
+            ]
+        for ids, queued in zip(chunks, outcomes):
+            labels = metrics.label_set(outcome='queued' if queued else 'coalesced')
+            metrics.inc('health_batch_process_batches_total', labels)
+            metrics.inc('health_batch_process_rows_total', labels, len(ids))
+            if queued:
+                processed_count += len(ids)
+                chunk_count += 1
+        chunks.clear()
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Queued {processed_count} health data records in {chunk_count} chunks "
+            f"({processed_count / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+    
+    for health_data_id in health_data_ids:
+        chunk.append(health_data_id)
+        if len(chunk) >= chunk_size:
+            chunks.append(chunk)
+            chunk = []
+            if len(chunks) >= group_size:
+                dispatch()
+    
+    if chunk:
+        chunks.append(chunk)
+    if chunks:
+        dispatch()
+    
+    return processed_count, chunk_count
+
+
 @shared_task
-def batch_process_health_data():
+def batch_process_health_data(chunk_size=None):
     """
     Batch process all unprocessed health data.
     This can be run periodically to ensure no data is missed.
+    
+    Today's HealthData rows without any Recommendation for the same user and date
+    are found with one NOT EXISTS anti-join, streamed in id order from a server-side
+    cursor and queued through the outbox as process_health_data_batch messages.
     """
     try:
-        # Find health data from today that might not have generated recommendations
+        # Find health data from today that has not generated recommendations
         today = timezone.now().date()
+        chunk_size = chunk_size or settings.HEALTH_BATCH_PROCESS_CHUNK_SIZE
         
-        health_data_today = HealthData.objects.filter(date=today)
-        processed_count = 0
+        unprocessed_ids = HealthData.objects.filter(date=today).exclude(
+            Exists(Recommendation.objects.filter(user_id=OuterRef('user_id'), date=OuterRef('date')))
+        ).order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
         
-        for health_data in health_data_today:
-            # Check if recommendations already exist for this data
-            existing_recs = Recommendation.objects.filter(
-                user=health_data.user,
-                date=health_data.date
-            ).count()
-            
-            # If no recommendations exist, process the health data
-            if existing_recs == 0:
-                process_health_data_ai.delay(health_data.id)
-                processed_count += 1
+        # In id order, so a re-run makes the same chunks and they are deduplicated
+        processed_count, _ = queue_health_data_batches(unprocessed_ids, chunk_size)
         
         logger.info(f"Queued {processed_count} health data records for AI processing")
         return f"Queued {processed_count} health data records for processing"
         
     except Exception as e:
+        metrics.mark_failed()
         logger.error(f"Error in batch processing: {str(e)}")
         return f"Error in batch processing: {str(e)}"
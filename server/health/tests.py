@@ -1,3 +1,1360 @@
-from django.test import TestCase
+import contextlib
+import csv
+import functools
+import gzip
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Avg, Sum
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import async_views, metrics, outbox, partitions, users
+from .admin import HealthDataAdmin, RecommendationAdmin
+from .analytics import ANOMALY_VERSION, detect, ewma, fingerprints, rolling_baseline
+from .authentication import CachedTokenAuthentication, _cache_key
+from .cache import get_user_version
+from .cleanup import CHECKPOINT_NAME as CLEANUP_CHECKPOINT, cleanup_expired_recommendations
+from .fast_serializers import (
+    HealthDataValuesSerializer, RecommendationListValuesSerializer, RecommendationValuesSerializer
+)
+from .imports import import_file, queue_imported
+from .models import (
+    BufferedHealthData, HealthData, HealthRollup, JobCheckpoint, OutboxMessage, Recommendation, RecommendationArchive,
+    RecommendationCounter, UserProfile, recommendations_changed
+)
+from .pagination import HealthDataKeysetPagination, PrecountedPageNumberPagination
+from .serializers import HealthDataCreateUpdateSerializer, HealthDataSerializer, RecommendationListSerializer, RecommendationSerializer
+from .reports import due_buckets, schedule_weekly_summaries, weekly_summary_stats, write_weekly_summaries
+from .rules import COLUMNS, DEFAULT_RULESET, Ruleset, _write_chunk, evaluate
+from .tasks import (
+    batch_process_health_data, flush_health_data_buffer, generate_weekly_summary, process_health_data_batch,
+    process_health_data_day
+)
+
+
+class HealthDataUpsertTests(TestCase):
+    """Set-based batch upsert of HealthData."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('upsert', password='x')
+        self.today = date.today()
+
+    def test_batch_endpoint_hides_server_errors(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        payload = {'user_id': str(self.user.id), 'records': [{'date': str(self.today), 'steps': 100}]}
+        with mock.patch.object(HealthData.objects, 'upsert', side_effect=RuntimeError('dsn=secret')), \
+                self.assertLogs('health.views', 'ERROR'):
+            response = client.post('/api/data/health/batch', payload, format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'success': False, 'message': 'Server error'})
+
+    def test_created_flag(self):
+        first = HealthData.objects.upsert([{'user_id': self.user.id, 'date': self.today, 'steps': 1000}])
+        second = HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': self.today, 'steps': 2000},
+            {'user_id': self.user.id, 'date': self.today - timedelta(days=1), 'steps': 3000},
+        ])
+
+        self.assertEqual([created for *_, created in first], [True])
+        created = {row_date: created for _, _, row_date, created in second}
+        self.assertEqual(created, {self.today: False, self.today - timedelta(days=1): True})
+        self.assertEqual(first[0][0], next(row[0] for row in second if row[2] == self.today))
+
+    def test_last_duplicate_wins(self):
+        saved = HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': self.today, 'steps': 1000, 'sleep_hours': 6},
+            {'user_id': self.user.id, 'date': self.today, 'steps': 2000},
+        ])
+
+        self.assertEqual(len(saved), 1)
+        row = HealthData.objects.get(user=self.user, date=self.today)
+        self.assertEqual(row.steps, 2000)
+        self.assertEqual(row.sleep_hours, 0)  # The superseded row's fields are not merged in
+
+    def test_partial_update_keeps_other_fields(self):
+        HealthData.objects.upsert([{'user_id': self.user.id, 'date': self.today, 'steps': 1000, 'heart_rate_avg': 70}])
+        HealthData.objects.upsert([{'user_id': self.user.id, 'date': self.today, 'steps': 5000}])
+
+        row = HealthData.objects.get(user=self.user, date=self.today)
+        self.assertEqual((row.steps, row.heart_rate_avg), (5000, 70))
+
+
+class HealthRollupTests(TestCase):
+    """Incrementally maintained rollups match a rebuild from HealthData."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rollup', password='x')
+        self.today = date.today()
+
+    def assertRollupsMatch(self):
+        self.assertEqual(HealthRollup.objects.verify([self.user.id]), [])
+
+    def test_add_update_remove_parity(self):
+        HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': self.today - timedelta(days=offset), 'steps': 1000 * offset,
+             'sleep_hours': 7, 'heart_rate_avg': 60 + offset, 'activity_level': 'light'}
+            for offset in (0, 3, 10, 45, 100)
+        ])
+        self.assertRollupsMatch()
+        week = HealthRollup.objects.current(self.user.id, 7)
+        self.assertEqual((week.days, week.steps_sum, week.heart_rate_days), (2, 3000, 2))
+
+        HealthData.objects.upsert([{'user_id': self.user.id, 'date': self.today, 'steps': 8000, 'activity_level': 'vigorous'}])
+        self.assertRollupsMatch()
+
+        row = HealthData.objects.get(user=self.user, date=self.today - timedelta(days=3))
+        row.heart_rate_avg = None
+        row.save()
+        self.assertRollupsMatch()
+
+        HealthData.objects.get(user=self.user, date=self.today - timedelta(days=10)).delete()
+        self.assertRollupsMatch()
+        month = HealthRollup.objects.current(self.user.id, 30)
+        self.assertEqual(month.days, 2)
+        self.assertEqual(month.activity_counts, {'vigorous': 1, 'light': 1})
+
+
+class DeleteSideEffectTests(TestCase):
+    """Queryset, cascade and admin deletes keep rollups, counters and caches in sync."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('deletes', password='x')
+        self.today = date.today()
+        HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': self.today - timedelta(days=offset), 'steps': 1000}
+            for offset in range(3)
+        ])
+        Recommendation.objects.create(
+            user=self.user, date=self.today, title='Rest', content='', type='general', priority='low',
+            confidence_score=0.5
+        )
+
+    def test_queryset_delete_updates_rollup_and_cache(self):
+        version = get_user_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            HealthData.objects.filter(user=self.user, date__lt=self.today).delete()
+
+        self.assertEqual(HealthRollup.objects.verify([self.user.id]), [])
+        self.assertEqual(HealthRollup.objects.current(self.user.id, 7).days, 1)
+        self.assertGreater(get_user_version(self.user.id), version)
+
+    def test_queryset_delete_refreshes_counter(self):
+        self.assertEqual(RecommendationCounter.objects.for_user(self.user.id).unread_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recommendation.objects.filter(user=self.user).delete()
+        self.assertEqual(RecommendationCounter.objects.get(user=self.user).unread_count, 0)
+
+    def test_user_delete_cascades_cleanly(self):
+        RecommendationCounter.objects.for_user(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(HealthRollup.objects.filter(user_id=self.user.id).exists())
+        self.assertFalse(RecommendationCounter.objects.filter(user_id=self.user.id).exists())
+
+    def test_admin_delete_queryset(self):
+        site = AdminSite()
+        version = get_user_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(HealthRollup.objects, 'rebuild', wraps=HealthRollup.objects.rebuild) as rebuild:
+            HealthDataAdmin(HealthData, site).delete_queryset(None, HealthData.objects.filter(user=self.user))
+            RecommendationAdmin(Recommendation, site).delete_queryset(None, Recommendation.objects.filter(user=self.user))
+
+        # the post_delete receivers are the only mechanism: no extra full rebuild
+        rebuild.assert_not_called()
+        self.assertGreater(get_user_version(self.user.id), version)
+        self.assertEqual(HealthRollup.objects.current(self.user.id, 90).days, 0)
+        self.assertEqual(HealthRollup.objects.verify([self.user.id]), [])
+        self.assertEqual(RecommendationCounter.objects.get(user=self.user).unread_count, 0)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Cached token entries hold no secrets and are dropped once changes commit."""
+
+    def setUp(self):
+        caches[settings.HEALTH_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('token', password='secret', email='token@example.com', is_staff=True)
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_entry_holds_only_auth_fields(self):
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        entry = caches[settings.HEALTH_CACHE_ALIAS].get(_cache_key(self.token.key))
+        self.assertEqual(entry, ([self.token.key, self.user.id], [self.user.id, True, True]))
+
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, user.is_staff, token.user_id), (self.user.id, True, self.user.id))
+        self.assertIn('password', user.get_deferred_fields())
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'token@example.com')
+
+    def test_deactivation_invalidates_on_commit(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.is_active = False
+            self.user.save()
+            # Not dropped before the commit, or a concurrent request could cache the old row again
+            self.assertIsNotNone(caches[settings.HEALTH_CACHE_ALIAS].get(_cache_key(self.token.key)))
+        self.assertTrue(callbacks)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+
+    def test_saves_without_auth_changes_keep_entries(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            # what django.contrib.auth.update_last_login does, plus an unrelated full save
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+            self.user.first_name = 'Token'
+            self.user.save()
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+        self.assertIsNotNone(caches[settings.HEALTH_CACHE_ALIAS].get(_cache_key(self.token.key)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('rotated')
+            self.user.save(update_fields=['password'])
+        self.assertIsNone(caches[settings.HEALTH_CACHE_ALIAS].get(_cache_key(self.token.key)))
+
+class UserResolutionTests(TestCase):
+    """Ingest user identifiers resolve without repeated queries and keep username precedence."""
+
+    def setUp(self):
+        users.clear()
+        self.addCleanup(users.clear)
+        self.user = User.objects.create_user('resolve', password='x')
+        # A username that is another user's numeric ID takes precedence over that ID
+        self.shadow = User.objects.create_user(str(self.user.id), password='x')
+
+    def test_authenticated_user_needs_no_query(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.assertIs(users.resolve_user('resolve', request), self.user)
+
+    def test_username_precedence_and_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(users.resolve_user(str(self.user.id)).id, self.shadow.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(users.resolve_user(self.user.id).username, str(self.user.id))
+        self.assertIsNone(users.resolve_user('nobody'))
+        self.assertEqual(users.resolve_user(str(self.shadow.id)).id, self.shadow.id)
+
+    def test_renames_invalidate_cached_identifiers(self):
+        self.assertEqual(users.resolve_user(str(self.user.id)).id, self.shadow.id)
+        self.shadow.username = 'renamed'
+        self.shadow.save()
+        self.assertEqual(users.resolve_user(str(self.user.id)).id, self.user.id)
+
+    def test_resolve_users_matches_resolve_user(self):
+        identifiers = ['resolve', str(self.user.id), str(self.shadow.id), 'nobody', '999999']
+        with self.assertNumQueries(1):
+            resolved = users.resolve_users(identifiers)
+        self.assertEqual(resolved, {'resolve': self.user.id, str(self.user.id): self.shadow.id,
+                                    str(self.shadow.id): self.shadow.id})
+        with self.assertNumQueries(0):
+            self.assertEqual({identifier: users.resolve_user(identifier).id for identifier in resolved}, resolved)
+
+class CreateRecommendationTests(TestCase):
+    """Manual recommendations are upserted by their content, not just their type and day."""
+
+    def test_distinct_manual_recommendations_are_kept(self):
+        user = User.objects.create_user('manual', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        payload = {'user': user.id, 'date': str(date.today()), 'type': 'sleep', 'priority': 'medium',
+                   'confidence_score': 0.8, 'title': 'Go to bed earlier', 'content': 'Aim for 22:30.'}
+
+        self.assertEqual(client.post('/api/recommendations/create', payload, format='json').status_code, 201)
+        response = client.post('/api/recommendations/create', dict(payload, priority='high'), format='json')
+        self.assertEqual((response.status_code, response.data['created']), (200, False))
+        response = client.post('/api/recommendations/create', dict(payload, title='Dim the lights'), format='json')
+        self.assertEqual((response.status_code, response.data['created']), (201, True))
+
+        self.assertEqual(
+            sorted(Recommendation.objects.filter(user=user).values_list('title', 'priority')),
+            [('Dim the lights', 'medium'), ('Go to bed earlier', 'high')]
+        )
+
+
+class ExportTests(TestCase):
+    """Exports stream every row in the requested format and reject bad dates before streaming."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('export', password='x')
+        cls.today = date.today()
+        HealthData.objects.upsert([
+            {'user_id': cls.user.id, 'date': cls.today - timedelta(days=offset), 'steps': 1000 + offset}
+            for offset in range(5)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, output, **params):
+        return self.client.get(f'/api/user/{self.user.id}/health-data/export', dict(params, output=output))
+
+    def test_ndjson(self):
+        response = self.export('ndjson', start_date=str(self.today - timedelta(days=2)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['steps'] for row in rows], [1002, 1001, 1000])
+        self.assertEqual(rows[-1]['date'], str(self.today))
+
+    def test_csv(self):
+        response = self.export('csv', end_date=str(self.today - timedelta(days=3)))
+        self.assertEqual(response.status_code, 200)
+        header, *rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(header[:2], ['date', 'steps'])
+        self.assertEqual([row[1] for row in rows], ['1004', '1003'])
+
+    def test_bad_date_is_rejected_before_streaming(self):
+        for output in ('ndjson', 'csv'):
+            response = self.export(output, start_date='2026-13-01')
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.streaming)
+
+
+class BatchProcessSweepTests(TestCase):
+    """The hourly sweep queues today's unprocessed rows through the outbox, once."""
+
+    def test_skips_days_with_recommendations(self):
+        today = timezone.now().date()
+        users = [User.objects.create_user(f'sweep-{index}', password='x') for index in range(3)]
+        HealthData.objects.upsert(
+            [{'user_id': user.id, 'date': today, 'steps': 100} for user in users]
+            + [{'user_id': users[0].id, 'date': today - timedelta(days=1), 'steps': 100}]
+        )
+        Recommendation.objects.create(
+            user=users[0], date=today, title='Walk', content='', type='exercise', priority='low', confidence_score=0.5
+        )
+        expected = sorted(HealthData.objects.filter(date=today, user__in=users[1:]).values_list('id', flat=True))
+
+        with override_settings(HEALTH_BATCH_PROCESS_CHUNK_SIZE=1):
+            batch_process_health_data()
+            self.assertEqual(OutboxMessage.objects.filter(task=process_health_data_batch.name).count(), 2)
+            # A re-run before the relay publishes adds nothing
+            batch_process_health_data()
+
+        messages = OutboxMessage.objects.filter(task=process_health_data_batch.name)
+        self.assertEqual(sorted(health_data_id for message in messages for health_data_id in message.args[0]), expected)
+
+
+class ProcessingCoalescingTests(TestCase):
+    """Updates of one user-day queue a single debounced run, which upserts recommendations."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('coalesce')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = date.today()
+
+    def post(self, day, **values):
+        payload = dict({'user_id': 'coalesce', 'date': str(day), 'steps': 1000, 'sleep_hours': 5}, **values)
+        response = self.client.post('/api/data/health', payload, format='json')
+        self.assertIn(response.status_code, (200, 201))
+
+    def test_updates_of_a_day_queue_one_run(self):
+        before = metrics.snapshot()['counters']
+        started = timezone.now()
+        for steps in (1000, 2000, 3000):
+            self.post(self.today, steps=steps)
+        self.post(self.today - timedelta(days=1))
+
+        messages = OutboxMessage.objects.filter(task=process_health_data_day.name).order_by('id')
+        self.assertEqual([message.args for message in messages],
+                         [[self.user.id, str(self.today)], [self.user.id, str(self.today - timedelta(days=1))]])
+        self.assertGreaterEqual(messages[0].available_at, started + timedelta(seconds=settings.HEALTH_AI_DEBOUNCE_SECONDS))
+
+        after = metrics.snapshot()['counters']
+        dispatched = lambda counters, outcome: counters.get(
+            ('health_ai_dispatch_total', metrics.label_set(outcome=outcome)), 0
+        )
+        self.assertEqual(dispatched(after, 'queued') - dispatched(before, 'queued'), 2)
+        self.assertEqual(dispatched(after, 'coalesced') - dispatched(before, 'coalesced'), 2)
+
+    def test_runs_upsert_from_the_latest_data(self):
+        self.post(self.today)
+        process_health_data_day(self.user.id, str(self.today))
+        first = set(Recommendation.objects.filter(user=self.user).values_list('id', 'title', 'content'))
+        self.assertTrue(first)
+
+        process_health_data_day(self.user.id, str(self.today))
+        self.assertEqual(set(Recommendation.objects.filter(user=self.user).values_list('id', 'title', 'content')), first)
+
+        # The rules that fired on the old values no longer do
+        self.post(self.today, steps=12000, sleep_hours=8, heart_rate_avg=65)
+        process_health_data_day(self.user.id, str(self.today))
+        titles = set(Recommendation.objects.filter(user=self.user).values_list('title', flat=True))
+        self.assertFalse(titles & {title for _, title, _ in first})
+
+def steps_rule(rule_id, op, **overrides):
+    return dict({
+        'id': rule_id, 'metric': 'steps', 'op': op, 'value': 5000, 'title': rule_id, 'content': '{steps} steps',
+        'type': 'exercise', 'priority': 'low', 'confidence_score': 0.5,
+    }, **overrides)
+
+
+class RulesetTests(TestCase):
+    """Rulesets are validated on load and evaluated column-wise."""
+
+    def test_threshold_ops(self):
+        ruleset = Ruleset.from_dict({'version': 't', 'rules': [steps_rule(op, op) for op in ('lt', 'lte', 'gt', 'gte')]})
+        today = date.today()
+        rows = [(1, 1, today, 4999, None, None, None), (2, 1, today, 5000, None, None, None),
+                (3, 1, today, 5001, None, None, None)]
+        fired = {}
+        for recommendation in evaluate(rows, ruleset):
+            fired.setdefault(recommendation.title, []).append(recommendation.content)
+        self.assertEqual(fired, {
+            'lt': ['4999 steps'], 'lte': ['4999 steps', '5000 steps'],
+            'gt': ['5001 steps'], 'gte': ['5000 steps', '5001 steps'],
+        })
+
+    def test_missing_metric_never_fires(self):
+        ruleset = Ruleset.from_dict(DEFAULT_RULESET)
+        self.assertEqual(evaluate([(1, 1, date.today(), None, None, None, None)], ruleset), [])
+
+    def test_invalid_rules_are_rejected(self):
+        for rule in (
+            steps_rule('bad', 'lt', content='{stepz} steps'),
+            steps_rule('bad', 'lt', content='{steps'),
+            steps_rule('bad', 'lt', extra=1),
+            {'id': 'bad', 'metric': 'steps'},
+            steps_rule('bad', 'eq'),
+        ):
+            with self.subTest(rule=rule), self.assertRaises(ImproperlyConfigured):
+                Ruleset.from_dict({'version': 't', 'rules': [rule]})
+
+
+class WriteChunkTests(TestCase):
+    """Re-processing a chunk refreshes its recommendations and drops the stale untouched ones."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rules', password='x')
+        self.today = date.today()
+        self.ruleset = Ruleset.from_dict(DEFAULT_RULESET)
+
+    def process(self, days):
+        HealthData.objects.upsert([dict(day, user_id=self.user.id) for day in days])
+        rows = list(HealthData.objects.filter(user=self.user).values_list(*COLUMNS))
+        return _write_chunk(rows, self.ruleset)
+
+    def titles(self):
+        return sorted(Recommendation.objects.filter(user=self.user).values_list('title', flat=True))
+
+    def test_rerun_is_idempotent(self):
+        day = {'date': self.today, 'steps': 1000, 'sleep_hours': 5}
+        self.assertEqual(self.process([day]), 2)
+        self.assertEqual(self.process([day]), 0)
+        self.assertEqual(self.titles(), ['Improve Sleep Quality', 'Increase Daily Steps'])
+
+    def test_stale_untouched_recommendations_are_deleted(self):
+        days = [{'date': self.today - timedelta(days=offset), 'steps': 1000, 'sleep_hours': 8} for offset in range(4)]
+        self.assertEqual(self.process(days), 4)
+        recommendations = Recommendation.objects.filter(user=self.user)
+        recommendations.filter(date=days[0]['date']).update(is_read=True)
+        recommendations.filter(date=days[1]['date']).update(is_completed=True)
+        recommendations.filter(date=days[2]['date']).update(user_rating=4)
+
+        # Steps no longer low on any day: only the unread, uncompleted, unrated one goes
+        self.process([dict(day, steps=12000) for day in days])
+        self.assertEqual(
+            sorted(Recommendation.objects.filter(user=self.user).values_list('date', flat=True)),
+            sorted(day['date'] for day in days[:3])
+        )
+
+
+def naive_baseline(values, window, min_days):
+    mean, std = np.full(values.shape, np.nan), np.full(values.shape, np.nan)
+    for user in range(values.shape[0]):
+        for day in range(values.shape[1]):
+            history = [value for value in values[user, max(day - window, 0):day] if not np.isnan(value)]
+            if len(history) >= max(min_days, 2):
+                mean[user, day] = statistics.mean(history)
+                std[user, day] = statistics.stdev(history)
+    return mean, std
+
+
+def naive_ewma(values, span):
+    alpha = 2 / (span + 1)
+    result = np.full(values.shape, np.nan)
+    for user in range(values.shape[0]):
+        state = None
+        for day in range(values.shape[1]):
+            result[user, day] = np.nan if state is None else state
+            if not np.isnan(values[user, day]):
+                state = values[user, day] if state is None else state + alpha * (values[user, day] - state)
+    return result
+
+
+class AnomalyKernelTests(SimpleTestCase):
+    """The vectorized baselines match naive loops."""
+
+    def setUp(self):
+        rng = np.random.default_rng(25)
+        self.values = rng.normal(10000, 1500, size=(4, 60))
+        self.values[rng.random(self.values.shape) < 0.3] = np.nan
+        self.values[1, :] = np.nan  # no history at all
+        self.values[2, 5:] = np.nan  # too little history
+        self.values[3, 20:35] = np.nan  # a long gap
+
+    def test_rolling_baseline(self):
+        for window, min_days in ((7, 3), (30, 14), (5, 1)):
+            mean, std = rolling_baseline(self.values, window, min_days)
+            expected_mean, expected_std = naive_baseline(self.values, window, min_days)
+            np.testing.assert_allclose(mean, expected_mean, rtol=1e-9, equal_nan=True)
+            np.testing.assert_allclose(std, expected_std, rtol=1e-6, equal_nan=True)
+        self.assertTrue(np.isnan(mean[1]).all())
+        self.assertTrue(np.isnan(rolling_baseline(self.values, 30, 14)[0][2]).all())
+
+    def test_window_excludes_current_day(self):
+        mean, std = rolling_baseline(np.array([[1.0, 2.0, 3.0, 100.0]]), 3, 2)
+        np.testing.assert_allclose(mean, [[np.nan, np.nan, 1.5, 2.0]])
+        np.testing.assert_allclose(std, [[np.nan, np.nan, statistics.stdev([1, 2]), 1.0]])
+
+    def test_ewma(self):
+        for span in (3, 7):
+            np.testing.assert_allclose(ewma(self.values, span), naive_ewma(self.values, span), equal_nan=True)
+
+
+@override_settings(
+    HEALTH_ANOMALY_DETECTION=True, HEALTH_ANOMALY_WINDOW_DAYS=14, HEALTH_ANOMALY_MIN_DAYS=7,
+    HEALTH_ANOMALY_Z_THRESHOLD=2.0
+)
+class AnomalyDetectionTests(TestCase):
+    """Detected anomalies can be found again by their fingerprints, and go stale with the data."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('anomaly', password='x')
+        self.today = date.today()
+        HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': self.today - timedelta(days=offset), 'steps': 9000 + 100 * (offset % 3),
+             'sleep_hours': 7.5, 'heart_rate_avg': 65 + offset % 2, 'calories_burned': 2200}
+            for offset in range(1, 20)
+        ])
+
+    def process(self, **today):
+        HealthData.objects.upsert([dict(today, user_id=self.user.id, date=self.today)])
+        rows = list(HealthData.objects.filter(user=self.user, date=self.today).values_list(*COLUMNS))
+        _write_chunk(rows, Ruleset(version='t', rules=()))
+        return rows
+
+    def test_detect_matches_fingerprints(self):
+        rows = self.process(steps=2000, sleep_hours=4, heart_rate_avg=90, calories_burned=2200)
+        detected = detect(rows)
+        self.assertEqual(
+            {recommendation.title for recommendation in detected},
+            {'Less Active Than Usual', 'Less Sleep Than Usual', 'Heart Rate Above Your Norm'}
+        )
+        self.assertLessEqual(
+            {recommendation.fingerprint for recommendation in detected}, fingerprints(self.user.id, self.today)
+        )
+        self.assertEqual(Recommendation.objects.filter(user=self.user, model_version=ANOMALY_VERSION).count(), 3)
+
+    def test_stale_anomalies_are_removed(self):
+        self.process(steps=2000, sleep_hours=7.5, heart_rate_avg=65, calories_burned=2200)
+        self.assertEqual(Recommendation.objects.filter(user=self.user, model_version=ANOMALY_VERSION).count(), 1)
+        self.process(steps=9100)
+        self.assertFalse(Recommendation.objects.filter(user=self.user, model_version=ANOMALY_VERSION).exists())
+
+
+class BufferFlushTests(TestCase):
+    """The write-behind flusher coalesces buffered writes per user-day, last write wins."""
+
+    def test_later_write_wins(self):
+        user = User.objects.create_user('buffered', password='x')
+        today = date.today()
+        BufferedHealthData.objects.create(user=user, date=today, payload={'steps': 1000, 'sleep_hours': 6.5})
+        BufferedHealthData.objects.create(user=user, date=today, payload={'steps': 4000, 'heart_rate_avg': 70})
+        BufferedHealthData.objects.create(user=user, date=today - timedelta(days=1), payload={'steps': 10})
+        flushed = metrics.snapshot()['counters'].get(('health_ingest_buffer_flushed_total', ()), 0)
+        self.assertEqual(metrics.read_gauges()[('health_ingest_buffer_depth', ())], 3)
+
+        flush_health_data_buffer(batch_size=2)
+
+        row = HealthData.objects.get(user=user, date=today)
+        self.assertEqual((row.steps, row.sleep_hours, row.heart_rate_avg), (4000, Decimal('6.5'), 70))
+        self.assertEqual(HealthData.objects.get(user=user, date=today - timedelta(days=1)).steps, 10)
+        self.assertFalse(BufferedHealthData.objects.exists())
+        self.assertEqual(OutboxMessage.objects.filter(task=process_health_data_batch.name).count(), 2)
+        self.assertEqual(metrics.snapshot()['counters'][('health_ingest_buffer_flushed_total', ())], flushed + 3)
+        self.assertIn('health_ingest_buffer_depth 0', metrics.render())
+
+
+class AsyncURLConf:
+    urlpatterns = [
+        path('api/data/health', async_views.health_data_create),
+        path('api/user/<int:user_id>/health-summary', async_views.health_summary),
+        path('api/user/<int:user_id>/recommendations', async_views.user_recommendations),
+    ]
+
+
+class AsyncViewParityTests(TestCase):
+    """The async views answer like their DRF counterparts and share their cache entries."""
+
+    def setUp(self):
+        caches[settings.HEALTH_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('async', password='x')
+        self.token = Token.objects.create(user=self.user).key
+        self.sync_client = Client()
+        self.async_client = AsyncClient()
+        HealthData.objects.upsert([
+            {'user_id': self.user.id, 'date': date.today() - timedelta(days=offset), 'steps': 5000 + offset,
+             'sleep_hours': 7, 'heart_rate_avg': 60}
+            for offset in range(1, 4)
+        ])
+        Recommendation.objects.create(
+            user=self.user, date=date.today(), title='Rest', content='', type='general', priority='low',
+            confidence_score=0.5
+        )
+
+    async def both(self, method, url, authenticated=True, headers=None, **extra):
+        """Responses of the DRF view, then of the async view, to the same request."""
+        headers = dict(headers or {})
+        if authenticated:
+            headers['Authorization'] = f'Token {self.token}'
+        sync_response = await sync_to_async(getattr(self.sync_client, method))(url, headers=headers, **extra)
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            async_response = await getattr(self.async_client, method)(url, headers=headers, **extra)
+        return sync_response, async_response
+
+    def assertSameResponse(self, sync_response, async_response, ignore=()):
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.get('X-Cache'), sync_response.get('X-Cache'))
+        self.assertEqual(async_response.get('WWW-Authenticate'), sync_response.get('WWW-Authenticate'))
+        sync_data, async_data = sync_response.json(), async_response.json()
+        for field in ignore:
+            sync_data.get('data', {}).pop(field, None)
+            async_data.get('data', {}).pop(field, None)
+        self.assertEqual(async_data, sync_data)
+
+    async def test_ingest(self):
+        payload = {'user_id': str(self.user.id), 'date': str(date.today()), 'steps': 1234, 'sleep_hours': 7.5}
+        post = functools.partial(self.both, 'post', '/api/data/health', content_type='application/json')
+
+        sync_created, async_updated = await post(data=payload)
+        self.assertEqual((sync_created.status_code, async_updated.status_code), (201, 200))
+        sync_updated, _ = await post(data=payload)
+        self.assertSameResponse(sync_updated, async_updated, ignore=('updated_at',))
+
+        self.assertSameResponse(*await post(data=dict(payload, steps=-1)))
+        self.assertSameResponse(*await post(data=payload, authenticated=False))
+
+        with mock.patch.object(HealthDataCreateUpdateSerializer, 'save', side_effect=RuntimeError('dsn=secret')), \
+                self.assertLogs('health', 'ERROR') as logs:
+            sync_response, async_response = await post(data=payload)
+        self.assertSameResponse(sync_response, async_response)
+        self.assertEqual(async_response.json(), {'success': False, 'message': 'Server error'})
+        self.assertEqual(len(logs.records), 2)
+
+    async def test_reads_share_cache_entries(self):
+        for url in (f'/api/user/{self.user.id}/health-summary', f'/api/user/{self.user.id}/recommendations'):
+            sync_response, async_response = await self.both('get', url)
+            self.assertEqual((sync_response['X-Cache'], async_response['X-Cache']), ('MISS', 'HIT'))
+            self.assertEqual(async_response.json(), sync_response.json())
+            self.assertSameResponse(*await self.both('get', url, headers={'X-Cache-Bypass': '1'}))
+            self.assertSameResponse(*await self.both('get', url, authenticated=False))
+
+
+class MetricsEndpointTests(TestCase):
+    """/metrics is scraped with the metrics bearer secret, not user tokens."""
+
+    def test_requires_metrics_token(self):
+        admin = User.objects.create_superuser('metrics-admin', password='x')
+        client = APIClient()
+        client.force_authenticate(admin)
+        with override_settings(HEALTH_METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(client.get('/metrics').status_code, 401)
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+            response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_disabled_without_token(self):
+        with override_settings(HEALTH_METRICS_TOKEN=''):
+            self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+class ValuesSerializerParityTests(TestCase):
+    """The values() fast path renders exactly what the DRF serializers do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('parity', password='x', first_name='Par', last_name='Ity')
+        today = date.today()
+        HealthData.objects.upsert([
+            {'user_id': cls.user.id, 'date': today, 'steps': 12345, 'sleep_hours': 7.25, 'heart_rate_avg': 64,
+             'activity_level': 'vigorous', 'calories_burned': 2400, 'weight': 71.5},
+            {'user_id': cls.user.id, 'date': today - timedelta(days=1), 'steps': 0},
+        ])
+        now = timezone.now()
+        for index, expires_at in enumerate([None, now + timedelta(days=1), now - timedelta(days=1)]):
+            Recommendation.objects.create(
+                user=cls.user, date=today, fingerprint=f'parity-{index}', title=f'Title {index}', content='Content', type='sleep',
+                priority='high', confidence_score=0.87, model_version='v1', expires_at=expires_at,
+                is_read=bool(index % 2), user_rating=index + 2 if index else None
+            )
+
+    def assertParity(self, values_serializer, serializer_class, queryset):
+        drf = serializer_class(queryset, many=True).data
+        fast = values_serializer.serialize(values_serializer.values(queryset))
+        self.assertEqual(len(fast), len(drf))
+        self.assertEqual(fast, [dict(item) for item in drf])
+
+    def test_health_data(self):
+        self.assertParity(HealthDataValuesSerializer, HealthDataSerializer, HealthData.objects.with_user().order_by('date'))
+
+    def test_recommendations(self):
+        queryset = Recommendation.objects.with_user_name().order_by('id')
+        self.assertParity(RecommendationValuesSerializer, RecommendationSerializer, queryset)
+        self.assertParity(RecommendationListValuesSerializer, RecommendationListSerializer, queryset)
+
+    def test_list_endpoints_match(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for url in (f'/api/user/{self.user.id}/health-data', f'/api/user/{self.user.id}/recommendations',
+                    '/api/v1/health-data/', '/api/v1/recommendations/'):
+            responses = []
+            for enabled in (False, True):
+                with override_settings(HEALTH_FAST_LIST_SERIALIZERS=enabled):
+                    response = client.get(url, {'include_expired': 'true'}, HTTP_X_CACHE_BYPASS='1')
+                self.assertEqual(response.status_code, 200, url)
+                responses.append(response.json())
+            drf, fast = responses
+            self.assertTrue(drf['results'], url)
+            self.assertEqual(fast, drf, url)
+
+
+class HealthRollupConcurrencyTests(TransactionTestCase):
+    """Concurrent first writes of a user must not rebuild from each other's stale snapshot."""
+
+    def test_concurrent_first_writes(self):
+        user_ids = [User.objects.create_user(f'concurrent{index}', password='x').id for index in range(10)]
+
+        for user_id in user_ids:
+            barrier = threading.Barrier(2)
+
+            def write(offset):
+                barrier.wait()
+                try:
+                    HealthData.objects.upsert([
+                        {'user_id': user_id, 'date': date.today() - timedelta(days=offset), 'steps': 100 + offset}
+                    ])
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=write, args=(offset,)) for offset in (0, 1)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(HealthRollup.objects.verify(user_ids), [])
+        self.assertEqual(HealthRollup.objects.get(user_id=user_ids[0], window_days=7).days, 2)
+
+
+class OutboxTests(TestCase):
+    """Outbox messages are coalesced, transactional and retried with backoff."""
+
+    def setUp(self):
+        self.sent = []
+        self.failures = 0
+        patcher = mock.patch.multiple(
+            outbox.current_app, send_task=mock.DEFAULT, producer_or_acquire=lambda: contextlib.nullcontext()
+        )
+        self.send_task = patcher.start()['send_task']
+        self.send_task.side_effect = self.send
+        self.addCleanup(patcher.stop)
+
+    def send(self, name, args, kwargs, producer=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('broker down')
+        self.sent.append(args)
+
+    def test_dedupe_key_collapses_waiting_messages(self):
+        self.assertTrue(outbox.enqueue(process_health_data_batch, ([1],), dedupe_key='batch'))
+        self.assertFalse(outbox.enqueue(process_health_data_batch, ([2],), dedupe_key='batch'))
+        outbox.enqueue(process_health_data_batch, ([3],))
+        outbox.relay()
+        self.assertEqual(self.sent, [[[1]], [[3]]])
+        # Once published, the key is free again
+        self.assertTrue(outbox.enqueue(process_health_data_batch, ([2],), dedupe_key='batch'))
+
+    def test_rolled_back_messages_are_never_relayed(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue(process_health_data_batch, ([1],))
+            raise RuntimeError
+        self.assertEqual(outbox.relay()['published'], 0)
+        self.assertEqual(self.sent, [])
+
+    def test_failed_publish_backs_off(self):
+        outbox.enqueue(process_health_data_batch, ([1],))
+        self.failures = 2
+        for attempt in (1, 2):
+            before = timezone.now()
+            with self.assertLogs('health.outbox', 'ERROR'):
+                self.assertEqual(outbox.relay()['failed'], 1)
+            message = OutboxMessage.objects.get()
+            self.assertEqual((message.attempts, message.last_error), (attempt, 'broker down'))
+            self.assertGreaterEqual(message.available_at, before + timedelta(seconds=2 ** attempt))
+            # Not due yet, so the next relay leaves it alone
+            self.assertEqual(outbox.relay()['batches'], 0)
+            OutboxMessage.objects.update(available_at=timezone.now())
+
+        self.assertEqual(outbox.relay()['published'], 1)
+        self.assertEqual(self.sent, [[[1]]])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+class OutboxConcurrencyTests(TransactionTestCase):
+    """Concurrent relays claim disjoint batches with SKIP LOCKED."""
+
+    def test_concurrent_relays_send_each_message_once(self):
+        for index in range(40):
+            outbox.enqueue(process_health_data_batch, ([index],))
+        sent = []
+
+        def send(name, args, kwargs, producer=None):
+            time.sleep(0.005)
+            sent.append(args[0][0])
+
+        barrier = threading.Barrier(4)
+
+        def relay():
+            barrier.wait()
+            try:
+                outbox.relay(batch_size=3)
+            finally:
+                connection.close()
+
+        with mock.patch.multiple(
+            outbox.current_app, send_task=mock.Mock(side_effect=send),
+            producer_or_acquire=lambda: contextlib.nullcontext()
+        ):
+            threads = [threading.Thread(target=relay) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(sent), list(range(40)))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+class ExpiryCleanupTests(TestCase):
+    """The expiry cleanup archives exactly what it deletes and resumes from its checkpoint."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'cleanup-{index}', password='x') for index in range(2)]
+        now = timezone.now()
+        self.expired = []
+        for index in range(10):
+            self.expired.append(self.recommend(f'expired-{index}', now - timedelta(days=1), user=self.users[index % 2]).id)
+        self.kept = [
+            self.recommend('completed', now - timedelta(days=1), is_completed=True).id,
+            self.recommend('current', now + timedelta(days=1)).id,
+            self.recommend('forever', None).id,
+        ]
+
+    def recommend(self, fingerprint, expires_at, user=None, **fields):
+        return Recommendation.objects.create(
+            user=user or self.users[0], date=date.today(), fingerprint=fingerprint, title=fingerprint, content='',
+            type='general', priority='low', confidence_score=0.5, expires_at=expires_at, **fields
+        )
+
+    def remaining(self):
+        return sorted(Recommendation.objects.values_list('id', flat=True))
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        versions = [get_user_version(user.id) for user in self.users]
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('health.cleanup.recommendations_changed', wraps=recommendations_changed) as changed:
+            stats = cleanup_expired_recommendations(batch_size=3, archive='table', max_batches=2)
+        self.assertEqual((stats['deleted'], stats['complete']), (6, False))
+        self.assertEqual(JobCheckpoint.objects.get(name=CLEANUP_CHECKPOINT).state['last_id'], self.expired[5])
+        self.assertEqual(changed.call_count, 2)
+        self.assertGreater(get_user_version(self.users[1].id), versions[1])
+
+        # Expired after the interrupted run started: outside the resumed run's cutoff
+        cutoff = parse_datetime(JobCheckpoint.objects.get().state['cutoff'])
+        late = self.recommend('late', cutoff + timedelta(milliseconds=1)).id
+        stats = cleanup_expired_recommendations(batch_size=3, archive='table')
+        self.assertEqual((stats['deleted'], stats['complete']), (4, True))
+        self.assertFalse(JobCheckpoint.objects.exists())
+
+        self.assertEqual(self.remaining(), sorted(self.kept + [late]))
+        self.assertEqual(sorted(RecommendationArchive.objects.values_list('recommendation_id', flat=True)), self.expired)
+
+    def test_jsonl_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.jsonl.gz')
+            stats = cleanup_expired_recommendations(batch_size=4, archive=path)
+            with gzip.open(path, 'rt') as archive:
+                archived = [json.loads(line) for line in archive]
+        self.assertEqual((stats['deleted'], stats['batches']), (10, 3))
+        self.assertEqual([row['id'] for row in archived], self.expired)
+        self.assertEqual({row['user_id'] for row in archived}, {user.id for user in self.users})
+        self.assertEqual(self.remaining(), sorted(self.kept))
+        self.assertFalse(RecommendationArchive.objects.exists())
+
+
+def naive_weekly_summary(user_id, end_date):
+    """The per-user weekly summary the set-based writer replaced, as (title, content) or None."""
+    start_date = end_date - timedelta(days=7)
+    weekly_data = HealthData.objects.filter(user_id=user_id, date__range=[start_date, end_date])
+    if not weekly_data.exists():
+        return None
+    stats = weekly_data.aggregate(
+        avg_steps=Avg('steps'), total_steps=Sum('steps'), avg_sleep=Avg('sleep_hours'),
+        avg_heart_rate=Avg('heart_rate_avg')
+    )
+    heart_rate = f"{stats['avg_heart_rate']:.0f} BPM average" if stats['avg_heart_rate'] is not None else 'no data'
+    content = f"""Weekly Health Summary:
+        
+        📊 Steps: {stats['total_steps']:,} total ({stats['avg_steps']:.0f} daily average)
+        😴 Sleep: {stats['avg_sleep']:.1f} hours average
+        ❤️ Heart Rate: {heart_rate}
+        
+        Keep up the great work! Review your detailed metrics in the app.
+        """
+    return f'Weekly Health Summary - {start_date.strftime("%b %d")} to {end_date.strftime("%b %d")}', content
+
+
+class ImportTests(TestCase):
+    """Bulk import stages rows with COPY, merges them like the upsert and resumes from checkpoints."""
+
+    def setUp(self):
+        users.clear()
+        self.addCleanup(users.clear)
+        self.first = User.objects.create_user('import-a')
+        self.second = User.objects.create_user('import-b')
+        # A month far enough back that no partition exists for it yet
+        self.month = date(2019, 3, 1)
+        HealthData.objects.upsert([{'user_id': self.second.id, 'date': self.month, 'steps': 1, 'heart_rate_avg': 70}])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, records):
+        path = os.path.join(self.directory, name)
+        if name.endswith('.csv.gz'):
+            with gzip.open(path, 'wt', newline='') as output:
+                writer = csv.DictWriter(output, ['user_id', 'date', 'steps', 'sleep_hours', 'heart_rate_avg'])
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(path, 'w') as output:
+                output.write(''.join(record if isinstance(record, str) else json.dumps(record) + '\n'
+                                     for record in records))
+        return path
+
+    def records(self):
+        day = lambda offset: str(self.month + timedelta(days=offset))
+        return [
+            {'user_id': 'import-a', 'date': day(0), 'steps': 100, 'sleep_hours': 7},
+            {'user_id': str(self.second.id), 'date': day(0), 'steps': 200, 'sleep_hours': 6},
+            {'user_id': 'import-a', 'date': day(1), 'steps': 300, 'sleep_hours': 8, 'heart_rate_avg': 65},
+            {'user_id': 'nobody', 'date': day(1), 'steps': 1, 'sleep_hours': 1},
+            {'user_id': 'import-a', 'date': day(2), 'steps': -5, 'sleep_hours': 7},
+            {'user_id': 'import-a', 'date': day(0), 'steps': 150, 'sleep_hours': 7.5},
+        ]
+
+    def imported(self):
+        return {
+            (row['user_id'], row['date'].day): (row['steps'], row['sleep_hours'], row['heart_rate_avg'])
+            for row in HealthData.objects.filter(date__gte=self.month, date__lt=date(2019, 4, 1)).values()
+        }
+
+    def test_import_merges_like_upsert(self):
+        path = self.write('export.csv.gz', self.records())
+        errors_path = os.path.join(self.directory, 'errors.jsonl')
+        stats = import_file(path, chunk_size=4, errors_path=errors_path)
+
+        self.assertEqual(
+            {key: stats[key] for key in ('records', 'imported', 'created', 'invalid', 'chunks', 'complete')},
+            {'records': 6, 'imported': 4, 'created': 2, 'invalid': 2, 'chunks': 2, 'complete': True}
+        )
+        # The last record wins for a repeated day; a missing heart rate keeps the stored one
+        self.assertEqual(self.imported(), {
+            (self.first.id, 1): (150, Decimal('7.50'), None),
+            (self.first.id, 2): (300, Decimal('8.00'), 65),
+            (self.second.id, 1): (200, Decimal('6.00'), 70),
+        })
+        with open(errors_path) as errors:
+            self.assertEqual([json.loads(line)['record'] for line in errors], [4, 5])
+        self.assertEqual(HealthRollup.objects.verify([self.first.id, self.second.id]), [])
+        # The month's partition was created and the existing row moved out of the default partition
+        self.assertIn(
+            partitions.partition_name('health_data', self.month),
+            [name for name, *_ in partitions.list_partitions('health_data')]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM health_data_default WHERE date < %s', [date(2019, 4, 1)])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_interrupted_import_resumes(self):
+        path = self.write('export.jsonl', self.records()[:3] + ['not json\n'] + self.records()[3:])
+        first = import_file(path, chunk_size=2, max_chunks=1)
+        self.assertEqual((first['records'], first['complete']), (2, False))
+
+        stats = import_file(path, chunk_size=2)
+        self.assertEqual((stats['records'], stats['imported'], stats['invalid'], stats['complete']), (7, 4, 3, True))
+        self.assertEqual(import_file(path, chunk_size=2)['chunks'], stats['chunks'])
+        self.assertEqual(self.imported()[(self.first.id, 1)], (150, Decimal('7.50'), None))
+
+    def test_shards_split_users_and_errors(self):
+        path = self.write('export.jsonl', self.records())
+        shard_stats = [import_file(path, shard=shard, shards=2, chunk_size=3) for shard in range(2)]
+        self.assertEqual(sum(stats['imported'] for stats in shard_stats), 4)
+        self.assertEqual(sum(stats['invalid'] for stats in shard_stats), 2)
+        self.assertEqual(len(self.imported()), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(queue_imported(shard_stats), 3)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+class WeeklySummaryTests(TestCase):
+    """The set-based weekly summaries match the per-user ones they replaced."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.end = date(2026, 1, 5)
+        cls.users = [User.objects.create_user(f'summary-{index}', password='x') for index in range(5)]
+        rows = []
+        for index, user in enumerate(cls.users[:3]):
+            for offset in range(0, 10, index + 1):
+                rows.append({
+                    'user_id': user.id, 'date': cls.end - timedelta(days=offset), 'steps': 3000 + 1117 * offset + index,
+                    'sleep_hours': 6 + offset % 4 * 0.75, 'heart_rate_avg': None if index == 2 else 60 + offset,
+                })
+        # Only outside the week
+        rows.append({'user_id': cls.users[3].id, 'date': cls.end - timedelta(days=8), 'steps': 1})
+        HealthData.objects.upsert(rows)
+
+    def summaries(self):
+        return {
+            user_id: (title, content) for user_id, title, content in
+            Recommendation.objects.filter(model_version='summary_v1.0').values_list('user_id', 'title', 'content')
+        }
+
+    def test_parity_with_per_user_summaries(self):
+        expected = {user.id: naive_weekly_summary(user.id, self.end) for user in self.users}
+        expected = {user_id: summary for user_id, summary in expected.items() if summary}
+        self.assertEqual(len(expected), 3)
+
+        for shard in range(2):
+            write_weekly_summaries(self.end, shard=shard, shards=2)
+        self.assertEqual(self.summaries(), expected)
+
+        stats = write_weekly_summaries(self.end)
+        self.assertEqual((stats['users'], stats['created']), (3, 0))
+        generate_weekly_summary(self.users[0].id, str(self.end))
+        self.assertEqual(self.summaries(), expected)
+
+    def test_stats_match_per_user_aggregates(self):
+        for user_id, stats in weekly_summary_stats(self.end):
+            self.assertEqual(stats, HealthData.objects.filter(
+                user_id=user_id, date__range=[self.end - timedelta(days=7), self.end]
+            ).aggregate(
+                avg_steps=Avg('steps'), total_steps=Sum('steps'), avg_sleep=Avg('sleep_hours'),
+                avg_heart_rate=Avg('heart_rate_avg')
+            ))
+
+
+@override_settings(
+    HEALTH_WEEKLY_SUMMARY_HOUR=8, HEALTH_WEEKLY_SUMMARY_WEEKDAY=0, HEALTH_REPORT_CATCH_UP_HOURS=24,
+    HEALTH_REPORT_CHUNK_INTERVAL=0
+)
+class WeeklySummaryScheduleTests(TestCase):
+    """Weekly summaries are queued at 8:00 local time, once, catching up on missed hours."""
+
+    # Monday 2026-01-05
+    MONDAY = datetime(2026, 1, 5, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.users = {}
+        for name in ('Europe/Berlin', 'Europe/Berlin', 'Europe/Paris', 'Europe/London', 'Mars/Base',
+                     'America/New_York', 'Asia/Tokyo', 'inactive'):
+            user = User.objects.create_user(f'zone-{len(self.users)}')
+            UserProfile.objects.filter(user=user).update(
+                timezone='Europe/Berlin' if name == 'inactive' else name, is_active=name != 'inactive'
+            )
+            self.users[user.id] = name
+        self.queued = []
+        enqueue = outbox.enqueue
+        self.fail_after = None
+
+        def record(task, args, **kwargs):
+            if self.fail_after is not None and len(self.queued) >= self.fail_after:
+                raise ConnectionError('database went away')
+            self.queued.append((args[1], tuple(args[0])))
+            return enqueue(task, args, **kwargs)
+
+        patcher = mock.patch.object(outbox, 'enqueue', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def users_in(self, *zones):
+        return sorted(user_id for user_id, zone in self.users.items() if zone in zones)
+
+    def test_buckets_follow_utc_offsets(self):
+        zones = {'Europe/Berlin', 'Europe/Paris', 'Europe/London', 'Mars/Base'}
+        self.assertEqual(due_buckets(self.MONDAY.replace(hour=7), zones), [
+            (timedelta(hours=1), date(2026, 1, 5), ['Europe/Berlin', 'Europe/Paris'])
+        ])
+        self.assertEqual(due_buckets(self.MONDAY.replace(hour=8), zones), [
+            (timedelta(0), date(2026, 1, 5), ['Europe/London', 'Mars/Base'])
+        ])
+        # Summer time moves Berlin an hour earlier in UTC
+        summer = datetime(2026, 7, 6, 6, tzinfo=dt_timezone.utc)
+        self.assertEqual([names for *_, names in due_buckets(summer, zones)], [['Europe/Berlin', 'Europe/Paris']])
+
+    def test_catches_up_and_resumes_without_duplicates(self):
+        self.assertEqual(schedule_weekly_summaries(now=self.MONDAY.replace(hour=6, minute=10))['users'], 0)
+
+        # Missed 07:00-13:00, and the run dies after two chunks
+        self.fail_after = 2
+        with self.assertRaises(ConnectionError):
+            schedule_weekly_summaries(now=self.MONDAY.replace(hour=13, minute=30), chunk_size=1)
+        self.fail_after = None
+        schedule_weekly_summaries(now=self.MONDAY.replace(hour=13, minute=30), chunk_size=1)
+        self.assertEqual(schedule_weekly_summaries(now=self.MONDAY.replace(hour=13, minute=50))['users'], 0)
+
+        expected = self.users_in('Europe/Berlin', 'Europe/Paris', 'Europe/London', 'Mars/Base', 'America/New_York')
+        self.assertEqual(sorted(user_id for _, user_ids in self.queued for user_id in user_ids), expected)
+        self.assertEqual({local_date for local_date, _ in self.queued}, {date(2026, 1, 5)})
+        self.assertEqual(
+            OutboxMessage.objects.filter(task='health.tasks.generate_weekly_summaries').count(), len(expected)
+        )
+
+    def test_catch_up_is_bounded(self):
+        schedule_weekly_summaries(now=self.MONDAY.replace(hour=6, minute=10))
+        with override_settings(HEALTH_REPORT_CATCH_UP_HOURS=2), self.assertLogs('health.reports', 'WARNING'):
+            stats = schedule_weekly_summaries(now=self.MONDAY.replace(hour=13, minute=30))
+        self.assertEqual(stats['hours'], 3)
+        self.assertEqual([user_ids for _, user_ids in self.queued], [tuple(self.users_in('America/New_York'))])
+
+
+class KeysetCursorTests(TestCase):
+    """Keyset cursors round-trip the sort key of the last row served."""
+
+    def paginator_for(self, query=''):
+        paginator = HealthDataKeysetPagination()
+        request = Request(APIRequestFactory().get(f'/api/health-data/?{query}'))
+        paginator.request = request
+        paginator.fields = [field.lstrip('-') for field in paginator.ordering]
+        return paginator, request
+
+    def test_encode_decode_round_trip(self):
+        paginator, _ = self.paginator_for()
+        position = [date(2025, 3, 1), 42]
+        cursor = paginator.encode_cursor(position)
+
+        decoder, request = self.paginator_for(f'cursor={cursor}')
+        self.assertEqual(decoder.decode_cursor(request, HealthData), position)
+
+    def test_invalid_cursor(self):
+        paginator, request = self.paginator_for('cursor=not-a-cursor')
+        with self.assertRaises(NotFound):
+            paginator.decode_cursor(request, HealthData)
+
+    def test_pages_cover_every_row_once(self):
+        user = User.objects.create_user('keyset', password='x')
+        today = date.today()
+        HealthData.objects.upsert([
+            {'user_id': user.id, 'date': today - timedelta(days=offset), 'steps': offset}
+            for offset in range(7)
+        ])
+        queryset = HealthData.objects.filter(user=user)
+
+        seen = []
+        query = 'pagination=keyset&page_size=3'
+        while True:
+            paginator, request = self.paginator_for(query)
+            seen.extend(row.date for row in paginator.paginate_queryset(queryset, request))
+            if not paginator.has_next:
+                break
+            query = f'page_size=3&cursor={paginator.encode_cursor(paginator.next_position)}'
+
+        self.assertEqual(seen, [today - timedelta(days=offset) for offset in range(7)])
+
+    def test_keyset_follows_requested_ordering(self):
+        user = User.objects.create_user('ordering', password='x')
+        Recommendation.objects.bulk_create([
+            Recommendation(user=user, date=date.today(), fingerprint=f'ordering-{index}', title=f'{priority} {index}',
+                           content='', type='general', priority=priority, confidence_score=0.5)
+            for index, priority in enumerate(['low', 'urgent', 'medium', 'high', 'low', 'urgent', 'medium'])
+        ])
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/api/user/{user.id}/recommendations'
+
+        by_page = [rec['title'] for rec in client.get(url, {'ordering': 'priority', 'page_size': 50}).json()['results']]
+        by_cursor = []
+        response = client.get(url, {'ordering': 'priority', 'pagination': 'keyset', 'page_size': 3}).json()
+        while True:
+            by_cursor.extend(rec['title'] for rec in response['results'])
+            if not response['next']:
+                break
+            response = client.get(response['next']).json()
+
+        self.assertEqual(by_cursor, by_page)
+        self.assertEqual([title.split()[0] for title in by_cursor[:2]], ['urgent', 'urgent'])
+
+    def test_keyset_rejects_unsupported_ordering(self):
+        paginator, request = self.paginator_for('pagination=keyset')
+        with self.assertRaises(ValidationError):
+            paginator.paginate_queryset(HealthData.objects.order_by('heart_rate_avg'), request)
+
+
+class RecommendationListTests(TestCase):
+    """The recommendation list serves a page and its counters from one aggregate, through the cache."""
+
+    def setUp(self):
+        caches[settings.HEALTH_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('listing', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/user/{self.user.id}/recommendations'
+        now = timezone.now()
+        # 3 unread, 1 read, 1 read and completed, 1 expired, 1 expiring later
+        states = [(False, False, None)] * 3 + [(True, False, None), (True, True, None),
+                                               (False, False, now - timedelta(hours=1)),
+                                               (False, False, now + timedelta(days=1))]
+        self.recommendations = Recommendation.objects.bulk_create([
+            Recommendation(user=self.user, date=date.today(), fingerprint=f'listing-{index}', title=f'#{index}',
+                           content='', type='general', priority='low', confidence_score=0.5,
+                           is_read=is_read, is_completed=is_completed, expires_at=expires_at)
+            for index, (is_read, is_completed, expires_at) in enumerate(states)
+        ])
+
+    def test_page_and_counters(self):
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(PrecountedPageNumberPagination, 'page_size', 2):
+            response = self.client.get(self.url)
+        data = response.json()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual((data['count'], data['unread_count'], data['pending_count']), (6, 4, 5))
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        # The paginator reuses the aggregate's total instead of its own COUNT(*)
+        self.assertEqual(len([query for query in queries if 'COUNT(' in query['sql']]), 1)
+
+        data = self.client.get(self.url, {'include_expired': 'true'}).json()
+        self.assertEqual((data['count'], data['unread_count']), (7, 5))
+
+        counts = self.client.get(f'{self.url}/counts').json()
+        self.assertEqual((counts['unread_count'], counts['pending_count']), (4, 5))
+
+    def test_actions_refresh_counters_and_cached_pages(self):
+        self.client.get(f'{self.url}/counts')
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recommendations/{self.recommendations[0].id}/action', {'action': 'mark_read'})
+
+        counter = RecommendationCounter.objects.get(user=self.user)
+        self.assertEqual((counter.unread_count, counter.pending_count), (3, 5))
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['unread_count'], 3)
+
+    def test_cached_page_expires_with_next_recommendation(self):
+        response = self.client.get(self.url)
+        # Cached until the recommendation expiring in a day drops out of the list
+        self.assertAlmostEqual(response.cache_timeout, 86400, delta=60)
+
+class RecommendationIndexTests(TestCase):
+    """EXPLAIN shows the recommendation list queries using their indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(f'index{index}', password='x') for index in range(20)]
+        cls.user = users[0]
+        today = date.today()
+        priorities = [level for level, _ in Recommendation.PRIORITY_LEVELS]
+        # A long history per user that is mostly read and completed, with users'
+        # rows interleaved on disk, as in production
+        Recommendation.objects.bulk_create([
+            Recommendation(
+                user=user, date=today, fingerprint=f'{user.id}-{index}', title='', content='',
+                type='general', priority=priorities[index % len(priorities)], confidence_score=0.5,
+                is_read=index % 50 != 0, is_completed=index % 50 > 1
+            )
+            for index in range(1000) for user in users
+        ], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE recommendations')
+
+    def index_names(self, queryset):
+        """Indexes the plan of ``queryset`` scans, by the name of the partitioned table's index."""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+
+            names = set()
+            nodes = [plan[0]['Plan']]
+            while nodes:
+                node = nodes.pop()
+                nodes.extend(node.get('Plans', []))
+                if 'Index Name' in node:
+                    # Partitions have their own copies of each index, attached to the parent's
+                    cursor.execute(
+                        'SELECT parent.relname FROM pg_inherits '
+                        'JOIN pg_class child ON child.oid = inhrelid JOIN pg_class parent ON parent.oid = inhparent '
+                        'WHERE child.relname = %s',
+                        [node['Index Name']]
+                    )
+                    row = cursor.fetchone()
+                    names.add(row[0] if row else node['Index Name'])
+        return names
+
+    def user_recommendations(self):
+        return Recommendation.objects.filter(user=self.user)
+
+    def test_active_uses_user_created_index(self):
+        queryset = self.user_recommendations().active().order_by('-created_at', '-id')[:20]
+        self.assertIn('rec_user_created_id_idx', self.index_names(queryset))
+
+    def test_unread_uses_partial_index(self):
+        queryset = self.user_recommendations().unread().order_by('-created_at')[:20]
+        self.assertIn('rec_user_unread_idx', self.index_names(queryset))
+
+    def test_pending_uses_partial_index(self):
+        queryset = self.user_recommendations().pending().order_by('-created_at')[:20]
+        self.assertIn('rec_user_pending_idx', self.index_names(queryset))
+
+    def test_priority_rank_ordering_uses_index(self):
+        queryset = self.user_recommendations().order_by('-priority_rank', '-created_at')[:20]
+        self.assertIn('rec_user_priority_idx', self.index_names(queryset))
@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
 from .views import HealthDataViewSet, RecommendationViewSet
 
 # Integrate router_v1 with HealthDataViewSet and RecommendationViewSet, keeping manual endpoints for action/summary
@@ -9,18 +10,39 @@ router_v1 = routers.DefaultRouter()
 router_v1.register('health-data', HealthDataViewSet)
 router_v1.register('recommendations', RecommendationViewSet)
 
+# Under ASGI the hot endpoints can be served by coroutine views instead
+if settings.HEALTH_ASYNC_VIEWS:
+    health_data_create = async_views.health_data_create
+    user_recommendations = async_views.user_recommendations
+    health_summary = async_views.health_summary
+else:
+    health_data_create = views.HealthDataCreateView.as_view()
+    user_recommendations = views.UserRecommendationsView.as_view()
+    health_summary = views.health_summary
+
 # Define URL patterns for the health app
 urlpatterns = [
     path('v1/', include(router_v1.urls)),
 
+    # Ingest endpoints
+    path('data/health', health_data_create, name='health-data-create'),
+    path('data/health/batch', views.HealthDataBatchCreateView.as_view(), name='health-data-batch'),
+    path('data/health/buffer', views.health_data_buffer_stats, name='health-data-buffer'),
+
     # User-specific endpoints
-    path('user/<int:user_id>/recommendations', views.UserRecommendationsView.as_view(), name='user-recommendations'),
+    path('user/<int:user_id>/recommendations', user_recommendations, name='user-recommendations'),
+    path('user/<int:user_id>/recommendations/counts', views.recommendation_counts, name='user-recommendation-counts'),
     path('user/<int:user_id>/health-data', views.UserHealthDataView.as_view(), name='user-health-data'),
+    path('user/<int:user_id>/health-data/export', views.UserHealthDataExportView.as_view(), name='user-health-data-export'),
+    path('user/<int:user_id>/recommendations/export', views.UserRecommendationsExportView.as_view(), name='user-recommendations-export'),
     path('user/<int:user_id>/profile', views.UserProfileView.as_view(), name='user-profile'),
-    path('user/<int:user_id>/health-summary', views.health_summary, name='user-health-summary'),
+    path('user/<int:user_id>/health-summary', health_summary, name='user-health-summary'),
 
     # Recommendation endpoints
     path('recommendations/<int:pk>', views.RecommendationDetailView.as_view(), name='recommendation-detail'),
     path('recommendations/<int:pk>/action', views.RecommendationActionView.as_view(), name='recommendation-action'),
     path('recommendations/create', views.create_recommendation, name='recommendation-create'),
+
+    # Operations
+    path('cache/stats', views.response_cache_stats, name='cache-stats'),
 ]
@@ -0,0 +1,143 @@
+"""
+Resolution of the ``user_id`` identifiers sent by the mobile app.
+
+An identifier is a username or, failing that, a numeric user ID. Resolving it
+used to cost up to two queries per record. ``resolve_user`` instead:
+
+1. returns the authenticated ``request.user`` when the identifier is its
+   username (no query, the common case for the app);
+2. looks the identifier up in a bounded in-process LRU cache with a TTL;
+3. otherwise runs one query that matches the username and the ID at once,
+   keeping the username-first precedence.
+
+Resolved users are partial instances (``id`` and ``username`` loaded, other
+fields deferred), which is all the ingest path needs. Cache entries are dropped
+when a user is saved or deleted in this process; other processes see such
+changes once the TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # identifier -> (expires_at, user_id, username)
+_identifiers_by_user = defaultdict(set)
+
+
+def _partial_user(user_id, username):
+    return User.from_db(DEFAULT_DB_ALIAS, ['id', 'username'], [user_id, username])
+
+
+def _forget(identifier):
+    _, user_id, _ = _entries.pop(identifier)
+    identifiers = _identifiers_by_user[user_id]
+    identifiers.discard(identifier)
+    if not identifiers:
+        del _identifiers_by_user[user_id]
+
+
+def _cached(identifier):
+    with _lock:
+        entry = _entries.get(identifier)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            _forget(identifier)
+            return None
+        _entries.move_to_end(identifier)
+        return entry
+
+
+def _remember(identifier, user_id, username):
+    with _lock:
+        if identifier in _entries:
+            _forget(identifier)
+        _entries[identifier] = (time.monotonic() + settings.HEALTH_USER_CACHE_TTL, user_id, username)
+        _identifiers_by_user[user_id].add(identifier)
+        while len(_entries) > settings.HEALTH_USER_CACHE_SIZE:
+            _forget(next(iter(_entries)))
+
+
+def invalidate_user(user_id, username=None):
+    """
+    Drop every cached identifier that resolves to ``user_id``, and ``username``
+    itself, which may now take precedence over a cached numeric ID.
+    """
+    with _lock:
+        for identifier in list(_identifiers_by_user.get(user_id, ())):
+            _forget(identifier)
+        if username is not None and username in _entries:
+            _forget(username)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _identifiers_by_user.clear()
+
+
+def resolve_user(identifier, request=None):
+    """Return the User for a username or numeric ID, or None if there is none."""
+    identifier = str(identifier)
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.get_username() == identifier:
+        return user
+
+    entry = _cached(identifier)
+    if entry is not None:
+        return _partial_user(entry[1], entry[2])
+
+    condition = Q(username=identifier)
+    if identifier.isdigit():
+        condition |= Q(id=int(identifier))
+    candidates = list(User.objects.filter(condition).only('id', 'username')[:2])
+    if not candidates:
+        return None
+
+    # Usernames take precedence over IDs, as in the original lookups
+    user = next((candidate for candidate in candidates if candidate.username == identifier), candidates[0])
+    _remember(identifier, user.id, user.username)
+    return user
+
+
+def resolve_users(identifiers):
+    """
+    Resolve many identifiers at once, e.g. for a bulk import.
+
+    Returns a dict mapping each identifier that names a user to that user's ID,
+    with the same username-first precedence as ``resolve_user``. Identifiers that
+    are not cached are looked up with one query.
+    """
+    resolved = {}
+    missing = set()
+    for identifier in map(str, identifiers):
+        entry = _cached(identifier)
+        if entry is not None:
+            resolved[identifier] = entry[1]
+        else:
+            missing.add(identifier)
+    if not missing:
+        return resolved
+
+    ids = {int(identifier) for identifier in missing if identifier.isdigit()}
+    users = list(User.objects.filter(Q(username__in=missing) | Q(id__in=ids)).values_list('id', 'username'))
+    by_username = {username: user_id for user_id, username in users}
+    by_id = {user_id: username for user_id, username in users}
+
+    for identifier in missing:
+        if identifier in by_username:
+            user_id = by_username[identifier]
+        elif identifier.isdigit() and int(identifier) in by_id:
+            user_id = int(identifier)
+        else:
+            continue
+        _remember(identifier, user_id, by_id[user_id])
+        resolved[identifier] = user_id
+    return resolved
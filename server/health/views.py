@@ -2,20 +2,43 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.db import transaction
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets
+from datetime import date
+import hmac
+import logging
 
-from .models import UserProfile, HealthData, Recommendation
+from .models import (
+    UserProfile, HealthData, HealthRollup, Recommendation, BufferedHealthData,
+    RecommendationCounter
+)
 from .serializers import (
     UserProfileSerializer, HealthDataSerializer, RecommendationSerializer,
     RecommendationListSerializer, RecommendationActionSerializer,
-    HealthDataCreateUpdateSerializer
+    HealthDataCreateUpdateSerializer, HealthDataBatchSerializer
+)
+from . import metrics, outbox
+from .tasks import process_health_data_batch, schedule_health_data_processing
+from .authentication import auth_cache_stats
+from .cache import cached_user_response, cache_stats
+from .exports import EXPORT_CONTENT_TYPES, export_health_data, export_recommendations
+from .fast_serializers import (
+    FastListMixin, HealthDataValuesSerializer, RecommendationValuesSerializer,
+    RecommendationListValuesSerializer
 )
-from .tasks import process_health_data_ai  # Will create this later
+from .pagination import (
+    KeysetPaginationMixin, HealthDataKeysetPagination, RecommendationKeysetPagination,
+    PrecountedPageNumberPagination
+)
+
+logger = logging.getLogger(__name__)
 
 
 class HealthDataCreateView(APIView):
@@ -28,28 +51,33 @@ class HealthDataCreateView(APIView):
     def post(self, request):
         """Create or update health data for a user."""
         try:
-            serializer = HealthDataCreateUpdateSerializer(data=request.data)
+            serializer = HealthDataCreateUpdateSerializer(data=request.data, context={'request': request})
+            
+            if serializer.is_valid() and settings.HEALTH_INGEST_MODE == 'buffered':
+                # Write-behind: the flusher task upserts buffered rows in bulk
+                serializer.enqueue()
+                return Response({
+                    'success': True,
+                    'message': 'Health data accepted for processing',
+                    'queued': True
+                }, status=status.HTTP_202_ACCEPTED)
             
             if serializer.is_valid():
                 with transaction.atomic():
                     health_data, created = serializer.save()
-                    
-                    # Trigger async AI processing
-                    try:
-                        process_health_data_ai.delay(health_data.id)
-                    except Exception as e:
-                        # Log error but don't fail the request
-                        print(f"Failed to trigger AI processing: {e}")
-                    
-                    # Prepare response
-                    response_serializer = HealthDataSerializer(health_data)
-                    
-                    return Response({
-                        'success': True,
-                        'message': 'Health data saved successfully' if created else 'Health data updated successfully',
-                        'data': response_serializer.data,
-                        'created': created
-                    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+                    # Outbox message in the same transaction: published by the relay once
+                    # committed; updates of the same day within the debounce window share one run
+                    schedule_health_data_processing(health_data.user_id, health_data.date)
+                
+                # Prepare response
+                response_serializer = HealthDataSerializer(health_data)
+                
+                return Response({
+                    'success': True,
+                    'message': 'Health data saved successfully' if created else 'Health data updated successfully',
+                    'data': response_serializer.data,
+                    'created': created
+                }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
             
             return Response({
                 'success': False,
@@ -57,68 +85,213 @@ class HealthDataCreateView(APIView):
                 'errors': serializer.errors
             }, status=status.HTTP_400_BAD_REQUEST)
             
-        except Exception as e:
+        except Exception:
+            logger.exception('Error saving health data')
+            return Response({
+                'success': False,
+                'message': 'Server error'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class HealthDataBatchCreateView(APIView):
+    """
+    POST /data/health/batch
+    Accept a batch of daily health records for one user (e.g. a Health Connect
+    backfill) and create/update them with a single upsert.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        """Create or update many days of health data for a user."""
+        try:
+            serializer = HealthDataBatchSerializer(data=request.data, context={'request': request})
+            
+            if not serializer.is_valid():
+                return Response({
+                    'success': False,
+                    'message': 'Invalid data provided',
+                    'errors': serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            with transaction.atomic():
+                results = serializer.save()
+                
+                saved_ids = [result['id'] for result in results if 'id' in result]
+                # AI processing once for the whole batch, through the outbox
+                if saved_ids:
+                    outbox.enqueue(process_health_data_batch, (saved_ids,))
+            
+            created_count = sum(1 for result in results if result['status'] == 'created')
+            updated_count = sum(1 for result in results if result['status'] == 'updated')
+            invalid_count = sum(1 for result in results if result['status'] == 'invalid')
+            
+            return Response({
+                'success': bool(saved_ids),
+                'message': f'{created_count} created, {updated_count} updated, {invalid_count} invalid',
+                'created_count': created_count,
+                'updated_count': updated_count,
+                'invalid_count': invalid_count,
+                'results': results
+            }, status=status.HTTP_200_OK if saved_ids else status.HTTP_400_BAD_REQUEST)
+            
+        except Exception:
+            logger.exception('Error saving health data batch')
             return Response({
                 'success': False,
-                'message': f'Server error: {str(e)}'
+                'message': 'Server error'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class UserRecommendationsView(generics.ListAPIView):
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def response_cache_stats(request):
+    """
+    GET /cache/stats
+    Report response and token cache hit/miss counters of this process.
+    """
+    return Response({
+        'success': True,
+        'cache': cache_stats(),
+        'auth': auth_cache_stats()
+    })
+
+
+@require_GET
+def prometheus_metrics(request):
+    """
+    GET /metrics
+    Request, database and Celery task metrics of all processes in the Prometheus text format.
+
+    Scrapers authenticate with ``Authorization: Bearer <HEALTH_METRICS_TOKEN>``
+    rather than a user token; without that setting the endpoint is disabled.
+    """
+    if not settings.HEALTH_METRICS_TOKEN:
+        raise Http404
+    keyword, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if keyword.lower() != 'bearer' or not hmac.compare_digest(
+        credentials.strip().encode(), settings.HEALTH_METRICS_TOKEN.encode()
+    ):
+        response = HttpResponse('Invalid metrics token.', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+        return response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def health_data_buffer_stats(request):
+    """
+    GET /data/health/buffer
+    Report write-behind buffer depth and lag for monitoring.
+    """
+    return Response({
+        'success': True,
+        'mode': settings.HEALTH_INGEST_MODE,
+        'buffer': BufferedHealthData.objects.stats()
+    })
+
+
+class UserRecommendationsView(FastListMixin, KeysetPaginationMixin, generics.ListAPIView):
     """
     GET /user/<id>/recommendations
-    Return list of recommendations for a specific user.
+    Return a page of recommendations for a specific user with summary counters.
+    Pass ?ordering=priority to sort by priority, ?pagination=keyset to page with cursors.
     """
     serializer_class = RecommendationListSerializer
+    fast_serializer_class = RecommendationListValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PrecountedPageNumberPagination
+    keyset_pagination_class = RecommendationKeysetPagination
     
     def get_queryset(self):
         """Get recommendations for the specified user."""
         user_id = self.kwargs['user_id']
         user = get_object_or_404(User, id=user_id)
-        
-        # Filter recommendations based on query parameters
-        queryset = Recommendation.objects.filter(user=user)
-        
-        # Filter by type if specified
-        rec_type = self.request.query_params.get('type')
-        if rec_type:
-            queryset = queryset.filter(type=rec_type)
-        
-        # Filter by read status
-        is_read = self.request.query_params.get('is_read')
-        if is_read is not None:
-            queryset = queryset.filter(is_read=is_read.lower() == 'true')
-        
-        # Filter by completion status
-        is_completed = self.request.query_params.get('is_completed')
-        if is_completed is not None:
-            queryset = queryset.filter(is_completed=is_completed.lower() == 'true')
-        
-        # Exclude expired recommendations by default
-        include_expired = self.request.query_params.get('include_expired', 'false')
-        if include_expired.lower() != 'true':
-            queryset = queryset.filter(expires_at__isnull=True) | queryset.filter(expires_at__gt=timezone.now())
-        
-        return queryset.order_by('-created_at')
+        return filter_recommendations(Recommendation.objects.filter(user=user), self.request.query_params)
     
     def list(self, request, *args, **kwargs):
-        """Override list to add extra context."""
+        """Serve the list through the per-user versioned cache."""
+        return cached_user_response(
+            'recommendations', request, self.kwargs['user_id'], self.build_list_response
+        )
+    
+    def build_list_response(self):
+        """Return one page plus total/unread/pending counters from a single aggregate."""
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        counts = queryset.counts()
         
-        # Add summary statistics
-        total_count = queryset.count()
-        unread_count = queryset.filter(is_read=False).count()
-        pending_count = queryset.filter(is_completed=False).count()
+        if isinstance(self.paginator, PrecountedPageNumberPagination):
+            self.paginator.known_count = counts['count']
         
-        return Response({
-            'success': True,
-            'count': total_count,
-            'unread_count': unread_count,
-            'pending_count': pending_count,
-            'results': serializer.data
-        })
+        page = self.paginate_queryset(self.get_list_rows(queryset))
+        response = self.get_paginated_response(self.serialize_list(page))
+        return add_recommendation_counts(response, counts, self.request.query_params)
+
+
+def filter_recommendations(queryset, query_params):
+    """Apply the recommendation list filters and ordering from ``query_params``."""
+    # Filter by type if specified
+    rec_type = query_params.get('type')
+    if rec_type:
+        queryset = queryset.filter(type=rec_type)
+    
+    # Filter by read status
+    is_read = query_params.get('is_read')
+    if is_read is not None:
+        queryset = queryset.filter(is_read=is_read.lower() == 'true')
+    
+    # Filter by completion status
+    is_completed = query_params.get('is_completed')
+    if is_completed is not None:
+        queryset = queryset.filter(is_completed=is_completed.lower() == 'true')
+    
+    # Exclude expired recommendations by default
+    include_expired = query_params.get('include_expired', 'false')
+    if include_expired.lower() != 'true':
+        queryset = queryset.active()
+    
+    # Order by priority rank if requested, newest first otherwise
+    if query_params.get('ordering') == 'priority':
+        return queryset.by_priority()
+    return queryset.order_by('-created_at')
+
+
+def add_recommendation_counts(response, counts, query_params):
+    """Add the counters to a paginated recommendations response."""
+    response.data.update({
+        'success': True,
+        'count': counts['count'],
+        'unread_count': counts['unread_count'],
+        'pending_count': counts['pending_count'],
+    })
+    
+    # Expiry changes the list without a write, so cached copies must not outlive it
+    include_expired = query_params.get('include_expired', 'false')
+    if counts['next_expiry'] and include_expired.lower() != 'true':
+        response.cache_timeout = int((counts['next_expiry'] - timezone.now()).total_seconds())
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def recommendation_counts(request, user_id):
+    """
+    GET /user/<id>/recommendations/counts
+    Return unread/pending badge counts for a user from the counter table.
+    """
+    user = get_object_or_404(User, id=user_id)
+    
+    if not settings.HEALTH_RECOMMENDATION_COUNTERS:
+        counts = Recommendation.objects.filter(user=user).active().counts()
+    else:
+        counter = RecommendationCounter.objects.for_user(user.id)
+        counts = {'unread_count': counter.unread_count, 'pending_count': counter.pending_count}
+    
+    return Response({
+        'success': True,
+        'unread_count': counts['unread_count'],
+        'pending_count': counts['pending_count']
+    })
 
 
 class RecommendationDetailView(generics.RetrieveUpdateAPIView):
@@ -126,7 +299,7 @@ class RecommendationDetailView(generics.RetrieveUpdateAPIView):
     GET/PUT /recommendations/<id>
     Retrieve or update a specific recommendation.
     """
-    queryset = Recommendation.objects.all()
+    queryset = Recommendation.objects.with_user_name()
     serializer_class = RecommendationSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -147,7 +320,7 @@ class RecommendationActionView(APIView):
     
     def post(self, request, pk):
         """Perform action on recommendation."""
-        recommendation = get_object_or_404(Recommendation, id=pk, user=request.user)
+        recommendation = get_object_or_404(Recommendation.objects.with_user_name(), id=pk, user=request.user)
         serializer = RecommendationActionSerializer(data=request.data)
         
         if serializer.is_valid():
@@ -179,20 +352,23 @@ class RecommendationActionView(APIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserHealthDataView(generics.ListAPIView):
+class UserHealthDataView(FastListMixin, KeysetPaginationMixin, generics.ListAPIView):
     """
     GET /user/<id>/health-data
     Get health data history for a user.
+    Pass ?pagination=keyset to page through it with cursors.
     """
     serializer_class = HealthDataSerializer
+    fast_serializer_class = HealthDataValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_pagination_class = HealthDataKeysetPagination
     
     def get_queryset(self):
         """Get health data for the specified user."""
         user_id = self.kwargs['user_id']
         user = get_object_or_404(User, id=user_id)
         
-        queryset = HealthData.objects.filter(user=user)
+        queryset = HealthData.objects.with_user().filter(user=user)
         
         # Filter by date range if provided
         start_date = self.request.query_params.get('start_date')
@@ -206,6 +382,48 @@ class UserHealthDataView(generics.ListAPIView):
         return queryset.order_by('-date')
 
 
+class UserHealthDataExportView(APIView):
+    """
+    GET /user/<id>/health-data/export?output=ndjson|csv
+    Stream a user's full health data history in one response.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    export = staticmethod(export_health_data)
+    
+    def get(self, request, user_id):
+        """Stream the export, honouring start_date/end_date filters."""
+        user = get_object_or_404(User, id=user_id)
+        
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in EXPORT_CONTENT_TYPES:
+            return Response({
+                'success': False,
+                'message': f"Unsupported output '{export_format}', use one of: {', '.join(EXPORT_CONTENT_TYPES)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Parsed up front: the rows are only read once the 200 has been sent
+        bounds = {}
+        for param in ('start_date', 'end_date'):
+            value = request.query_params.get(param)
+            try:
+                bounds[param] = date.fromisoformat(value) if value else None
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'message': f"Invalid {param} '{value}', use YYYY-MM-DD"
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return self.export(user, export_format, **bounds)
+
+
+class UserRecommendationsExportView(UserHealthDataExportView):
+    """
+    GET /user/<id>/recommendations/export?output=ndjson|csv
+    Stream a user's full recommendation history in one response.
+    """
+    export = staticmethod(export_recommendations)
+
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     """
     GET/PUT /user/<id>/profile
@@ -228,44 +446,62 @@ def health_summary(request, user_id):
     """
     GET /user/<id>/health-summary
     Get aggregated health data summary for a user.
+    Averages and activity distribution come from the 30-day HealthRollup.
     """
+    # The 30-day window moves daily, so today's date is part of the cache key
+    return cached_user_response(
+        'health-summary', request, user_id,
+        lambda: build_health_summary(user_id),
+        key_parts=[date.today()]
+    )
+
+
+def build_health_summary(user_id):
+    """Build the health_summary response."""
     user = get_object_or_404(User, id=user_id)
     
-    # Get recent health data (last 30 days)
-    from datetime import date, timedelta
-    recent_data = HealthData.objects.filter(
-        user=user,
-        date__gte=date.today() - timedelta(days=30)
-    ).order_by('-date')
+    # Recent health data (last 30 days)
+    rollup = HealthRollup.objects.current(user.id, 30)
     
-    if not recent_data.exists():
+    if not rollup.days:
         return Response({
             'success': True,
             'message': 'No recent health data found',
             'summary': {}
         })
     
-    # Calculate summary statistics
-    total_days = recent_data.count()
-    avg_steps = recent_data.aggregate(avg=models.Avg('steps'))['avg'] or 0
-    avg_sleep = recent_data.aggregate(avg=models.Avg('sleep_hours'))['avg'] or 0
-    avg_heart_rate = recent_data.aggregate(avg=models.Avg('heart_rate_avg'))['avg'] or 0
-    
     # Get latest data
-    latest_data = recent_data.first()
+    latest_data = HealthData.objects.filter(
+        user=user,
+        date__gte=rollup.start_date
+    ).order_by('-date').first()
+    
+    if settings.HEALTH_RECOMMENDATION_COUNTERS:
+        recommendations_count = RecommendationCounter.objects.for_user(user.id).unread_count
+    else:
+        recommendations_count = Recommendation.objects.filter(user=user, is_read=False).count()
     
+    return Response({
+        'success': True,
+        'summary': summarize_health(user_id, rollup, latest_data, recommendations_count)
+    })
+
+
+def summarize_health(user_id, rollup, latest_data, recommendations_count):
+    """Build the health_summary ``summary`` object from a non-empty rollup."""
     # Get activity level distribution
-    from django.db import models
-    activity_distribution = recent_data.values('activity_level').annotate(
-        count=models.Count('activity_level')
-    ).order_by('-count')
+    activity_distribution = [
+        {'activity_level': level, 'count': count}
+        for level, count in sorted(rollup.activity_counts.items(), key=lambda item: -item[1])
+    ]
     
-    summary = {
+    avg_heart_rate = rollup.avg_heart_rate
+    return {
         'user_id': user_id,
-        'period_days': total_days,
+        'period_days': rollup.days,
         'averages': {
-            'steps': round(avg_steps, 0),
-            'sleep_hours': round(avg_sleep, 2),
+            'steps': round(rollup.avg_steps, 0),
+            'sleep_hours': round(rollup.avg_sleep_hours, 2),
             'heart_rate_avg': round(avg_heart_rate, 0) if avg_heart_rate else None,
         },
         'latest': {
@@ -276,17 +512,9 @@ def health_summary(request, user_id):
             'activity_level': latest_data.activity_level,
             'activity_score': latest_data.activity_score,
         },
-        'activity_distribution': list(activity_distribution),
-        'recommendations_count': Recommendation.objects.filter(
-            user=user, 
-            is_read=False
-        ).count()
+        'activity_distribution': activity_distribution,
+        'recommendations_count': recommendations_count
     }
-    
-    return Response({
-        'success': True,
-        'summary': summary
-    })
 
 
 @api_view(['POST'])
@@ -299,12 +527,18 @@ def create_recommendation(request):
     serializer = RecommendationSerializer(data=request.data)
     
     if serializer.is_valid():
-        recommendation = serializer.save()
+        # Upserted by fingerprint, which hashes the title and content: a repeated
+        # request refreshes the recommendation, a different one is created
+        [(recommendation_id, _, day, created)] = Recommendation.objects.upsert(
+            [Recommendation(**serializer.validated_data)]
+        )
+        recommendation = Recommendation.objects.with_user_name().get(id=recommendation_id, date=day)
         return Response({
             'success': True,
-            'message': 'Recommendation created successfully',
-            'data': RecommendationSerializer(recommendation).data
-        }, status=status.HTTP_201_CREATED)
+            'message': 'Recommendation created successfully' if created else 'Recommendation updated successfully',
+            'data': RecommendationSerializer(recommendation).data,
+            'created': created
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
     return Response({
         'success': False,
@@ -312,13 +546,17 @@ def create_recommendation(request):
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class HealthDataViewSet(viewsets.ModelViewSet):
-    queryset = HealthData.objects.all()
+class HealthDataViewSet(FastListMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
+    queryset = HealthData.objects.with_user()
     serializer_class = HealthDataSerializer
+    fast_serializer_class = HealthDataValuesSerializer
+    keyset_pagination_class = HealthDataKeysetPagination
     # Можно добавить фильтрацию по пользователю, дате и т.д.
 
 
-class RecommendationViewSet(viewsets.ModelViewSet):
-    queryset = Recommendation.objects.all()
+class RecommendationViewSet(FastListMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
+    queryset = Recommendation.objects.with_user_name()
     serializer_class = RecommendationSerializer
+    fast_serializer_class = RecommendationValuesSerializer
+    keyset_pagination_class = RecommendationKeysetPagination
     # Можно добавить фильтрацию по пользователю, типу и т.д.
@@ -1,5 +1,7 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
+from django.conf import settings
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'synaptica.settings')
@@ -23,6 +25,22 @@ app.conf.beat_schedule = {
         'task': 'health.tasks.batch_process_health_data',
         'schedule': 3600.0,  # Run hourly
     },
+    'flush-health-data-buffer': {
+        'task': 'health.tasks.flush_health_data_buffer',
+        'schedule': settings.HEALTH_INGEST_FLUSH_INTERVAL,
+    },
+    'relay-outbox': {
+        'task': 'health.tasks.relay_outbox',
+        'schedule': settings.HEALTH_OUTBOX_RELAY_INTERVAL,
+    },
+    'schedule-weekly-summaries': {
+        'task': 'health.tasks.schedule_weekly_summaries',
+        'schedule': crontab(minute=0),  # Run hourly, on the hour (local report times)
+    },
+    'maintain-partitions': {
+        'task': 'health.tasks.maintain_partitions',
+        'schedule': 86400.0,  # Run daily
+    },
 }
 
 app.conf.timezone = 'UTC'
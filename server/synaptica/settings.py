@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'health.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,7 +96,7 @@ DATABASES = {
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'health.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -116,6 +117,21 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Cache: Redis when CACHE_URL is set, otherwise in-process memory (dev/tests)
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Celery Configuration (for async tasks)
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -123,6 +139,95 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Health data ingest
+HEALTH_DATA_BATCH_MAX_RECORDS = int(os.getenv('HEALTH_DATA_BATCH_MAX_RECORDS', '366'))
+# 'direct' writes on every request, 'buffered' queues writes for the flusher task
+HEALTH_INGEST_MODE = os.getenv('HEALTH_INGEST_MODE', 'direct')
+HEALTH_INGEST_FLUSH_INTERVAL = float(os.getenv('HEALTH_INGEST_FLUSH_INTERVAL', '5'))  # seconds
+HEALTH_INGEST_FLUSH_BATCH_SIZE = int(os.getenv('HEALTH_INGEST_FLUSH_BATCH_SIZE', '5000'))
+# In-process cache of resolved user_id identifiers (username or ID)
+HEALTH_USER_CACHE_SIZE = int(os.getenv('HEALTH_USER_CACHE_SIZE', '10000'))
+HEALTH_USER_CACHE_TTL = float(os.getenv('HEALTH_USER_CACHE_TTL', '300'))  # seconds
+
+# Token authentication cache: in-process LRU (short TTL) over the shared cache
+HEALTH_AUTH_CACHE_SIZE = int(os.getenv('HEALTH_AUTH_CACHE_SIZE', '10000'))
+HEALTH_AUTH_CACHE_LOCAL_TTL = float(os.getenv('HEALTH_AUTH_CACHE_LOCAL_TTL', '5'))  # seconds
+HEALTH_AUTH_CACHE_TTL = int(os.getenv('HEALTH_AUTH_CACHE_TTL', '60'))  # seconds
+
+# Maintain per-user unread/pending recommendation counters for badge counts
+HEALTH_RECOMMENDATION_COUNTERS = os.getenv('HEALTH_RECOMMENDATION_COUNTERS', 'True').lower() == 'true'
+
+# Versioned response cache for summaries and recommendation lists
+HEALTH_CACHE_ALIAS = os.getenv('HEALTH_CACHE_ALIAS', 'default')
+HEALTH_CACHE_TIMEOUT = int(os.getenv('HEALTH_CACHE_TIMEOUT', '86400'))  # seconds, only reclaims memory
+
+# Recommendation rules: optional JSON ruleset replacing the built-in one
+HEALTH_RULESET_PATH = os.getenv('HEALTH_RULESET_PATH') or None
+HEALTH_RULES_CHUNK_SIZE = int(os.getenv('HEALTH_RULES_CHUNK_SIZE', '5000'))
+# Hourly sweep: health data IDs per task, and tasks enqueued to the outbox per transaction
+HEALTH_BATCH_PROCESS_CHUNK_SIZE = int(os.getenv('HEALTH_BATCH_PROCESS_CHUNK_SIZE', '1000'))
+HEALTH_BATCH_PROCESS_GROUP_SIZE = int(os.getenv('HEALTH_BATCH_PROCESS_GROUP_SIZE', '50'))
+# AI processing per user-day: seconds a run waits for further updates of the same day
+HEALTH_AI_DEBOUNCE_SECONDS = int(os.getenv('HEALTH_AI_DEBOUNCE_SECONDS', '30'))
+
+# Anomaly recommendations: whether rule processing adds them, days in the rolling
+# baseline, fewest days with data a baseline needs, |z-score| flagged, EWMA span
+HEALTH_ANOMALY_DETECTION = os.getenv('HEALTH_ANOMALY_DETECTION', 'False').lower() == 'true'
+HEALTH_ANOMALY_WINDOW_DAYS = int(os.getenv('HEALTH_ANOMALY_WINDOW_DAYS', '30'))
+HEALTH_ANOMALY_MIN_DAYS = int(os.getenv('HEALTH_ANOMALY_MIN_DAYS', '14'))
+HEALTH_ANOMALY_Z_THRESHOLD = float(os.getenv('HEALTH_ANOMALY_Z_THRESHOLD', '2.0'))
+HEALTH_ANOMALY_EWMA_SPAN = int(os.getenv('HEALTH_ANOMALY_EWMA_SPAN', '7'))
+
+# Task outbox relay: beat interval (seconds), messages per publish batch, and the
+# longest retry backoff (seconds) after a failed publish
+HEALTH_OUTBOX_RELAY_INTERVAL = float(os.getenv('HEALTH_OUTBOX_RELAY_INTERVAL', '2'))
+HEALTH_OUTBOX_BATCH_SIZE = int(os.getenv('HEALTH_OUTBOX_BATCH_SIZE', '500'))
+HEALTH_OUTBOX_MAX_BACKOFF = int(os.getenv('HEALTH_OUTBOX_MAX_BACKOFF', '300'))
+
+# Weekly summaries: local hour and weekday (0 = Monday) users get them at, users
+# per queued chunk, seconds between chunks becoming due, the Celery rate limit of
+# chunk tasks, and how many missed hours a late scheduler run catches up on
+HEALTH_WEEKLY_SUMMARY_HOUR = int(os.getenv('HEALTH_WEEKLY_SUMMARY_HOUR', '8'))
+HEALTH_WEEKLY_SUMMARY_WEEKDAY = int(os.getenv('HEALTH_WEEKLY_SUMMARY_WEEKDAY', '0'))
+HEALTH_REPORT_CHUNK_SIZE = int(os.getenv('HEALTH_REPORT_CHUNK_SIZE', '500'))
+HEALTH_REPORT_CHUNK_INTERVAL = float(os.getenv('HEALTH_REPORT_CHUNK_INTERVAL', '2'))
+HEALTH_REPORT_RATE_LIMIT = os.getenv('HEALTH_REPORT_RATE_LIMIT', '30/m')
+HEALTH_REPORT_CATCH_UP_HOURS = int(os.getenv('HEALTH_REPORT_CATCH_UP_HOURS', '24'))
+# Weekly summaries upserted per statement by the set-based writer
+HEALTH_REPORT_WRITE_CHUNK_SIZE = int(os.getenv('HEALTH_REPORT_WRITE_CHUNK_SIZE', '1000'))
+
+# Expiry cleanup: rows per delete batch, seconds to pause between batches, and
+# where deleted rows go: 'table', 'none', or a .jsonl / .jsonl.gz file path
+HEALTH_CLEANUP_BATCH_SIZE = int(os.getenv('HEALTH_CLEANUP_BATCH_SIZE', '5000'))
+HEALTH_CLEANUP_BATCH_PAUSE = float(os.getenv('HEALTH_CLEANUP_BATCH_PAUSE', '0'))
+HEALTH_CLEANUP_ARCHIVE = os.getenv('HEALTH_CLEANUP_ARCHIVE', 'table')
+
+# Monthly partitions of health_data and recommendations: months created ahead,
+# months kept (unset keeps everything), and whether expired partitions are dropped
+HEALTH_PARTITION_MONTHS_AHEAD = int(os.getenv('HEALTH_PARTITION_MONTHS_AHEAD', '3'))
+HEALTH_PARTITION_RETENTION_MONTHS = int(os.getenv('HEALTH_PARTITION_RETENTION_MONTHS', '0')) or None
+HEALTH_PARTITION_DROP_DETACHED = os.getenv('HEALTH_PARTITION_DROP_DETACHED', 'False').lower() == 'true'
+
+# Serve read-only list endpoints from values() rows instead of DRF serializers (opt-in)
+HEALTH_FAST_LIST_SERIALIZERS = os.getenv('HEALTH_FAST_LIST_SERIALIZERS', 'False').lower() == 'true'
+
+# Serve ingest, health summary and recommendation lists from async views (ASGI only)
+HEALTH_ASYNC_VIEWS = os.getenv('HEALTH_ASYNC_VIEWS', 'False').lower() == 'true'
+
+# Metrics: queries per request above which it is flagged, and how often (seconds)
+# processes publish their metrics to the shared cache / how long snapshots live
+HEALTH_METRICS_QUERY_BUDGET = int(os.getenv('HEALTH_METRICS_QUERY_BUDGET', '20'))
+HEALTH_METRICS_PUBLISH_INTERVAL = int(os.getenv('HEALTH_METRICS_PUBLISH_INTERVAL', '15'))
+HEALTH_METRICS_PROCESS_TTL = int(os.getenv('HEALTH_METRICS_PROCESS_TTL', '300'))
+# Bearer secret Prometheus sends to scrape /metrics; the endpoint is disabled when empty
+HEALTH_METRICS_TOKEN = os.getenv('HEALTH_METRICS_TOKEN', '')
+
+# Bulk imports: records validated, staged and merged per transaction
+HEALTH_IMPORT_CHUNK_SIZE = int(os.getenv('HEALTH_IMPORT_CHUNK_SIZE', '20000'))
+
+# Streaming exports: rows fetched per server-side cursor round trip
+HEALTH_EXPORT_CHUNK_SIZE = int(os.getenv('HEALTH_EXPORT_CHUNK_SIZE', '2000'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
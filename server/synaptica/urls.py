@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
 
+from health.views import prometheus_metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
@@ -26,4 +28,7 @@ urlpatterns = [
     
     # Authentication
     path('api/auth/token/', obtain_auth_token, name='api_token_auth'),
+    
+    # Prometheus scrape target
+    path('metrics', prometheus_metrics, name='metrics'),
 ]